@@ -0,0 +1,278 @@
+"""Background acquisition pipeline for runs of back to back listens.
+
+    A reader thread is the only thing talking to the EchoRecorder, it pushes
+    each capture into a bounded queue. A writer thread saves the frames and then
+    offers them to an optional plot stage that only keeps the newest frame, so a
+    slow disk or a slow redraw never holds up the next ping. When the writer
+    falls behind far enough to fill the queue the reader blocks, that
+    backpressure is counted so it shows up in the stats. If write_fun raises
+    the error is kept and the whole pipeline stops instead of leaving the
+    reader stuck on a queue nobody empties.
+    
+    Given an emitter the reader runs a bb_ping.PingCycle instead, every capture
+    then starts with a chirp and the frame carries the emit timing.
+    """
+
+import threading
+import queue
+import time
+import numpy as np
+
+import bb_listener
+import bb_ping
+from bb_stereo import StereoCapture
+
+
+class AcqFrame:
+    """One ping handed through the pipeline, the capture is a view into the
+    recorder's capture ring. Frames offered to the plot stage are copies.
+    """
+    __slots__ = ('index','timestamp','capture','emit_offset')
+
+    def __init__(self,index:int,timestamp:float,capture:StereoCapture,emit_offset:float = None) -> None:
+        self.index = index
+        self.timestamp = timestamp
+        self.capture = capture
+        # seconds from START_LISTEN to EMIT_CHIRP on the host, None when nothing was emitted
+        self.emit_offset = emit_offset
+
+    @property
+    def left(self)->np.uint16:
+        return self.capture.left
+
+    @property
+    def right(self)->np.uint16:
+        return self.capture.right
+
+
+class AcquisitionPipeline:
+
+    def __init__(self,recorder:bb_listener.EchoRecorder,listen_time_ms:int,num_pings:int,
+                 write_fun = None,queue_len:int = 16,plot_every:int = 0,emitter = None,emit_delay_bursts:int = 0,
+                 put_poll_s:float = 0.1) -> None:
+        """Creates the pipeline, nothing runs until start()
+
+        Args:
+            recorder (bb_listener.EchoRecorder): listener to read from
+            listen_time_ms (int): time to listen for each ping
+            num_pings (int): pings to take, None runs until stop()
+            write_fun (callable, optional): called as write_fun(frame) on the writer thread. Defaults to None.
+            queue_len (int, optional): frames that can wait for the writer before the reader blocks. Defaults to 16.
+            plot_every (int, optional): offer every Nth frame to the plot stage, 0 turns plotting off. Defaults to 0.
+            emitter (bb_emitter.EchoEmitter, optional): chirp at the start of every capture. Defaults to None.
+            emit_delay_bursts (int, optional): see bb_ping.PingCycle. Defaults to 0.
+            put_poll_s (float, optional): how often a reader blocked on a full queue checks
+                for stop() or a dead writer. Defaults to 0.1.
+        """
+        self.recorder = recorder
+        self.listen_time_ms = listen_time_ms
+        self.num_pings = num_pings
+        self.write_fun = write_fun
+        self.queue_len = queue_len
+        self.plot_every = plot_every
+        self.emitter = emitter
+        self.emit_delay_bursts = emit_delay_bursts
+        self.put_poll_s = put_poll_s
+        # PingCycle.stats() once the reader is done, None without an emitter
+        self.ping_stats = None
+
+        # frames are views into the ring, it has to cover the slot being read, the queue,
+        # the frame held while the queue is full and the frame being written. The plot
+        # stage gets copies. Only applied to the recorder while the reader runs
+        self.ring_slots = max(self.recorder.ring_slots,queue_len + 4)
+
+        self.write_q = queue.Queue(maxsize=queue_len)
+        self.plot_q = queue.Queue(maxsize=1)
+        self.stop_event = threading.Event()
+
+        self.reader_thread = threading.Thread(target=self._reader,daemon=True)
+        self.writer_thread = threading.Thread(target=self._writer,daemon=True)
+
+        # counters
+        self.captured = 0
+        self.written = 0
+        self.dropped = 0
+        self.plot_offered = 0
+        self.plot_dropped = 0
+        self.backpressure_events = 0
+        self.backpressure_time = 0.0
+        self.max_queue_depth = 0
+        self.write_time = 0.0
+        self.listen_rate = 0.0
+        self.error = None
+
+    def start(self)->None:
+        self.reader_thread.start()
+        self.writer_thread.start()
+
+    def stop(self)->None:
+        """Asks the reader to stop after the current ping, the writer still
+        saves everything already in the queue. A frame the reader is holding
+        while it waits for room in the queue is dropped.
+        """
+        self.stop_event.set()
+
+    def join(self,timeout:float = None)->None:
+        self.reader_thread.join(timeout)
+        self.writer_thread.join(timeout)
+
+    def is_running(self)->bool:
+        return self.reader_thread.is_alive() or self.writer_thread.is_alive()
+
+    def get_plot_frame(self,timeout:float = 0.0)->AcqFrame:
+        """Newest frame waiting for the plot stage
+
+        Args:
+            timeout (float, optional): time to wait for a frame. Defaults to 0.0.
+
+        Returns:
+            AcqFrame: the frame or None if nothing new arrived
+        """
+        try:
+            if timeout > 0:
+                return self.plot_q.get(timeout=timeout)
+            return self.plot_q.get_nowait()
+        except queue.Empty:
+            return None
+
+    def stats(self)->dict:
+        """Snapshot of the pipeline counters
+
+        Returns:
+            dict: counters, times are in seconds
+        """
+        return {
+            'captured': self.captured,
+            'written': self.written,
+            'dropped': self.dropped,
+            'queue_depth': self.write_q.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'backpressure_events': self.backpressure_events,
+            'backpressure_time': self.backpressure_time,
+            'plot_offered': self.plot_offered,
+            'plot_dropped': self.plot_dropped,
+            'mean_write_time': self.write_time/self.written if self.written else 0.0,
+            'listen_rate': self.listen_rate,
+            'ping_stats': self.ping_stats,
+            'error': self.error,
+        }
+
+    def _reader(self)->None:
+        caller_slots = self.recorder.ring_slots
+        self.recorder.ring_slots = self.ring_slots
+        if self.emitter is None:
+            source = self.recorder.session()
+        else:
+            source = bb_ping.PingCycle(self.emitter,self.recorder,self.listen_time_ms,self.emit_delay_bursts)
+        try:
+            with source:
+                if not source.connected:
+                    self.error = "listener not responding" if self.emitter is None else "listener or emitter not responding"
+                    return
+
+                count = 0
+                while not self.stop_event.is_set():
+                    if self.num_pings is not None and count >= self.num_pings:
+                        break
+
+                    frame = self._next_frame(source,count)
+                    if frame is None:
+                        self.error = "listen failed"
+                        break
+
+                    try:
+                        self.write_q.put_nowait(frame)
+                    except queue.Full:
+                        # writer is behind, wait for it and count how long
+                        self.backpressure_events += 1
+                        blocked = time.perf_counter()
+                        queued = self._put(frame,until_stopped=True)
+                        self.backpressure_time += time.perf_counter() - blocked
+                        if not queued:
+                            self.dropped += 1
+                            break
+
+                    self.max_queue_depth = max(self.max_queue_depth,self.write_q.qsize())
+                    self.captured += 1
+                    self.listen_rate = source.cycles_per_second()
+                    count += 1
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            # once per run, not per ping
+            if self.emitter is not None:
+                self.ping_stats = source.stats()
+            # the ring itself stays until the recorder's next get_ring, frames still queued are fine
+            self.recorder.ring_slots = caller_slots
+            # tells the writer nothing else is coming
+            self._put(None,until_stopped=False)
+
+    def _put(self,item,until_stopped:bool)->bool:
+        """Blocking put that gives up once the writer is gone, or on stop() if until_stopped
+
+        Returns:
+            bool: true if item went into the queue
+        """
+        while True:
+            try:
+                self.write_q.put(item,timeout=self.put_poll_s)
+                return True
+            except queue.Full:
+                if not self.writer_thread.is_alive():
+                    return False
+                if until_stopped and self.stop_event.is_set():
+                    return False
+
+    def _next_frame(self,source,count:int)->AcqFrame:
+        """One capture from a ListenSession or a PingCycle"""
+        if self.emitter is not None:
+            ping = source.ping()
+            if ping is None:
+                return None
+            return AcqFrame(count,ping.timestamp,ping.capture,ping.emit_offset)
+
+        ret = source.listen(self.listen_time_ms)
+        if ret is None:
+            return None
+        capture = self.recorder.to_capture(ret[0])
+        return AcqFrame(count,time.time(),capture)
+
+    def _writer(self)->None:
+        while True:
+            frame = self.write_q.get()
+            if frame is None:
+                break
+
+            if self.write_fun is not None:
+                start = time.perf_counter()
+                try:
+                    self.write_fun(frame)
+                except Exception as e:
+                    # nothing else can be saved, stop the reader too
+                    self.error = f"write failed: {e}"
+                    self.stop_event.set()
+                    break
+                self.write_time += time.perf_counter() - start
+            self.written += 1
+
+            if self.plot_every and frame.index % self.plot_every == 0:
+                self._offer_plot(frame)
+
+    def _offer_plot(self,frame:AcqFrame)->None:
+        """Puts a copy of the frame in the plot slot, replacing whatever the plot stage has not picked up yet.
+        The plot stage can hold on to it as long as it likes, the ring slot gets reused
+        """
+        self.plot_offered += 1
+        frame = AcqFrame(frame.index,frame.timestamp,frame.capture.copy(),frame.emit_offset)
+        try:
+            self.plot_q.put_nowait(frame)
+        except queue.Full:
+            try:
+                self.plot_q.get_nowait()
+                self.plot_dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self.plot_q.put_nowait(frame)
+            except queue.Full:
+                self.plot_dropped += 1
@@ -0,0 +1,340 @@
+"""Acquisition benchmarks against the simulated boards in bb_sim
+
+    Runs the real host code (EchoRecorder, ListenSession, PingCycle,
+    EchoEmitter.upload_chirp, ser_utils framing) over ptys and reports
+    pings/s, upload MB/s and latency percentiles per stage in ms. Results can
+    be saved as json and compared against an earlier run, any rate that fell
+    or latency that grew by more than the tolerance is a regression and the
+    exit code is 1.
+
+        python bb_bench.py --json base.json
+        python bb_bench.py --compare base.json -t 0.2
+    """
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+from collections import defaultdict
+import numpy as np
+from serial import Serial
+
+import bb_listener
+import bb_emitter
+import bb_ping
+import bb_sim
+import ser_utils
+import emit
+from bb_listener import t_colors
+
+PERCENTILES = (50,90,99)
+
+
+def latency_summary(samples:list)->dict:
+    """Percentiles, mean and max of durations in seconds, reported in ms"""
+    ms = np.asarray(samples,dtype=np.float64)*1e3
+    if len(ms) == 0:
+        return {}
+    summary = {f"p{p}": float(np.percentile(ms,p)) for p in PERCENTILES}
+    summary['mean'] = float(np.mean(ms))
+    summary['max'] = float(np.max(ms))
+    return summary
+
+
+class StageTimes:
+    """Durations per named stage of a benchmark"""
+
+    def __init__(self) -> None:
+        self.samples = defaultdict(list)
+
+    def add(self,stage:str,seconds:float)->None:
+        self.samples[stage].append(seconds)
+
+    def summary(self)->dict:
+        return {stage: latency_summary(samples) for stage,samples in self.samples.items()}
+
+
+def _quiet():
+    # the emitter prints progress and status on every upload
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def bench_listen(pings:int = 100,listen_time_ms:int = 30,realtime:bool = False)->dict:
+    """Back to back listens on one ListenSession, split into the steps it takes
+
+    Args:
+        pings (int, optional): listens to time. Defaults to 100.
+        listen_time_ms (int, optional): listen time of each. Defaults to 30.
+        realtime (bool, optional): stream at the ADC rate instead of as fast as possible. Defaults to False.
+
+    Returns:
+        dict: rates and latency_ms per stage
+    """
+    times = StageTimes()
+    with bb_sim.SimTeensy(realtime=realtime) as teensy:
+        recorder = bb_listener.EchoRecorder(Serial(teensy.port))
+        with recorder.session() as session:
+            if not session.connected:
+                return {'error': "listener not responding"}
+            captured = 0
+            capture_time = 0.0
+            start = time.perf_counter()
+            for i in range(pings):
+                t0 = time.perf_counter()
+                raw = recorder._capture(listen_time_ms)
+                t1 = time.perf_counter()
+                recorder._drain_input(session.drain_quiet_s,session.max_drain_s)
+                t2 = time.perf_counter()
+                recorder.to_capture(raw)
+                t3 = time.perf_counter()
+
+                times.add('capture',t1 - t0)
+                times.add('drain',t2 - t1)
+                times.add('split',t3 - t2)
+                times.add('cycle',t3 - t0)
+                captured += raw.nbytes
+                capture_time += t1 - t0
+            elapsed = time.perf_counter() - start
+        recorder.disconnect_serial()
+
+    return {
+        'rates': {
+            'pings_per_second': pings/elapsed,
+            'stream_mb_per_second': captured/capture_time/1e6,
+        },
+        'latency_ms': times.summary(),
+    }
+
+
+def bench_ping(pings:int = 100,listen_time_ms:int = 30,emit_delay_bursts:int = 0,realtime:bool = False)->dict:
+    """PingCycle with both boards, board_skew is the emitter seeing EMIT_CHIRP minus the
+    listener seeing START_LISTEN, what the capture actually records
+
+    Args:
+        pings (int, optional): pings to time. Defaults to 100.
+        listen_time_ms (int, optional): listen time of each. Defaults to 30.
+        emit_delay_bursts (int, optional): see PingCycle. Defaults to 0.
+        realtime (bool, optional): see bench_listen. Defaults to False.
+
+    Returns:
+        dict: rates and latency_ms per stage
+    """
+    times = StageTimes()
+    with bb_sim.SimTeensy(realtime=realtime) as teensy, bb_sim.SimItsy() as itsy:
+        recorder = bb_listener.EchoRecorder(Serial(teensy.port))
+        with _quiet():
+            emitter = bb_emitter.EchoEmitter(Serial(itsy.port))
+            chirp,_ = emitter.gen_chirp(100e3,30e3,3)
+            emitter.upload_chirp(chirp)
+
+        with bb_ping.PingCycle(emitter,recorder,listen_time_ms,emit_delay_bursts) as cycle:
+            if not cycle.connected:
+                return {'error': "listener or emitter not responding"}
+            # board receive times are only matched to pings sent from here
+            emits_before = itsy.emits
+            listens_before = teensy.listens
+            cycles = 0
+            for i in range(pings):
+                ping = cycle.ping()
+                if ping is None:
+                    break
+                times.add('cycle',ping.t_end - ping.t_listen)
+                times.add('emit_offset',ping.emit_offset)
+                cycles += 1
+            stats = cycle.stats()
+
+        started = teensy.start_times[listens_before:listens_before + cycles]
+        emitted = itsy.emit_times[emits_before:emits_before + cycles]
+        for t_start,t_emit in zip(started,emitted):
+            times.add('board_skew',t_emit - t_start)
+        recorder.disconnect_serial()
+        emitter.disconnect_serial()
+
+    return {
+        'rates': {'pings_per_second': stats['cycles_per_second']},
+        'missing_acks': stats['missing_acks'],
+        'latency_ms': times.summary(),
+    }
+
+
+def bench_upload(chirp_len:int = 30000,reps:int = 20)->dict:
+    """Forced uploads of one chirp with the CRC check
+
+    Args:
+        chirp_len (int, optional): uint16 in the chirp. Defaults to 30000.
+        reps (int, optional): uploads to time. Defaults to 20.
+
+    Returns:
+        dict: rates and latency_ms per stage
+    """
+    times = StageTimes()
+    rng = np.random.default_rng(0)
+    chirp = rng.integers(0,4096,chirp_len).astype(np.uint16)
+    failed = 0
+    with bb_sim.SimItsy() as itsy:
+        with _quiet():
+            emitter = bb_emitter.EchoEmitter(Serial(itsy.port))
+            for i in range(reps):
+                start = time.perf_counter()
+                ok = emitter.upload_chirp(chirp,force=True)
+                total = time.perf_counter() - start
+                if not ok:
+                    failed += 1
+                    continue
+                times.add('write',emitter.last_upload_time)
+                times.add('upload',total)
+        emitter.disconnect_serial()
+
+    write_times = times.samples['write']
+    return {
+        'rates': {
+            'upload_mb_per_second': chirp_len*2*len(write_times)/sum(write_times)/1e6 if write_times else 0.0,
+            'uploads_per_second': len(times.samples['upload'])/sum(times.samples['upload']) if write_times else 0.0,
+        },
+        'failed': failed,
+        'latency_ms': times.summary(),
+    }
+
+
+def bench_framed(records:int = 50,samples_per_record:int = 25000,emit_len:int = 3000,timeout:float = 2.0)->dict:
+    """ser_utils frames both ways, emit uploads out and START_RECORD data frames back
+
+    Args:
+        records (int, optional): uploads and records to time. Defaults to 50.
+        samples_per_record (int, optional): uint16 sent back per record. Defaults to 25000.
+        emit_len (int, optional): uint16 in the emit upload. Defaults to 3000.
+        timeout (float, optional): give up on a record after this long. Defaults to 2.0.
+
+    Returns:
+        dict: rates and latency_ms per stage
+    """
+    times = StageTimes()
+    emit_data = np.random.default_rng(0).integers(0,4096,emit_len).astype(np.uint16)
+    request = bytes(ser_utils.encode_msg(bytearray([bb_sim.START_RECORD])))
+    decoded_bytes = 0
+    lost = 0
+    with bb_sim.SimFramedDevice(samples_per_record) as device:
+        port = Serial(device.port,timeout=0.05)
+        for i in range(records):
+            t0 = time.perf_counter()
+            chunks,_ = emit.build_emit_upd(emit_len,emit_data)
+            t1 = time.perf_counter()
+            port.write(b''.join(bytes(chunk) for chunk in chunks))
+            times.add('encode',t1 - t0)
+
+            # the record answer also tells the upload was decoded, frames are handled in order
+            decoder = ser_utils.FrameDecoder()
+            frames = 0
+            start = time.perf_counter()
+            port.write(request)
+            while frames < device.record_frames and time.perf_counter() - start < timeout:
+                data = port.read(max(port.in_waiting,1))
+                t_dec = time.perf_counter()
+                for frame_type,payload in decoder.feed(data):
+                    frames += 1
+                    decoded_bytes += len(payload)
+                times.add('decode',time.perf_counter() - t_dec)
+            if frames < device.record_frames:
+                lost += 1
+                continue
+            times.add('record',time.perf_counter() - start)
+        port.close()
+        uploads = device.uploads
+
+    record_times = times.samples['record']
+    return {
+        'rates': {
+            'records_per_second': len(record_times)/sum(record_times) if record_times else 0.0,
+            'decode_mb_per_second': decoded_bytes/sum(times.samples['decode'])/1e6 if times.samples['decode'] else 0.0,
+        },
+        'uploads_seen': uploads,
+        'lost_records': lost,
+        'latency_ms': times.summary(),
+    }
+
+
+def compare(results:dict,baseline:dict,tolerance:float = 0.2)->list[str]:
+    """Rates that dropped or median and p99 latencies that grew by more than tolerance
+
+    Args:
+        results (dict): this run
+        baseline (dict): an earlier run
+        tolerance (float, optional): allowed fraction of change. Defaults to 0.2.
+
+    Returns:
+        list[str]: one line per regression
+    """
+    regressions = []
+    for bench,res in results.items():
+        base = baseline.get(bench)
+        if not base or 'error' in res or 'error' in base:
+            continue
+        for name,value in res.get('rates',{}).items():
+            old = base.get('rates',{}).get(name)
+            if old and value < old*(1 - tolerance):
+                regressions.append(f"{bench}.{name}: {value:.2f} was {old:.2f}")
+        for stage,summary in res.get('latency_ms',{}).items():
+            old = base.get('latency_ms',{}).get(stage,{})
+            for p in ('p50','p99'):
+                # skews can be negative, only growing durations count
+                if old.get(p,0) > 0 and summary.get(p,0) > old[p]*(1 + tolerance):
+                    regressions.append(f"{bench}.{stage}.{p}: {summary[p]:.3f} ms was {old[p]:.3f} ms")
+    return regressions
+
+
+def print_results(results:dict)->None:
+    for bench,res in results.items():
+        print(f"{t_colors.HEADER}{bench}{t_colors.ENDC}")
+        if 'error' in res:
+            print(f"  {t_colors.FAIL}{res['error']}{t_colors.ENDC}")
+            continue
+        for name,value in res['rates'].items():
+            print(f"  {name:24s} {value:10.2f}")
+        for name,value in res.items():
+            if name not in ('rates','latency_ms'):
+                print(f"  {name:24s} {value:10}")
+        print(f"  {'stage (ms)':16s}" + "".join(f"{k:>10s}" for k in [f"p{p}" for p in PERCENTILES] + ['mean','max']))
+        for stage,summary in res['latency_ms'].items():
+            print(f"  {stage:16s}" + "".join(f"{v:10.3f}" for v in summary.values()))
+
+
+BENCHMARKS = ('listen','ping','upload','framed')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="acquisition benchmarks on simulated boards")
+    parser.add_argument('-b','--bench',nargs='+',choices=BENCHMARKS,default=list(BENCHMARKS))
+    parser.add_argument('-p','--pings',type=int,default=100,help="pings for listen and ping")
+    parser.add_argument('-lt','--listen_time',type=int,default=30,help="ms per listen")
+    parser.add_argument('-ed','--emit_delay',type=int,default=0,help="bursts before the chirp in ping")
+    parser.add_argument('-cl','--chirp_len',type=int,default=30000,help="uint16 per upload")
+    parser.add_argument('-u','--uploads',type=int,default=20)
+    parser.add_argument('-r','--records',type=int,default=50,help="framed records")
+    parser.add_argument('--realtime',action='store_true',help="stream at the ADC rate")
+    parser.add_argument('--json',help="save results here")
+    parser.add_argument('--compare',help="results json of an earlier run")
+    parser.add_argument('-t','--tolerance',type=float,default=0.2)
+    args = parser.parse_args()
+
+    runs = {
+        'listen': lambda: bench_listen(args.pings,args.listen_time,args.realtime),
+        'ping': lambda: bench_ping(args.pings,args.listen_time,args.emit_delay,args.realtime),
+        'upload': lambda: bench_upload(args.chirp_len,args.uploads),
+        'framed': lambda: bench_framed(args.records),
+    }
+    results = {bench: runs[bench]() for bench in args.bench}
+    print_results(results)
+
+    if args.json:
+        with open(args.json,'w') as f:
+            json.dump(results,f,indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results,json.load(f),args.tolerance)
+        for line in regressions:
+            print(f"{t_colors.FAIL}REGRESSION {line}{t_colors.ENDC}")
+        if regressions:
+            sys.exit(1)
+        print(f"{t_colors.OKGREEN}no regressions over {args.tolerance*100:.0f}%{t_colors.ENDC}")
@@ -0,0 +1,416 @@
+"""Chirp library, every chirp design precomputed into one memory mappable file
+
+    Layout, all little endian:
+
+        file header     HEADER_DTYPE, 64 bytes
+        index           n_chirps entries of ENTRY_DTYPE
+        per chirp       uint16 DAC samples, as uploaded to the emitter
+                        float64 zero mean template, what EchoRanger correlates with
+                        complex128 conj(rfft(template, nfft)), the matched filter spectrum
+
+    Every block starts on an 8 byte boundary so the samples, template and
+    spectrum are views into the mapped file. The designs come from a YAML spec
+    like chirps.yaml. The header keeps a CRC of the spec, the .npy sources it
+    names and the default gain and offset, open_library rebuilds the file
+    whenever any of them changed. bb_repl and bb_gui pick chirps by name,
+    nothing is regenerated, normalized or FFT'd at upload or ranging time.
+    """
+
+import os
+import time
+import zlib
+import yaml
+import numpy as np
+
+import bb_emitter
+from bb_echo import EchoRanger, chirp_spectrum
+
+LIB_MAGIC = b'BBCHIRP1'
+LIB_VERSION = 2
+ALIGN = 8
+DAC_FREQ = 1e6
+
+HEADER_DTYPE = np.dtype([
+    ('magic','S8'),
+    ('version','<u4'),
+    ('n_chirps','<u4'),
+    ('sample_freq','<f8'),
+    ('index_offset','<u8'),
+    ('created','<f8'),
+    ('spec_crc','<u4'),
+    ('reserved','S20'),
+])
+
+ENTRY_DTYPE = np.dtype([
+    ('name','S32'),
+    ('kind','S8'),
+    ('method','S16'),
+    ('source','S64'),
+    ('f0','<f8'),
+    ('f1','<f8'),
+    ('t_end','<f8'),
+    ('gain','<f8'),
+    ('offset','<f8'),
+    ('n_samples','<u4'),
+    ('crc','<u4'),
+    ('nfft','<u4'),
+    ('reserved','<u4'),
+    ('energy','<f8'),
+    ('samples_offset','<u8'),
+    ('template_offset','<u8'),
+    ('spectrum_offset','<u8'),
+])
+
+
+def _aligned(pos:int)->int:
+    return -(-pos//ALIGN)*ALIGN
+
+
+def default_nfft(n_samples:int)->int:
+    """Same FFT size EchoRanger picks, the power of 2 at least 4x the chirp"""
+    return 1 << int(np.ceil(np.log2(4*n_samples)))
+
+
+def make_samples(spec:dict,gain:float = bb_emitter.SIG_GAIN,offset:float = bb_emitter.SIG_OFFSET)->np.uint16:
+    """DAC samples for one design, made by the same cached functions EchoEmitter uses
+
+    Args:
+        spec (dict): 'file' for a .npy, 'sine' for a sine at that frequency, otherwise
+            'f0', 'f1' and 'method' for a scipy chirp. 't_end' in ms for sines and chirps.
+        gain (float, optional): used when the spec has none. Defaults to bb_emitter.SIG_GAIN.
+        offset (float, optional): used when the spec has none. Defaults to bb_emitter.SIG_OFFSET.
+
+    Returns:
+        np.uint16: read only samples
+    """
+    gain = float(spec.get('gain',gain))
+    offset = float(spec.get('offset',offset))
+    if 'file' in spec:
+        return bb_emitter.cached_file(spec['file'],gain,offset)
+    if 'sine' in spec:
+        return bb_emitter.cached_sine(spec['t_end'],float(spec['sine']),gain,offset)[0]
+    return bb_emitter.cached_chirp(float(spec['f0']),float(spec['f1']),spec['t_end'],spec.get('method','linear'),gain,offset)[0]
+
+
+def load_spec(spec_path:str)->list[dict]:
+    """Reads the chirp designs from a YAML spec, file paths are relative to the spec
+
+    Args:
+        spec_path (str): YAML with a 'chirps' list
+
+    Returns:
+        list[dict]: one dict per design
+    """
+    with open(spec_path,"r") as f:
+        spec = yaml.safe_load(f)
+
+    spec_dir = os.path.dirname(os.path.abspath(spec_path))
+    chirps = []
+    for chirp in spec['chirps']:
+        chirp = dict(chirp)
+        if 'file' in chirp:
+            chirp['file'] = os.path.join(spec_dir,chirp['file'])
+        chirps.append(chirp)
+    return chirps
+
+
+def spec_crc(spec_path:str,specs:list[dict],gain:float = bb_emitter.SIG_GAIN,offset:float = bb_emitter.SIG_OFFSET)->int:
+    """CRC of everything a library is built from, the spec's bytes, the mtime and
+    size of every .npy it names and the default gain and offset
+
+    Args:
+        spec_path (str): YAML spec
+        specs (list[dict]): its designs, from load_spec
+        gain (float, optional): gain for designs without one. Defaults to bb_emitter.SIG_GAIN.
+        offset (float, optional): offset for designs without one. Defaults to bb_emitter.SIG_OFFSET.
+
+    Returns:
+        int: crc32
+    """
+    with open(spec_path,'rb') as f:
+        crc = zlib.crc32(f.read())
+    crc = zlib.crc32(np.array([gain,offset],dtype='<f8').tobytes(),crc)
+    for spec in specs:
+        if 'file' in spec:
+            st = os.stat(spec['file'])
+            crc = zlib.crc32(f"{spec['file']}:{st.st_mtime_ns}:{st.st_size}".encode(),crc)
+    return crc
+
+
+def build_library(file_path:str,specs:list[dict],gain:float = bb_emitter.SIG_GAIN,offset:float = bb_emitter.SIG_OFFSET,
+                  crc:int = 0)->str:
+    """Precomputes every design into a library file, an existing one is replaced.
+    The library is written to a temporary file next to it and moved over it once complete,
+    so a ChirpLibrary still mapping the old file keeps its data and a crash leaves no half written library
+
+    Args:
+        file_path (str): library to write
+        specs (list[dict]): designs with a unique 'name', see make_samples
+        gain (float, optional): gain for designs without one. Defaults to bb_emitter.SIG_GAIN.
+        offset (float, optional): offset for designs without one. Defaults to bb_emitter.SIG_OFFSET.
+        crc (int, optional): spec_crc of what the designs came from, kept in the header. Defaults to 0.
+
+    Returns:
+        str: file_path
+    """
+    names = [str(spec['name']) for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"chirp names are not unique {names}")
+    for name in names:
+        if len(name.encode()) > ENTRY_DTYPE['name'].itemsize:
+            raise ValueError(f"chirp name {name} is longer than {ENTRY_DTYPE['name'].itemsize} bytes")
+
+    header = np.zeros(1,HEADER_DTYPE)
+    header['magic'] = LIB_MAGIC
+    header['version'] = LIB_VERSION
+    header['n_chirps'] = len(specs)
+    header['sample_freq'] = DAC_FREQ
+    header['index_offset'] = HEADER_DTYPE.itemsize
+    header['created'] = time.time()
+    header['spec_crc'] = crc
+    index = np.zeros(len(specs),ENTRY_DTYPE)
+
+    # same directory so the replace is a rename on one filesystem
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path,'wb') as f:
+            _write_library(f,header,index,specs,gain,offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path,file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return file_path
+
+
+def _write_library(f,header:np.ndarray,index:np.ndarray,specs:list[dict],gain:float,offset:float)->None:
+    """Writes the blocks of every design, then the header and the filled in index"""
+    end = _aligned(HEADER_DTYPE.itemsize + ENTRY_DTYPE.itemsize*len(specs))
+
+    def write_block(data:np.ndarray)->int:
+        nonlocal end
+        pos = end
+        f.seek(pos)
+        f.write(data.tobytes())
+        end = _aligned(pos + data.nbytes)
+        return pos
+
+    for entry,spec in zip(index,specs):
+        samples = np.ascontiguousarray(make_samples(spec,gain,offset),dtype='<u2')
+        template = samples - np.mean(samples)
+        nfft = default_nfft(len(samples))
+        spectrum,energy = chirp_spectrum(template,nfft)
+
+        entry['name'] = str(spec['name']).encode()
+        if 'file' in spec:
+            entry['kind'] = b'file'
+            entry['source'] = os.path.basename(spec['file']).encode()[:ENTRY_DTYPE['source'].itemsize]
+        elif 'sine' in spec:
+            entry['kind'] = b'sine'
+            entry['f0'] = entry['f1'] = spec['sine']
+            entry['t_end'] = spec['t_end']
+        else:
+            entry['kind'] = b'chirp'
+            entry['method'] = spec.get('method','linear').encode()
+            entry['f0'] = spec['f0']
+            entry['f1'] = spec['f1']
+            entry['t_end'] = spec['t_end']
+        entry['gain'] = spec.get('gain',gain)
+        entry['offset'] = spec.get('offset',offset)
+        entry['n_samples'] = len(samples)
+        # same bytes, same CRC as EchoEmitter.upload_chirp gets back from the itsy
+        entry['crc'] = zlib.crc32(samples.tobytes())
+        entry['nfft'] = nfft
+        entry['energy'] = energy
+        entry['samples_offset'] = write_block(samples)
+        entry['template_offset'] = write_block(template.astype('<f8'))
+        entry['spectrum_offset'] = write_block(spectrum.astype('<c16'))
+
+    f.seek(0)
+    f.write(header.tobytes())
+    f.write(index.tobytes())
+
+
+class LibraryChirp:
+    """One chirp of a ChirpLibrary, the arrays are views into the mapped file"""
+    __slots__ = ('name','kind','method','source','f0','f1','t_end','gain','offset',
+                 'crc','nfft','energy','samples','template','spectrum')
+
+    def ranger(self,sample_freq:float = 1e6,**kwargs)->EchoRanger:
+        """EchoRanger on the stored spectrum, nothing is FFT'd
+
+        Args:
+            sample_freq (float, optional): sample rate of the listener. Defaults to 1e6.
+            kwargs: the rest of EchoRanger's arguments
+
+        Returns:
+            EchoRanger: matched filter for this chirp
+        """
+        return EchoRanger(self.samples,sample_freq,nfft=self.nfft,spectrum=(self.spectrum,self.energy),**kwargs)
+
+    def describe(self)->str:
+        if self.kind == 'file':
+            return f"FILE USED: {self.source}"
+        if self.kind == 'sine':
+            return f"SINE FREQ: {self.f0} DURATION MS: {self.t_end}"
+        return f"START FREQ: {self.f0} END FREQ: {self.f1} DURATION MS: {self.t_end} METHOD: {self.method}"
+
+
+class ChirpLibrary:
+
+    def __init__(self,file_path:str) -> None:
+        """Memory maps a chirp library, nothing is read until a chirp is used
+
+        Args:
+            file_path (str): file written by build_library
+        """
+        self.file_path = file_path
+        self.mm = np.memmap(file_path,dtype=np.uint8,mode='r')
+
+        self.header = self.mm[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if self.header['magic'] != LIB_MAGIC:
+            raise ValueError(f"{file_path} is not a chirp library")
+        if self.header['version'] > LIB_VERSION:
+            raise ValueError(f"{file_path} is version {self.header['version']}, newest known is {LIB_VERSION}")
+
+        self.sample_freq = float(self.header['sample_freq'])
+        start = int(self.header['index_offset'])
+        self.index = self.mm[start:start + ENTRY_DTYPE.itemsize*int(self.header['n_chirps'])].view(ENTRY_DTYPE)
+        self.positions = {name.decode():i for i,name in enumerate(self.index['name'])}
+
+    def __enter__(self)->'ChirpLibrary':
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback)->None:
+        self.close()
+
+    def __len__(self)->int:
+        return len(self.index)
+
+    def __contains__(self,name:str)->bool:
+        return name in self.positions
+
+    @property
+    def names(self)->list[str]:
+        return list(self.positions)
+
+    def _block(self,offset:int,dtype:str,n:int)->np.ndarray:
+        dtype = np.dtype(dtype)
+        return self.mm[offset:offset + n*dtype.itemsize].view(dtype)
+
+    def __getitem__(self,key)->LibraryChirp:
+        """Chirp by name or position
+
+        Args:
+            key (str | int): chirp name or index
+
+        Returns:
+            LibraryChirp: the stored chirp
+        """
+        if isinstance(key,str):
+            if key not in self.positions:
+                raise KeyError(f"no chirp named {key} in {self.file_path}")
+            key = self.positions[key]
+        entry = self.index[key]
+
+        chirp = LibraryChirp()
+        for field in ('name','kind','method','source'):
+            setattr(chirp,field,entry[field].decode())
+        for field in ('f0','f1','t_end','gain','offset','energy'):
+            setattr(chirp,field,float(entry[field]))
+        chirp.crc = int(entry['crc'])
+        chirp.nfft = int(entry['nfft'])
+
+        n = int(entry['n_samples'])
+        chirp.samples = self._block(int(entry['samples_offset']),'<u2',n)
+        chirp.template = self._block(int(entry['template_offset']),'<f8',n)
+        chirp.spectrum = self._block(int(entry['spectrum_offset']),'<c16',chirp.nfft//2 + 1)
+        return chirp
+
+    def close(self)->None:
+        # the map is released once nothing points at it anymore
+        self.mm = None
+
+
+def _library_crc(file_path:str)->int:
+    """spec_crc stored in a library of this version, None if there is no such library"""
+    if not os.path.exists(file_path) or os.path.getsize(file_path) < HEADER_DTYPE.itemsize:
+        return None
+    header = np.fromfile(file_path,dtype=HEADER_DTYPE,count=1)[0]
+    if header['magic'] != LIB_MAGIC or header['version'] != LIB_VERSION:
+        return None
+    return int(header['spec_crc'])
+
+
+def open_library(spec_path:str,file_path:str = None,gain:float = bb_emitter.SIG_GAIN,offset:float = bb_emitter.SIG_OFFSET)->ChirpLibrary:
+    """Opens the library for a spec, building it first if it is missing or was built
+    from a different spec, different .npy sources or a different gain and offset
+
+    Args:
+        spec_path (str): YAML spec, see load_spec
+        file_path (str, optional): library file, None puts it next to the spec as .bbchirp. Defaults to None.
+        gain (float, optional): gain for designs without one. Defaults to bb_emitter.SIG_GAIN.
+        offset (float, optional): offset for designs without one. Defaults to bb_emitter.SIG_OFFSET.
+
+    Returns:
+        ChirpLibrary: the mapped library
+    """
+    if file_path is None:
+        file_path = os.path.splitext(spec_path)[0] + ".bbchirp"
+
+    specs = load_spec(spec_path)
+    crc = spec_crc(spec_path,specs,gain,offset)
+    if _library_crc(file_path) != crc:
+        build_library(file_path,specs,gain,offset,crc)
+    return ChirpLibrary(file_path)
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    from bb_echo import _chirp_spectrum
+
+    if len(sys.argv) > 1:
+        spec_path = sys.argv[1]
+        file_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(spec_path)[0] + ".bbchirp"
+        build_library(file_path,load_spec(spec_path))
+        with ChirpLibrary(file_path) as lib:
+            for name in lib.names:
+                chirp = lib[name]
+                print(f"{name:>32}: {len(chirp.samples):6d} samples, crc {chirp.crc:08x}, {chirp.describe()}")
+        sys.exit()
+
+    # 30ms designs, made and FFT'd per use vs picked from the library
+    specs = [{'name':f"lfm_{f0//1000}k_{method}",'f0':f0,'f1':30000,'t_end':30,'method':method}
+             for f0 in (80000,90000,100000) for method in ('linear','quadratic','logarithmic')]
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = build_library(os.path.join(tmp,"chirps.bbchirp"),specs)
+
+        reps = 3
+        start = time.perf_counter()
+        for i in range(reps):
+            bb_emitter.clear_chirp_cache()
+            _chirp_spectrum.cache_clear()
+            for spec in specs:
+                samples = make_samples(spec)
+                EchoRanger(samples,nfft=default_nfft(len(samples)))
+        fresh_time = (time.perf_counter() - start)/reps/len(specs)
+
+        lib = ChirpLibrary(file_path)
+        reps = 100
+        start = time.perf_counter()
+        for i in range(reps):
+            for spec in specs:
+                lib[spec['name']].ranger()
+        lib_time = (time.perf_counter() - start)/reps/len(specs)
+
+        chirp = lib[specs[0]['name']]
+        assert np.array_equal(chirp.samples,make_samples(specs[0]))
+        assert chirp.crc == zlib.crc32(make_samples(specs[0]).astype('<u2').tobytes())
+        lib.close()
+
+    print(f"generate + spectrum: {fresh_time*1e3:8.3f} ms/chirp")
+    print(f"       from library: {lib_time*1e3:8.3f} ms/chirp")
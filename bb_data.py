@@ -5,11 +5,11 @@ import numpy as np
 from scipy import signal
 from datetime import datetime
 import bb_log
-import m4
 import yaml
 
 from bb_utils import get_timestamp_now
 from threading import Thread
+import queue
 
 write_npy_fun = lambda s,d,su: write_npy(s,d, su)
 
@@ -22,29 +22,140 @@ def write_npy(save_path, data, suffix=None):
     path += ".npy"
         
     with open(path, 'wb') as fd:
-        np.save(fd, np.array(data))
-        fd.close()
+        np.save(fd, np.asarray(data))
+        
+    return path
+
+def fsync_path(path):
+    # reopened for writing, Windows will not commit a read only handle
+    with open(path, 'rb+') as fd:
+        os.fsync(fd.fileno())
         
 class DataThread(Thread):
-    def __init__(self, write_queue, exit_cond):
+    def __init__(self, write_queue, exit_cond, batch_max=32, fsync_every=0, fsync_interval=0, fsync_on_close=True, poll_timeout=0.1,
+                 max_unsynced=256):
+        """Writes (data, suffix, save_path, write_fun) items from write_queue until
+        exit_cond() is true and the queue is empty.
+        
+        The thread sleeps in q.get until an item arrives, then takes up to batch_max
+        waiting items in one go. Only the dequeue and the fsync are batched, each
+        item still goes through its own write_fun call, so write_npy makes one
+        file per item. Files are fsynced when fsync_every items or
+        fsync_interval seconds have built up since the last sync, and once more on
+        exit if fsync_on_close. Whatever the policy, max_unsynced waiting paths
+        force a sync so a long run neither piles up paths nor leaves every file
+        to be reopened at exit. write_fun has to return the written path for the
+        sync to find it, write_npy does.
+
+        Args:
+            write_queue (queue.Queue): items to write
+            exit_cond (callable): returns True once nothing else will be queued
+            batch_max (int, optional): most items taken off the queue per wake up. Defaults to 32.
+            fsync_every (int, optional): items between syncs, 0 turns it off. Defaults to 0.
+            fsync_interval (float, optional): seconds between syncs, 0 turns it off. Defaults to 0.
+            fsync_on_close (bool, optional): sync what is left on exit. Defaults to True.
+            poll_timeout (float, optional): how often exit_cond is checked while idle. Defaults to 0.1.
+            max_unsynced (int, optional): most written paths waiting for a sync, 0 is no cap. Defaults to 256.
+        """
         Thread.__init__(self)
         self.q = write_queue
         self.exit_cond = exit_cond
+        self.batch_max = batch_max
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.fsync_on_close = fsync_on_close
+        self.poll_timeout = poll_timeout
+        self.max_unsynced = max_unsynced
+        
+        self.unsynced = []
+        self.last_sync = time.monotonic()
+        
+        # stats
+        self.items_written = 0
+        self.bytes_written = 0
+        self.batches = 0
+        self.syncs = 0
+        self.max_queue_depth = 0
+        self.write_time = 0.0
+        self.sync_time = 0.0
+        self.start_time = None
         
     def run(self):
+        self.start_time = time.monotonic()
         
         while True:
-            if self.exit_cond() and self.q.empty():
-                break
+            try:
+                batch = [self.q.get(timeout=self.poll_timeout)]
+            except queue.Empty:
+                if self.exit_cond() and self.q.empty():
+                    break
+                self.check_sync()
+                continue
+            
+            self.max_queue_depth = max(self.max_queue_depth, self.q.qsize() + 1)
+            while len(batch) < self.batch_max:
+                try:
+                    batch.append(self.q.get_nowait())
+                except queue.Empty:
+                    break
+            
+            self.write_batch(batch)
+            self.check_sync()
+            
+        if self.fsync_on_close:
+            self.sync()
+            
+    def write_batch(self, batch):
+        start = time.monotonic()
+        for data, data_suffix, save_path, write_fun in batch:
+            path = write_fun(save_path, data, data_suffix)
+            if path is not None:
+                self.unsynced.append(path)
+                if self.max_unsynced and len(self.unsynced) >= self.max_unsynced:
+                    self.sync()
+            self.bytes_written += np.asarray(data).nbytes
+            self.items_written += 1
+            self.q.task_done()
+        self.write_time += time.monotonic() - start
+        self.batches += 1
         
-            if not self.q.empty():
-                data, data_suffix, save_path, write_fun = self.q.get()
-                
-                write_fun(save_path, data, data_suffix)
-                self.q.task_done()
+    def check_sync(self):
+        if not self.unsynced:
+            return
+        if self.fsync_every and len(self.unsynced) >= self.fsync_every:
+            self.sync()
+        elif self.fsync_interval and time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync()
             
-            else:
-                time.sleep(0.01)
+    def sync(self):
+        start = time.monotonic()
+        for path in self.unsynced:
+            fsync_path(path)
+        self.unsynced = []
+        self.last_sync = time.monotonic()
+        self.sync_time += self.last_sync - start
+        self.syncs += 1
+        
+    def stats(self):
+        """Snapshot of the writer counters
+
+        Returns:
+            dict: counters, times are in seconds and throughput is per second of running
+        """
+        elapsed = time.monotonic() - self.start_time if self.start_time is not None else 0.0
+        return {
+            'queue_depth': self.q.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'items_written': self.items_written,
+            'bytes_written': self.bytes_written,
+            'batches': self.batches,
+            'syncs': self.syncs,
+            'unsynced': len(self.unsynced),
+            'write_time': self.write_time,
+            'sync_time': self.sync_time,
+            'items_per_s': self.items_written/elapsed if elapsed else 0.0,
+            'bytes_per_s': self.bytes_written/elapsed if elapsed else 0.0,
+        }
 
 class DataController:
     
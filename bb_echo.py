@@ -0,0 +1,221 @@
+"""Online echo ranging with a matched filter on each ping
+
+    Each ear is correlated against the uploaded chirp with overlap-save FFT
+    blocks, both ears and every block in one batch. The chirp spectrum is
+    computed once per chirp. Peaks of the correlation envelope give the echo
+    delay, range and amplitude per ear as soon as the ping is captured, the
+    same idea as src/listen/recieve.py autocorr but without waiting for the
+    whole run.
+    """
+
+import functools
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+
+from bb_stereo import StereoCapture
+
+SPEED_OF_SOUND = 343.0
+
+
+@functools.lru_cache(maxsize=8)
+def _chirp_spectrum(template_bytes:bytes,nfft:int)->tuple[np.ndarray,float]:
+    template = np.frombuffer(template_bytes)
+    H = np.conj(np.fft.rfft(template,nfft))
+    H.flags.writeable = False
+    return H,float(np.sum(template**2))
+
+
+def chirp_spectrum(template:np.ndarray,nfft:int)->tuple[np.ndarray,float]:
+    """Conjugate spectrum of the chirp for correlating, made once per chirp and FFT size
+
+    Args:
+        template (np.ndarray): zero mean chirp
+        nfft (int): FFT size of the overlap-save blocks
+
+    Returns:
+        tuple[np.ndarray,float]: conj(rfft(template, nfft)), energy of the template
+    """
+    template = np.ascontiguousarray(template,dtype=np.float64)
+    return _chirp_spectrum(template.tobytes(),int(nfft))
+
+
+class Echoes:
+    """Echoes found in one ear, sorted by delay"""
+    __slots__ = ('delays','ranges','amplitudes')
+
+    def __init__(self,delays:np.ndarray,ranges:np.ndarray,amplitudes:np.ndarray) -> None:
+        self.delays = delays
+        self.ranges = ranges
+        self.amplitudes = amplitudes
+
+    def __len__(self)->int:
+        return len(self.delays)
+
+    def nearest(self)->float:
+        """Range of the closest echo in meters, None if nothing was found"""
+        if len(self.ranges) == 0:
+            return None
+        return float(self.ranges[0])
+
+
+class EchoRanger:
+
+    def __init__(self,chirp:np.ndarray,sample_freq:float = 1e6,nfft:int = None,speed_of_sound:float = SPEED_OF_SOUND,
+                 threshold:float = 0.4,min_delay:int = 0,max_echoes:int = 8,spectrum:tuple = None) -> None:
+        """Matched filter for one chirp
+
+        Args:
+            chirp (np.ndarray): chirp as uploaded to the emitter, the DAC offset is removed here
+            sample_freq (float, optional): sample rate of the listener. Defaults to 1e6.
+            nfft (int, optional): overlap-save FFT size, None picks the power of 2 at least 4x the chirp. Defaults to None.
+            speed_of_sound (float, optional): in m/s. Defaults to SPEED_OF_SOUND.
+            threshold (float, optional): peaks below this fraction of the strongest echo are ignored. Defaults to 0.4.
+            min_delay (int, optional): samples to ignore at the start, the emitter's own chirp. Defaults to 0.
+            max_echoes (int, optional): most echoes reported per ear. Defaults to 8.
+            spectrum (tuple, optional): (conj spectrum, energy) already made for this chirp and nfft, like
+                bb_chirplib stores them. None computes it. Defaults to None.
+        """
+        chirp = np.asarray(chirp,dtype=np.float64)
+        self.template = chirp - np.mean(chirp)
+        self.chirp_len = len(self.template)
+        if nfft is None:
+            nfft = 1 << int(np.ceil(np.log2(4*self.chirp_len)))
+        if nfft < self.chirp_len:
+            raise ValueError(f"nfft {nfft} is shorter than the chirp {self.chirp_len}")
+        self.nfft = nfft
+        # new output samples per block, the rest wraps around
+        self.step = nfft - self.chirp_len + 1
+
+        if spectrum is None:
+            self.H,self.energy = chirp_spectrum(self.template,nfft)
+        else:
+            self.H,self.energy = spectrum
+            if len(self.H) != nfft//2 + 1:
+                raise ValueError(f"spectrum has {len(self.H)} bins, nfft {nfft} needs {nfft//2 + 1}")
+
+        self.sample_freq = sample_freq
+        self.speed_of_sound = speed_of_sound
+        self.threshold = threshold
+        self.min_delay = min_delay
+        self.max_echoes = max_echoes
+
+        self._work_shape = None
+
+    def _workspace(self,shape:tuple)->None:
+        """Padded input and analytic spectrum buffers for captures of this shape"""
+        if shape == self._work_shape:
+            return
+        channels,n = shape
+        self.n_lags = max(n - self.chirp_len + 1,1)
+        self.n_blocks = -(-self.n_lags//self.step)
+        self.padded = np.zeros((channels,(self.n_blocks - 1)*self.step + self.nfft))
+        self.blocks = sliding_window_view(self.padded,self.nfft,axis=-1)[:,::self.step]
+        self.analytic = np.zeros((channels,self.n_blocks,self.nfft),dtype=np.complex128)
+        self._work_shape = shape
+
+    def analytic_correlation(self,data:np.ndarray)->np.ndarray:
+        """Analytic matched filter output for every lag where the whole chirp fits. The real part
+        is the correlation with the chirp, the imaginary part its Hilbert transform within each block
+
+        Args:
+            data (np.ndarray): (channels, N) samples, the mean is removed here
+
+        Returns:
+            np.ndarray: (channels, N - chirp_len + 1) complex, scaled by the chirp's energy
+        """
+        data = np.atleast_2d(data)
+        self._workspace(data.shape)
+        n = data.shape[1]
+        np.subtract(data,np.mean(data,axis=1,keepdims=True),out=self.padded[:,:n])
+
+        # correlation of every block with the chirp, only the positive
+        # frequencies are kept so the inverse is the analytic signal
+        half = self.nfft//2 + 1
+        self.analytic[...,:half] = np.fft.rfft(self.blocks,axis=-1)*self.H
+        self.analytic[...,1:(self.nfft + 1)//2] *= 2
+        out = np.fft.ifft(self.analytic,axis=-1)[...,:self.step]
+
+        out = out.reshape(out.shape[0],-1)[:,:self.n_lags]
+        out /= self.energy
+        return out
+
+    def correlate(self,data:np.ndarray)->np.ndarray:
+        """Matched filter envelope for every lag where the whole chirp fits
+
+        Args:
+            data (np.ndarray): (channels, N) samples, the mean is removed here
+
+        Returns:
+            np.ndarray: (channels, N - chirp_len + 1) envelope, scaled so an echo that
+            is an exact copy of the chirp times a has a peak of a
+        """
+        return np.abs(self.analytic_correlation(data))
+
+    def find_echoes(self,env:np.ndarray)->Echoes:
+        """Peaks of one ear's envelope
+
+        Args:
+            env (np.ndarray): one row from correlate
+
+        Returns:
+            Echoes: delays in s, ranges in m and amplitudes
+        """
+        search = env[self.min_delay:]
+        peak = np.max(search) if len(search) else 0.0
+        if peak <= 0:
+            empty = np.zeros(0)
+            return Echoes(empty,empty,empty)
+
+        # a chirp's envelope is about as wide as 1/bandwidth, half a chirp
+        # keeps one peak per echo without merging close ones
+        peaks,props = signal.find_peaks(search,height=self.threshold*peak,distance=max(self.chirp_len//2,1))
+        strongest = np.argsort(props['peak_heights'])[::-1][:self.max_echoes]
+        peaks = np.sort(peaks[strongest])
+
+        delays = (peaks + self.min_delay)/self.sample_freq
+        return Echoes(delays,delays*self.speed_of_sound/2,search[peaks])
+
+    def range(self,capture:StereoCapture)->list[Echoes]:
+        """Echoes heard by each ear of one ping
+
+        Args:
+            capture (StereoCapture): the ping
+
+        Returns:
+            list[Echoes]: [left, right]
+        """
+        env = self.correlate(capture.data)
+        return [self.find_echoes(row) for row in env]
+
+
+if __name__ == '__main__':
+    import time
+
+    # 3ms chirp like the GUI default, two echoes per ear
+    Fs = 1e6
+    t = np.arange(0,3e-3,1/Fs)
+    chirp = (signal.chirp(t,100e3,3e-3,30e3)*512 + 2048).astype(np.uint16)
+    template = chirp - np.mean(chirp)
+
+    rng = np.random.default_rng(0)
+    data = rng.normal(scale=20,size=(2,30000)) + 2048
+    for ear,(delay,amp) in enumerate([(8000,0.3),(12000,0.2)]):
+        data[ear,delay:delay + len(template)] += amp*template
+        data[ear,delay + 5000:delay + 5000 + len(template)] += amp/2*template
+    capture = StereoCapture(data,Fs)
+
+    ranger = EchoRanger(chirp,Fs,threshold=0.3)
+    for ear,echoes in zip(('left','right'),ranger.range(capture)):
+        print(f"{ear}: " + ", ".join(f"{r:.3f} m ({a:.2f})" for r,a in zip(echoes.ranges,echoes.amplitudes)))
+
+    reps = 50
+    start = time.perf_counter()
+    for i in range(reps):
+        for row in capture.data:
+            np.abs(signal.correlate(row - np.mean(row),template,mode='same'))
+    print(f"signal.correlate per ear: {(time.perf_counter() - start)/reps*1e3:8.3f} ms/ping")
+    start = time.perf_counter()
+    for i in range(reps):
+        ranger.range(capture)
+    print(f"  EchoRanger both ears: {(time.perf_counter() - start)/reps*1e3:8.3f} ms/ping")
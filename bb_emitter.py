@@ -10,6 +10,7 @@ import matplotlib.pyplot as plt
 import sys
 from scipy import signal
 import zlib
+import functools
 
 
 
@@ -26,9 +27,17 @@ class ECHO_SERIAL_CMD(Enum):
     STOP_AMP = 9
     CLEAR_SERIAL = 10
     
+# CDC_SERIAL_BUFFER_SIZE in the itsy's core, bytes it holds before USB makes the host wait
+ITSY_RX_BUF_LEN = 256
+
+# DAC counts, waveforms in [-1, 1] are scaled by the gain around the offset
+SIG_GAIN = 512
+SIG_OFFSET = 2048
+
 class LAST_CHIRP_DATA(Enum):
     FILE = 0
     CUSTOM = 1
+    LIBRARY = 2
     NONE = 3
 
 def hide_cursor():
@@ -42,6 +51,68 @@ def show_cursor():
 
 
 
+def range_to_dac(data:np.ndarray,gain:float,offset:float)->np.uint16:
+    """Scales data to [offset, offset + gain] DAC counts"""
+    data = data - np.min(data)
+    data = data/np.max(data)
+    data = data*gain + offset
+    return data.astype(np.uint16)
+
+def _read_only(*arrays):
+    # cached waveforms are handed to every caller, nobody gets to change them
+    for a in arrays:
+        a.flags.writeable = False
+    return arrays
+
+@functools.lru_cache(maxsize=32)
+def cached_chirp(f_start:float,f_end:float,t_end:float,method:str,gain:float,offset:float)->tuple[np.uint16,np.ndarray]:
+    """scipy chirp of t_end ms at 1 MHz in DAC counts, memoized on its arguments
+
+    Returns:
+        tuple[np.uint16,np.ndarray]: read only chirp and its time axis
+    """
+    Fs = 1e6
+    Ts = 1/Fs
+    t = np.arange(0,t_end*1e-3 - Ts/2,Ts)
+    chirp = signal.chirp(t,f_start,t_end*1e-3,f_end,method)
+    return _read_only(range_to_dac(chirp,gain,offset),t)
+
+@functools.lru_cache(maxsize=32)
+def cached_sine(time_ms:float,freq:float,gain:float,offset:float)->tuple[np.uint16,np.ndarray]:
+    """Sine of time_ms ms at 1 MHz in DAC counts, memoized on its arguments
+
+    Returns:
+        tuple[np.uint16,np.ndarray]: read only sine and its time axis
+    """
+    DATA_LEN = int(time_ms*1e3)
+    duration = DATA_LEN / 1e6  # Duration of the sine wave (in seconds)
+    
+    t = np.linspace(0, duration, DATA_LEN, endpoint=False)
+    
+    sin_wave = np.sin(2 * np.pi * freq *t)
+    return _read_only(range_to_dac(sin_wave,gain,offset),t)
+
+@functools.lru_cache(maxsize=32)
+def _cached_file(file_name:str,mtime_ns:int,size:int,gain:float,offset:float)->np.uint16:
+    # mtime and size are only part of the key, a rewritten file is loaded again
+    return _read_only(range_to_dac(np.load(file_name),gain,offset))[0]
+
+def cached_file(file_name:str,gain:float,offset:float)->np.uint16:
+    """Loads a .npy waveform in DAC counts, memoized until the file changes
+
+    Returns:
+        np.uint16: read only waveform
+    """
+    file_name = os.path.abspath(file_name)
+    st = os.stat(file_name)
+    return _cached_file(file_name,st.st_mtime_ns,st.st_size,gain,offset)
+
+def clear_chirp_cache()->None:
+    cached_chirp.cache_clear()
+    cached_sine.cache_clear()
+    _cached_file.cache_clear()
+
+
 class t_colors:
     HEADER = '\033[95m'
     OKBLUE = '\033[94m'
@@ -69,20 +140,35 @@ class EchoEmitter:
         self.output_t = 1/output_freq
         
         self.chirp_uploaded = False
+        # copy of the last chirp the itsy confirmed, for matched filtering echoes
+        self.uploaded_chirp = None
+        # its CRC, an upload with the same CRC is skipped
+        self.uploaded_crc = None
         self.last_upload_type = LAST_CHIRP_DATA.NONE
         self.last_f0 = 0
         self.last_f1 = 0
         self.last_tend = 0
         self.last_method = 0
         self.last_filename = ""
+        # bb_chirplib.LibraryChirp picked last, its spectrum saves an FFT when ranging
+        self.library_chirp = None
+        
+        self.SIG_GAIN = SIG_GAIN
+        self.SIG_OFFSET = SIG_OFFSET
         
-        self.SIG_GAIN = 512
-        self.SIG_OFFSET = 2048
+        # chirp upload is written in blocks the size of the itsy's receive buffer
+        self.upload_block_len = ITSY_RX_BUF_LEN
+        self.progress_interval_s = 0.1
+        self.last_upload_time = 0.0
         
         self.EMIT_TIME = 0
     
     def connect_Serial(self,serial:Serial):
         self.itsy = serial
+        # could be a different itsy, nothing is known about what it holds
+        self.chirp_uploaded = False
+        self.uploaded_chirp = None
+        self.uploaded_crc = None
         self.itsy.timeout = 0.5
         self.connection_status()
         self.get_max_chirp_uint16_length()
@@ -178,29 +264,44 @@ class EchoEmitter:
             print(f"{t_colors.FAIL}FAILED TO CHIRP {msg}{t_colors.ENDC}")
             return False
 
-    def upload_chirp(self,data:np.uint16 = None)->bool:
-        self.itsy.flush()
+    def upload_chirp(self,data:np.uint16 = None,force:bool = False)->bool:
+        """Uploads data to the itsy and checks the CRC it sends back. Skipped when
+        the itsy already confirmed a chirp with the same length and CRC.
+
+        Args:
+            data (np.uint16): chirp in DAC counts
+            force (bool, optional): upload even if the itsy should already have it,
+                e.g. after it was power cycled. Defaults to False.
+
+        Returns:
+            bool: true if the itsy holds data afterwards
+        """
+        data_len = len(data)
+        
+        # the itsy rebuilds each sample from two bytes, low byte first
+        chirp_copy = np.array(data)
+        payload = chirp_copy.astype('<u2').tobytes()
+        OG_CRC = zlib.crc32(payload)
+        
         if not self.connection_status():
+            # can't tell what the itsy holds once it is gone, it may have been power cycled
+            self.chirp_uploaded = False
+            self.uploaded_chirp = None
+            self.uploaded_crc = None
             return False
         
+        if not force and self.chirp_uploaded and self.uploaded_crc == OG_CRC and self.EMIT_TIME == data_len:
+            print(f"{t_colors.OKGREEN}CHIRP ALREADY UPLOADED (CRC {OG_CRC:08x}){t_colors.ENDC}")
+            return True
+        
+        self.itsy.flush()
+        
         if not self.max_chirp_length:
             self.get_max_chirp_uint16_length()
         
-        write_data = []
-        copy_write = bytearray()
-        data_len = len(data)
-        
         if data_len > self.max_chirp_length:
             print(f"{t_colors.FAIL}DATA TOO LONG! given: {data_len} but max is {self.max_chirp_length} or {self.max_chirp_length*1e-3}ms!{t_colors.ENDC}")
             return False
-
-        
-        OG_CRC = zlib.crc32(data)
-
-        write_data = data.tolist()
-        for data in write_data:
-            copy_write.append(data &0xff)
-            copy_write.append((data>>8)&0xff)
         
         self.itsy.write([ECHO_SERIAL_CMD.CHIRP_DATA.value,data_len&0xff,data_len>>8&0xff])
         
@@ -220,25 +321,13 @@ class EchoEmitter:
             self.chirp_uploaded = False
             return False
             
-        # upload the chirp
-        hide_cursor()
-        for i in range(0,len(copy_write),20):
-            self.itsy.write([copy_write[i],copy_write[i+1],
-                             copy_write[i+2],copy_write[i+3],
-                             copy_write[i+4],copy_write[i+5],
-                             copy_write[i+6],copy_write[i+7],
-                             copy_write[i+8],copy_write[i+9],
-                             copy_write[i+10],copy_write[i+11],
-                             copy_write[i+12],copy_write[i+13],
-                             copy_write[i+14],copy_write[i+15],
-                             copy_write[i+16],copy_write[i+17],
-                             copy_write[i+18],copy_write[i+19]])
-            
-            if i % 20 == 0:
-                print(f"{t_colors.OKBLUE}Uploading{t_colors.ENDC}: {i/len(copy_write)*100:.1f}%",end='\r',flush=True)
-        print(f"{t_colors.OKBLUE}Uploading{t_colors.ENDC}: {100:.1f}%",end='\r',flush=True)
-        print()            
-        show_cursor()
+        # upload the chirp, whatever the itsy had is gone from here on
+        self.chirp_uploaded = False
+        self.uploaded_chirp = None
+        self.uploaded_crc = None
+        upload_start = time.perf_counter()
+        self._write_blocks(payload)
+        self.last_upload_time = time.perf_counter() - upload_start
                 
 
         # wait for an ack from itsy to say they got it
@@ -247,25 +336,61 @@ class EchoEmitter:
         if msg_recv != ECHO_SERIAL_CMD.ACK:
             print(f"{t_colors.FAIL}EXPECTED ACK {msg_recv}{t_colors.ENDC}")
             self.chirp_uploaded = False
-            return
+            return False
         
         # verify the chirp by reading it back
         print("Validating hash...")
         crc_back = self.itsy.read(4)
-        crc_back = (crc_back[0] | (crc_back[1]<<8) | (crc_back[2] << 16) | (crc_back[3] << 24))
+        if len(crc_back) != 4:
+            print(f"{t_colors.FAIL}TIMEOUT WAITING FOR HASH{t_colors.ENDC}")
+            self.chirp_uploaded = False
+            return False
+        crc_back = int.from_bytes(crc_back,'little')
 
 
         if crc_back == OG_CRC:
-            print(f"{t_colors.OKGREEN}SUCCESS, UPLOADED CHIRP!{t_colors.ENDC}")
+            rate = len(payload)/self.last_upload_time if self.last_upload_time > 0 else 0
+            print(f"{t_colors.OKGREEN}SUCCESS, UPLOADED CHIRP!{t_colors.ENDC} {len(payload)} bytes in {self.last_upload_time*1e3:.1f}ms ({rate*1e-3:.1f} kB/s)")
         else:
             print(f"{t_colors.FAIL}FAILED TO UPLOAD CHIRP{t_colors.ENDC}")
             self.chirp_uploaded = False
             return False
         
         self.chirp_uploaded = True
+        self.uploaded_chirp = chirp_copy
+        self.uploaded_crc = OG_CRC
         self.EMIT_TIME = data_len
+        return True
+    
+    def _write_blocks(self,payload:bytes)->None:
+        """Streams the chirp bytes in upload_block_len writes. Each block is flushed
+        out before the next one so no more than one receive buffer's worth is ever
+        in flight, the itsy only drains it as fast as it copies samples out.
+
+        Args:
+            payload (bytes): little endian uint16 chirp samples
+        """
+        view = memoryview(payload)
+        total = len(view)
+        block = self.upload_block_len
+        last_print = 0.0
+        
+        hide_cursor()
+        try:
+            for i in range(0,total,block):
+                self.itsy.write(view[i:i+block])
+                self.itsy.flush()
+                
+                # a progress line per block costs more than the block itself
+                now = time.perf_counter()
+                if now - last_print >= self.progress_interval_s:
+                    last_print = now
+                    print(f"{t_colors.OKBLUE}Uploading{t_colors.ENDC}: {i/total*100:.1f}%",end='\r',flush=True)
+            print(f"{t_colors.OKBLUE}Uploading{t_colors.ENDC}: {100:.1f}%",end='\r',flush=True)
+            print()
+        finally:
+            show_cursor()
 
- 
     def get_max_chirp_uint16_length(self) -> np.uint16:
         if not self.connection_status():
             return False
@@ -289,11 +414,7 @@ class EchoEmitter:
     
     
     def gen_chirp(self,f_start:int,f_end:int, t_end:int,method:str ='linear',gain:float = None,offset = None)->tuple[np.uint16,np.ndarray]:
-        Fs = 1e6
-        Ts = 1/Fs
-        t = np.arange(0,t_end*1e-3 - Ts/2,Ts)
-        chirp = signal.chirp(t,f_start,t_end*1e-3,f_end,method)
-        chirp = self.convert_and_range_data(chirp,gain,offset)
+        chirp,t = cached_chirp(f_start,f_end,t_end,method,*self._gain_offset(gain,offset))
 
         self.last_upload_type = LAST_CHIRP_DATA.CUSTOM
         self.last_f0 = f_start
@@ -304,13 +425,7 @@ class EchoEmitter:
         return [chirp,t]
     
     def gen_sine(self,time_ms:np.uint16, freq:np.uint16,gain:float = None,offset = None)->tuple[np.uint16,np.ndarray]:
-        DATA_LEN = int(time_ms*1e3)
-        duration = DATA_LEN / 1e6  # Duration of the sine wave (in seconds)
-        
-        t = np.linspace(0, duration, DATA_LEN, endpoint=False)
-        
-        sin_wave = np.sin(2 * np.pi * freq *t)
-        sin_wave = self.convert_and_range_data(sin_wave,gain,offset)
+        sin_wave,t = cached_sine(time_ms,freq,*self._gain_offset(gain,offset))
         
         self.last_upload_type = LAST_CHIRP_DATA.CUSTOM
         self.last_f0 = freq
@@ -320,10 +435,7 @@ class EchoEmitter:
         
         return [sin_wave,t]
     
-    def convert_and_range_data(self,data:np.ndarray,gain:float = None,offset:float =None)->np.uint16:
-        data = data - np.min(data)
-        data = data/np.max(data)
-        
+    def _gain_offset(self,gain:float = None,offset:float = None)->tuple[float,float]:
         g = self.SIG_GAIN
         if gain is not None:
             g = gain
@@ -331,22 +443,39 @@ class EchoEmitter:
         of = self.SIG_OFFSET
         if offset is not None:
             of = offset
-            
-        data = data*g + of
         
-
-        return data.astype(np.uint16)
+        return g,of
+    
+    def convert_and_range_data(self,data:np.ndarray,gain:float = None,offset:float =None)->np.uint16:
+        return range_to_dac(data,*self._gain_offset(gain,offset))
     
     def get_and_convert_numpy(self,file_name:str,gain:float = None,offset = None)->np.uint16:
         if not os.path.exists(file_name):
             print(f"File does not exist!")
             return None
-        data = np.load(file_name)
-        data = self.convert_and_range_data(data,gain,offset)
+        data = cached_file(file_name,*self._gain_offset(gain,offset))
         
         self.last_upload_type = LAST_CHIRP_DATA.FILE
         self.last_filename = file_name
         return data
+    
+    def use_library_chirp(self,chirp)->np.uint16:
+        """Picks a precomputed chirp from a bb_chirplib.ChirpLibrary, nothing is generated
+
+        Args:
+            chirp (bb_chirplib.LibraryChirp): chirp from the library
+
+        Returns:
+            np.uint16: its samples, ready for upload_chirp
+        """
+        self.last_upload_type = LAST_CHIRP_DATA.LIBRARY
+        self.last_f0 = chirp.f0
+        self.last_f1 = chirp.f1
+        self.last_tend = chirp.t_end
+        self.last_method = chirp.method
+        self.last_filename = chirp.source
+        self.library_chirp = chirp
+        return chirp.samples
 
     def save_chirp_info(self,file_path:str)->bool:
         if not file_path.endswith(".txt"):
@@ -358,6 +487,8 @@ class EchoEmitter:
                 f.write(f"START FREQ: {self.last_f0} END FREQ: {self.last_f1} DURATION MS: {self.last_tend} METHOD: {self.last_method}\n")
             elif self.last_upload_type == LAST_CHIRP_DATA.FILE:
                 f.write(f"FILE USED: {self.last_filename}")
+            elif self.last_upload_type == LAST_CHIRP_DATA.LIBRARY:
+                f.write(f"LIBRARY CHIRP: {self.library_chirp.name} {self.library_chirp.describe()}\n")
             else:
                 f.write(f"WARNING UNKNOWN CHIRP!!\n")
                 return False
@@ -35,7 +35,7 @@ from PyQt6.QtWidgets import (
     
 
 )
-from PyQt6.QtCore import Qt, QFile, QTextStream, QThread, pyqtSignal,QObject
+from PyQt6.QtCore import Qt, QFile, QTextStream, QThread, QTimer, pyqtSignal,QObject
 from PyQt6.QtSerialPort import QSerialPortInfo
 from PyQt6.QtGui import QIcon
 
@@ -61,8 +61,13 @@ import pyqtgraph as pg
 import bb_listener
 import bb_emitter
 import bb_gps
+import bb_acquire
+from bb_runfile import RunWriter
+import bb_chirplib
+import bb_trajectory
 import threading
 from serial_helper import get_port_from_serial_num
+from bb_spec import SpecView
 
 
 # showing plots in qt from matlab
@@ -83,62 +88,6 @@ def remove_colorbars(fig):
                 child.remove()
 
 
-def plot_spec(ax:plt.axes, fig:plt.figure, spec_tup, fbounds = (30E3, 100E3), dB_range = 40, plot_title = 'spec',use_cb=True):
-    
-    fmin, fmax = fbounds
-    s, f, t = spec_tup
-    
-    lfc = (f >= fmin).argmax()
-    s = 20*np.log10(s)
-    f_cut = f[lfc:]
-    s_cut = s[:][lfc:]
-
-    
-    max_s = np.amax(s_cut)
-    s_cut = s_cut - max_s
-    
-    [rows_s, cols_s] = np.shape(s_cut)
-    
-    dB = -dB_range
-    
-    for col in range(cols_s):
-        for row in range(rows_s):
-            if s_cut[row][col] < dB:
-                s_cut[row][col] = dB
-                
-    cf = ax.pcolormesh(t, f_cut, s_cut, cmap='jet', shading='auto')
-    
-    if use_cb:
-        cbar = fig.colorbar(cf, ax=ax)
-        cbar.ax.set_ylabel('dB')
-    
-    ax.set_ylim(fmin, fmax)
-    ax.set_yticks(range(30000, 100000 + 1, 10000))
-    ax.set_ylabel('Frequency (Hz)')
-    ytick_labels = [f'{int(val)} kHz' for val in ax.get_yticks()/1000]
-    ax.set_yticks(ax.get_yticks())
-    ax.set_yticklabels(ytick_labels)
-    ax.set_ylim(fmin, fmax)
-    ax.set_xlabel('Time (sec)')
-    ax.title.set_text(plot_title)
-
-
-
-
-def process(raw, spec_settings, time_offs = 0):
-
-    unraw_balanced = raw - np.mean(raw)
-    # unraw_balanced = raw
-    
-    pt_cut = unraw_balanced[time_offs:]
-    remainder = unraw_balanced[:time_offs]
-    
-    Fs, NFFT, noverlap, window = spec_settings
-    spec_tup = mlab.specgram(pt_cut, Fs=Fs, NFFT=NFFT, noverlap=noverlap, window=window)
-    
-    return spec_tup, pt_cut, remainder
-
-
 class ComboBox(QComboBox):
     popupAboutToBeShown = pyqtSignal()
 
@@ -152,7 +101,8 @@ import logging
 logging.basicConfig(level=logging.DEBUG)
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')) )
-from pinnae import PinnaeController
+from pinnae import PinnaeController, PinnaPair
+from bb_sched import DeadlineScheduler
 
 try:
     from spidev import SpiDev
@@ -164,6 +114,13 @@ except ImportError:
 DAC_ADC_FREQ = 1e6
 
 NUM_PINNAE = 7
+# instruction table column each motor of an ear plays when both ears run, the
+# right ear's motor 6 takes motor 7's column, an ear on its own plays LEFT_EAR_COLUMNS
+LEFT_EAR_COLUMNS = (0,1,2,3,4,5,6)
+RIGHT_EAR_COLUMNS = (0,1,2,3,4,6,6)
+
+# most spectrogram redraws per second during a run
+MAX_REDRAW_FPS = 25
 
 
 class BBGUI(QWidget):
@@ -183,11 +140,12 @@ class BBGUI(QWidget):
     instructionThread = None
     instructionThreadRunning = False
     
+    acquisitionWorker = None
+    latest_frame = None
+    
     gpsThread = None
     gpsThreadRunning = False
     
-    left_pinna_plotted = False
-    right_pinna_plotted = False
 
     dir_path = os.path.dirname(os.path.realpath(__file__))
 
@@ -214,6 +172,9 @@ class BBGUI(QWidget):
         # dir_path = os.path.dirname(os.path.realpath(__file__))
         with open(self.dir_path+'/bb_conf.yaml',"r") as f:
             self.bb_config = yaml.safe_load(f)
+        
+        self.chirp_lib = None
+        self.load_chirp_library()
 
 
         
@@ -524,6 +485,12 @@ class BBGUI(QWidget):
         self.chirp_offset_SB.setPrefix("Offset ")
         chirp_grid.addWidget(self.chirp_offset_SB,1,6)
         
+        # precomputed chirp, custom uses the settings above
+        self.chirp_library_CB = QComboBox()
+        self.chirp_library_CB.addItem('custom')
+        chirp_grid.addWidget(QLabel("Library:"),2,0)
+        chirp_grid.addWidget(self.chirp_library_CB,2,1,1,3)
+        
         
         # upload to board
         self.upload_chirp_PB = QPushButton("Upload")
@@ -534,6 +501,11 @@ class BBGUI(QWidget):
         self.run_PB.clicked.connect(self.run_PB_Clicked)
         chirp_grid.addWidget(self.run_PB,1,7)
         
+        self.stop_run_PB = QPushButton("STOP")
+        self.stop_run_PB.clicked.connect(self.stop_run_PB_Clicked)
+        self.stop_run_PB.setEnabled(False)
+        chirp_grid.addWidget(self.stop_run_PB,2,7)
+        
         self.times_to_chirp_SB = QSpinBox()
         self.times_to_chirp_SB.setSuffix(' chirps')
         self.times_to_chirp_SB.setRange(1,2000)
@@ -861,6 +833,20 @@ class BBGUI(QWidget):
             
 
 
+    def load_chirp_library(self):
+        """Maps the chirp library from bb_conf.yaml and lists its chirps"""
+        lib_cfg = self.bb_config.get('chirp_library') if self.bb_config else None
+        if not lib_cfg:
+            return
+        try:
+            self.chirp_lib = bb_chirplib.open_library(os.path.join(self.dir_path,lib_cfg['spec']),
+                                                      os.path.join(self.dir_path,lib_cfg['file']))
+        except Exception as e:
+            logging.error(f"failed to open chirp library: {e}")
+            return
+        for name in self.chirp_lib.names:
+            self.chirp_library_CB.addItem(name)
+
     def upload_chirp_PB_Clicked(self):
         """ when clicked"""
         
@@ -869,6 +855,12 @@ class BBGUI(QWidget):
             win.showMessage("EMITTER IS NOT CONNECTED!")
             return
         
+        lib_name = self.chirp_library_CB.currentText()
+        if self.chirp_lib is not None and lib_name in self.chirp_lib:
+            s = self.emitter.use_library_chirp(self.chirp_lib[lib_name])
+            self.emitter.upload_chirp(s)
+            return
+        
         gain = self.chirp_gain_SB.value()
         offset = self.chirp_offset_SB.value()
         
@@ -880,66 +872,70 @@ class BBGUI(QWidget):
         self.emitter.upload_chirp(s)
         
     def run_PB_Clicked(self):
-        """ """
+        """Starts a run on the acquisition worker, the UI thread only redraws"""
         
         if not self.listener_connect_PB.isChecked():
             win = QErrorMessage(self)
             win.showMessage("LISTENER IS NOT CONNECTED!")
             return
-
-        count = 0
         
-        Fs = 1e6
-        NFFT = 512
-        noverlap = 400
-        spec_settings = (Fs, NFFT, noverlap, signal.windows.hann(NFFT))
-        DB_range = 40
-        f_plot_bounds = (30E3, 100E3)
+        if self.acquisitionWorker is not None and self.acquisitionWorker.isRunning():
+            return
         
         listen_time = self.time_to_listen_SB.value()
         times_to_chirp = self.times_to_chirp_SB.value()
         
-        
-        
         cur_time = self.get_current_time_str()
         cur_dir = self.runs_path+f"/{cur_time}"
         os.makedirs(cur_dir)
         self.emitter.save_chirp_info(cur_dir+"/chirp_info.txt")
         
-        while True:
-            raw,L,R = self.listener.listen(listen_time)
-            
-            np.save(cur_dir+f"/left_ear_{count}.npy",L)
-            np.save(cur_dir+f"/right_ear_{count}.npy",R)
-            # np.save(self.runs_path+f"/left_ear_{count}.npy",L)
-            # np.save(self.runs_path+f"/right_ear_{count}.npy",R)
-            
-            time_off = int(self.time_off_SB.value()*1000)
-            times_plot = self.plot_frequency_SB.value()
-            
-            
-            
-            if count % times_plot == 0:
-                spec_tup1, pt_cut1, pt1 = process(L, spec_settings, time_offs=time_off)
-                spec_tup2, pt_cut2, pt2 = process(R, spec_settings, time_offs=time_off)
-                self.leftPinnaeSpec.axes.cla()  # Clear the canva
-                plot_spec(self.leftPinnaeSpec.axes, self.leftPinnaeSpec.figure, spec_tup1, fbounds = f_plot_bounds, dB_range = DB_range, plot_title='Left Pinna',use_cb=not self.left_pinna_plotted)
-                self.leftPinnaeSpec.draw()
-                self.leftPinnaeSpec.axes.set_ybound(30e3,100e3)
-                self.leftPinnaeSpec.figure.tight_layout()
-                
-                self.rightPinnaeSpec.axes.cla()  # Clear the canvas.
-                plot_spec(self.rightPinnaeSpec.axes, self.rightPinnaeSpec.figure, spec_tup2, fbounds = f_plot_bounds, dB_range = DB_range, plot_title='Right Pinna',use_cb= not self.right_pinna_plotted)
-                self.rightPinnaeSpec.draw()
-                self.rightPinnaeSpec.figure.tight_layout()
-                
-                # self.echo_GB.update()
-                self.left_pinna_plotted = self.right_pinna_plotted = True
-                QApplication.processEvents()
-            
-            if count >= times_to_chirp:
-                break
-            count +=1
+        self.latest_frame = None
+        self.acquisitionWorker = AcquisitionWorker(self.listener,listen_time,times_to_chirp+1,cur_dir,self.plot_frequency_SB.value())
+        self.acquisitionWorker.frame_ready.connect(self.acquisition_frame_ready_callback)
+        self.acquisitionWorker.run_finished.connect(self.acquisition_finished_callback)
+        
+        self.run_PB.setEnabled(False)
+        self.stop_run_PB.setEnabled(True)
+        self.acquisitionWorker.start()
+        self.redraw_timer.start()
+        
+    def stop_run_PB_Clicked(self):
+        """Ends the run after the current ping, everything captured is still saved"""
+        if self.acquisitionWorker is not None:
+            self.acquisitionWorker.stop()
+        self.stop_run_PB.setEnabled(False)
+            
+    def acquisition_frame_ready_callback(self,frame):
+        # only keep the newest, the redraw timer decides when to draw it
+        self.latest_frame = frame
+        
+    def acquisition_finished_callback(self,stats:dict):
+        self.redraw_timer.stop()
+        self.redraw_spec()
+        self.run_PB.setEnabled(True)
+        self.stop_run_PB.setEnabled(False)
+        
+        if stats['error'] is not None:
+            win = QErrorMessage(self)
+            win.showMessage(f"Run stopped: {stats['error']}")
+        print(f"Listen rate: {stats['listen_rate']:.2f} cycles/s, "
+              f"captured: {stats['captured']} written: {stats['written']}, "
+              f"backpressure: {stats['backpressure_events']}, "
+              f"plot dropped: {stats['plot_dropped']}/{stats['plot_offered']}")
+        
+    def redraw_spec(self):
+        """Draws the newest frame from the worker, called from redraw_timer"""
+        frame = self.latest_frame
+        if frame is None:
+            return
+        self.latest_frame = None
+        
+        time_off = int(self.time_off_SB.value()*1000)
+        
+        s, f, t = frame.spectrogram(self.spec_settings, time_offs=time_off)
+        self.leftSpecView.update((s[0], f, t))
+        self.rightSpecView.update((s[1], f, t))
     
 
         
@@ -1140,6 +1136,14 @@ class BBGUI(QWidget):
         self.cycle_counter_SB.setEnabled(False)
         table_side_grid.addWidget(self.cycle_counter_SB,3,1)
         
+        # keyframes played as they are, or compiled into a dense trajectory
+        table_side_grid.addWidget(QLabel("Interp:"),4,0)
+        self.interpolation_CB = QComboBox()
+        self.interpolation_CB.addItems(bb_trajectory.METHODS)
+        table_side_grid.addWidget(self.interpolation_CB,4,1)
+        # movement file the table was loaded from or saved to, its compiled trajectory is cached
+        self.movement_file = None
+        
         # out of phase option
         # self.ear_phase_CB = QCheckBox("PHASE EARS")
         # self.ear_phase_CB.pressed.connect(self.ear_phase_CB_cb)
@@ -1207,6 +1211,7 @@ class BBGUI(QWidget):
                 
             with open(file_path,'w') as f:
                 yaml.dump(data,f)
+            self.movement_file = file_path
         else:
             print("no save")    
     
@@ -1246,6 +1251,7 @@ class BBGUI(QWidget):
                         self.instruction_TABLE.setItem(row,col,newItem)    
                 
                 self.intstruction_speed_SB.setValue(int(yam_file["pinna_movements"]["speed"]))
+                self.movement_file = file_path
                         
                     
                     
@@ -1356,6 +1362,47 @@ class BBGUI(QWidget):
             self.instruction_TABLE.setItem(row,column,newItem)
             logging.debug("Clamped value min")
         
+    def compile_instructions(self,dataArray:np.int16)->tuple[np.int16,float]:
+        """Turns the table's keyframes into what the instruction thread plays
+
+        Args:
+            dataArray (np.int16): (rows, NUM_PINNAE) keyframes from the table
+
+        Returns:
+            tuple[np.int16,float]: angles for each step, steps per second
+        """
+        speed = self.intstruction_speed_SB.value()
+        method = self.interpolation_CB.currentText()
+        if method == 'step':
+            return dataArray,speed
+        
+        # clamp every column to what the motors playing it can reach, on each selected ear
+        selected = self.selected_pinna_QB.currentText()
+        if selected == 'both':
+            ears = [(self.left_pinna,LEFT_EAR_COLUMNS),(self.right_pinna,RIGHT_EAR_COLUMNS)]
+        else:
+            # one ear alone plays the table as is, see RunInstructionsThread
+            ears = [(self.left_pinna if selected == 'left' else self.right_pinna,LEFT_EAR_COLUMNS)]
+        limits = [bb_trajectory.column_limits(p.min_angle_limits,p.max_angle_limits,columns) for p,columns in ears]
+        min_limits = np.max([lo for lo,hi in limits],axis=0)
+        max_limits = np.min([hi for lo,hi in limits],axis=0)
+        if (min_limits > max_limits).any():
+            logging.warning(f"no angle fits both ears' limits in columns {np.flatnonzero(min_limits > max_limits)}, those steps will be rejected")
+        rate = bb_trajectory.DEFAULT_RATE_HZ
+        
+        try:
+            keyframes,file_speed = bb_trajectory.load_movements(self.movement_file) if self.movement_file else (None,None)
+        except (OSError,ValueError,yaml.YAMLError):
+            keyframes,file_speed = None,None
+        if keyframes is not None and file_speed == speed and np.array_equal(keyframes,dataArray):
+            # table is still what the file holds, use the cache next to it
+            trajectory = bb_trajectory.cached_trajectory(bb_trajectory.cache_path(self.movement_file),keyframes,speed,rate,method,min_limits,max_limits)
+        else:
+            trajectory = bb_trajectory.compile_trajectory(dataArray,speed,rate,method,min_limits,max_limits)
+        logging.debug(f"compiled {len(dataArray)} keyframes into {len(trajectory)} {method} steps at {rate} Hz")
+        # a copy, the cache file can be rewritten while this plays
+        return np.array(trajectory),rate
+    
     def start_stop_instruction_PB_pressed_CB(self):
         if not self.instructionThreadRunning:
             rows = self.instruction_TABLE.rowCount()
@@ -1372,14 +1419,15 @@ class BBGUI(QWidget):
                  
         
              # print(dataArray)
+            dataArray,rate = self.compile_instructions(dataArray)
             if self.selected_pinna_QB.currentText() == 'left':
-                self.instructionThread = RunInstructionsThread(dataArray,self.intstruction_speed_SB.value(),self.left_pinna)
+                self.instructionThread = RunInstructionsThread(dataArray,rate,self.left_pinna)
                 
             elif self.selected_pinna_QB.currentText() == 'right':
-                self.instructionThread = RunInstructionsThread(dataArray,self.intstruction_speed_SB.value(),self.right_pinna)
+                self.instructionThread = RunInstructionsThread(dataArray,rate,self.right_pinna)
                 
             elif self.selected_pinna_QB.currentText() == 'both':
-                self.instructionThread = RunInstructionsThread(dataArray,self.intstruction_speed_SB.value(),self.left_pinna,self.right_pinna)
+                self.instructionThread = RunInstructionsThread(dataArray,rate,self.left_pinna,self.right_pinna)
                 
             self.instructionThread.start()
             self.instructionThread.cycle_complete.connect(self.cycle_complete_emit_callback)
@@ -1813,6 +1861,19 @@ class BBGUI(QWidget):
         hLay.addWidget(self.rightPinnaeSpec)
         vLay.addLayout(hLay)
         self.echo_GB.setLayout(vLay)
+        
+        # Fs, NFFT, noverlap, window, fixed for every run
+        NFFT = 512
+        self.spec_settings = (1e6, NFFT, 400, signal.windows.hann(NFFT))
+        
+        # the spectrograms are built on the first frame and updated in place after
+        self.leftSpecView = SpecView(self.leftPinnaeSpec.axes, fbounds=(30E3, 100E3), dB_range=40, plot_title='Left Pinna',khz_ticks=True,tight_layout=True)
+        self.rightSpecView = SpecView(self.rightPinnaeSpec.axes, fbounds=(30E3, 100E3), dB_range=40, plot_title='Right Pinna',khz_ticks=True,tight_layout=True)
+        
+        # redraws are capped so drawing never sets the ping rate
+        self.redraw_timer = QTimer(self)
+        self.redraw_timer.setInterval(int(1000/MAX_REDRAW_FPS))
+        self.redraw_timer.timeout.connect(self.redraw_spec)
  
 
     def Add_Echo_GB(self):
@@ -1826,6 +1887,9 @@ class BBGUI(QWidget):
         
     def closeEvent(self,event):
         plt.close('all')
+        if self.acquisitionWorker is not None and self.acquisitionWorker.isRunning():
+            self.acquisitionWorker.stop()
+            self.acquisitionWorker.wait()
         try:
             self.listener.disconnect_serial()
         except:
@@ -1848,6 +1912,40 @@ class BBGUI(QWidget):
             pass
         event.accept()
         
+class AcquisitionWorker(QThread):
+    """Runs the listen/save loop off the UI thread, frames for the plots come
+    out through frame_ready as StereoCapture copies.
+    """
+    frame_ready = pyqtSignal(object)
+    run_finished = pyqtSignal(dict)
+    
+    def __init__(self,listener:bb_listener.EchoRecorder,listen_time_ms:int,num_pings:int,save_dir:str,plot_every:int = 1):
+        QThread.__init__(self)
+        self.save_dir = save_dir
+        self.run_file = RunWriter(save_dir+"/run.bbrun",sample_freq=listener.sample_freq)
+        self.pipeline = bb_acquire.AcquisitionPipeline(listener,listen_time_ms,num_pings,
+                                                       write_fun=self.write_frame,plot_every=plot_every)
+        
+    def write_frame(self,frame:bb_acquire.AcqFrame):
+        self.run_file.append_capture(frame.capture,frame.timestamp)
+        
+    def run(self):
+        logging.debug("AcquisitionWorker starting")
+        self.pipeline.start()
+        while self.pipeline.is_running():
+            frame = self.pipeline.get_plot_frame(timeout=0.05)
+            if frame is not None:
+                # plot frames are already copies out of the capture ring
+                self.frame_ready.emit(frame.capture)
+        self.pipeline.join()
+        self.run_file.close()
+        self.run_finished.emit(self.pipeline.stats())
+        logging.debug("AcquisitionWorker exiting")
+        
+    def stop(self):
+        self.pipeline.stop()
+        
+        
 class RunInstructionsThread(QThread):
     cycle_complete = pyqtSignal(int)
     end_motor_angles = pyqtSignal(list)
@@ -1856,32 +1954,46 @@ class RunInstructionsThread(QThread):
         QThread.__init__(self)
         self.data = dataArray
         self.timeBetween = 1/freq
+        # steps go out on fixed deadlines, the time spent sending doesn't slow the rate
+        self.scheduler = DeadlineScheduler(self.timeBetween)
         self.runThread = True
         self.curIndex = 0
         self.maxIndex = len(dataArray)
         self.l_pinna = l_pinna
         self.r_pinna = r_pinna
         self.cycle_count = 0
+        # steps a controller refused as out of its limits
+        self.rejected = 0
+        # both ears go out back to back in one update
+        self.pair = PinnaPair(l_pinna,r_pinna) if r_pinna is not None else None
         
     def run(self):
         logging.debug("RunInstructionsThread starting")
-        right_data = self.data
-        if self.r_pinna is not None:
-            right_data[:,5] = self.data[:,6]
+        if self.pair is not None:
+            pair_data = np.stack((self.data[:,LEFT_EAR_COLUMNS],self.data[:,RIGHT_EAR_COLUMNS]),axis=1)
             
+        self.scheduler.start()
         while self.runThread:
-            self.l_pinna.set_motor_angles(self.data[self.curIndex])
-            self.r_pinna.set_motor_angles(right_data[self.curIndex])
+            self.scheduler.wait()
+            if self.pair is not None:
+                sent = self.pair.set_motor_angles(pair_data[self.curIndex])
+            else:
+                sent = self.l_pinna.set_motor_angles(self.data[self.curIndex])
+            if not sent:
+                self.rejected += 1
             
-            print(self.data[self.curIndex])
             self.curIndex+=1
             if self.curIndex >= self.maxIndex:
                 self.curIndex = 0
                 self.cycle_count += 1
                 self.cycle_complete.emit(self.cycle_count)
-            
-            time.sleep(self.timeBetween)
         
+        logging.debug(f"RunInstructionsThread {self.scheduler.report()}")
+        if self.rejected:
+            logging.warning(f"RunInstructionsThread {self.rejected} steps were out of the motor limits and not sent")
+        if self.pair is not None:
+            stats = self.pair.skew_stats()
+            logging.debug(f"inter ear skew mean {stats['skew_mean']*1e6:.1f} us, p99 {stats['skew_p99']*1e6:.1f} us, max {stats['skew_max']*1e6:.1f} us")
         self.end_motor_angles.emit(self.l_pinna.current_angles)
         logging.debug("RunInstructionsThread exiting")
         
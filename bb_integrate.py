@@ -0,0 +1,267 @@
+"""Coherent integration of many pings into one low noise capture
+
+    Each ping is folded into a preallocated float32 accumulator as soon as it
+    is captured, either a running sum or a Welford running mean and variance
+    per ear and sample. No ping is kept after it is added and only the shifts
+    of the last shift_history pings are, so the number of pings is limited by
+    time and not by memory. Pings can be aligned first by
+    cross correlating with the chirp, the strongest match (usually the
+    emitter's own chirp) is shifted to where it was in the first ping. Both
+    ears get the same shift so the interaural delay is kept.
+    """
+
+import time
+import numpy as np
+
+import bb_listener
+from bb_echo import EchoRanger
+from bb_stereo import StereoCapture
+
+
+class CoherentIntegrator:
+
+    def __init__(self,n_samples:int,chirp:np.ndarray = None,max_shift:int = 0,search_len:int = None,
+                 welford:bool = True,sample_freq:float = 1e6,channels:int = 2,shift_history:int = 4096) -> None:
+        """Accumulator for pings of n_samples per ear
+
+        Args:
+            n_samples (int): samples per ear in every ping
+            chirp (np.ndarray, optional): chirp to align pings with, None adds them as they come. Defaults to None.
+            max_shift (int, optional): most samples a ping is moved to line up, 0 turns alignment off. Defaults to 0.
+            search_len (int, optional): samples from the start searched for the chirp, None searches the whole ping. Defaults to None.
+            welford (bool, optional): keep a running variance too, otherwise only a running sum. Defaults to True.
+            sample_freq (float, optional): sample rate of each ear. Defaults to 1e6.
+            channels (int, optional): ears per ping. Defaults to 2.
+            shift_history (int, optional): most recent shifts kept, shift_stats covers every ping. Defaults to 4096.
+        """
+        self.shape = (channels,n_samples)
+        self.n_samples = n_samples
+        self.sample_freq = sample_freq
+        self.welford = welford
+
+        # mean for welford, sum otherwise
+        self.acc = np.zeros(self.shape,dtype=np.float32)
+        self.m2 = np.zeros(self.shape,dtype=np.float32) if welford else None
+        # work buffers, nothing is allocated per ping
+        self.x = np.empty(self.shape,dtype=np.float32)
+        self.delta = np.empty(self.shape,dtype=np.float32) if welford else None
+
+        self.count = 0
+        self.skipped = 0
+        self._shifts = np.zeros(shift_history,dtype=np.int32)
+        self.shift_min = 0
+        self.shift_max = 0
+        self._shift_sum = 0
+        self._shift_sq = 0
+
+        self.ranger = None
+        self.ref_lag = None
+        self.max_shift = max_shift
+        if chirp is not None and max_shift > 0:
+            self.search_len = n_samples if search_len is None else min(search_len,n_samples)
+            if self.search_len < len(chirp):
+                raise ValueError(f"search_len {self.search_len} is shorter than the chirp {len(chirp)}")
+            self.ranger = EchoRanger(chirp,sample_freq)
+
+    @property
+    def shifts(self)->list[int]:
+        """Shifts of the most recent pings, oldest first"""
+        kept = min(self.count,len(self._shifts))
+        start = self.count - kept
+        return [int(self._shifts[i % len(self._shifts)]) for i in range(start,self.count)]
+
+    def _record_shift(self,shift:int)->None:
+        self._shifts[self.count % len(self._shifts)] = shift
+        if self.count == 0 or shift < self.shift_min:
+            self.shift_min = shift
+        if self.count == 0 or shift > self.shift_max:
+            self.shift_max = shift
+        self._shift_sum += shift
+        self._shift_sq += shift*shift
+
+    def shift_stats(self)->dict:
+        """Shifts over every ping added, in samples
+
+        Returns:
+            dict: count, mean, std, min and max, all zero before the first ping
+        """
+        if self.count == 0:
+            return {'count': 0,'mean': 0.0,'std': 0.0,'min': 0,'max': 0}
+        mean = self._shift_sum/self.count
+        return {
+            'count': self.count,
+            'mean': mean,
+            'std': float(np.sqrt(max(self._shift_sq/self.count - mean*mean,0.0))),
+            'min': self.shift_min,
+            'max': self.shift_max,
+        }
+
+    def _find_shift(self,data:np.ndarray)->int:
+        """Samples this ping is late compared to the first one"""
+        env = self.ranger.correlate(data[:,:self.search_len]).sum(axis=0)
+        if self.ref_lag is None:
+            self.ref_lag = int(np.argmax(env))
+            return 0
+        lo = max(self.ref_lag - self.max_shift,0)
+        hi = self.ref_lag + self.max_shift + 1
+        return lo + int(np.argmax(env[lo:hi])) - self.ref_lag
+
+    def _load(self,data:np.ndarray,shift:int)->None:
+        """Copies the ping into x moved back by shift, the gap is filled with the ping's mean"""
+        x = self.x
+        n = self.n_samples
+        if shift == 0:
+            x[...] = data
+            return
+        fill = data.mean(axis=1,keepdims=True)
+        if shift > 0:
+            x[:,:n - shift] = data[:,shift:]
+            x[:,n - shift:] = fill
+        else:
+            x[:,-shift:] = data[:,:n + shift]
+            x[:,:-shift] = fill
+
+    def add(self,capture)->bool:
+        """Folds one ping into the accumulator
+
+        Args:
+            capture (StereoCapture | np.ndarray): the ping, or its (channels, n_samples) samples
+
+        Returns:
+            bool: false if the ping had the wrong length and was skipped
+        """
+        data = capture.data if isinstance(capture,StereoCapture) else np.asarray(capture)
+        if data.shape != self.shape:
+            # a listen that timed out comes back short
+            self.skipped += 1
+            return False
+
+        shift = self._find_shift(data) if self.ranger is not None else 0
+        self._record_shift(shift)
+        self._load(data,shift)
+        self.count += 1
+
+        if not self.welford:
+            self.acc += self.x
+            return True
+
+        # welford, with x - new_mean = delta*(1 - 1/k) so x can be reused
+        k = self.count
+        np.subtract(self.x,self.acc,out=self.delta)
+        np.multiply(self.delta,self.delta,out=self.x)
+        self.x *= np.float32(1 - 1/k)
+        self.m2 += self.x
+        self.delta *= np.float32(1/k)
+        self.acc += self.delta
+        return True
+
+    def mean(self)->np.ndarray:
+        """(channels, n_samples) mean of every ping added so far, a copy"""
+        if self.welford or self.count == 0:
+            return self.acc.copy()
+        return self.acc/np.float32(self.count)
+
+    def variance(self)->np.ndarray:
+        """(channels, n_samples) sample variance per sample, needs welford and two pings
+
+        Returns:
+            np.ndarray: variance or None
+        """
+        if not self.welford or self.count < 2:
+            return None
+        return self.m2/np.float32(self.count - 1)
+
+    def capture(self)->StereoCapture:
+        """The integrated ping, ready for spectrograms or EchoRanger"""
+        return StereoCapture(self.mean(),self.sample_freq)
+
+    def save(self,directory:str)->None:
+        """Saves left_ear.npy/right_ear.npy of the mean, the variance and the recent shifts
+
+        Args:
+            directory (str): folder to save in
+        """
+        self.capture().save(directory,suffix="_integrated")
+        var = self.variance()
+        if var is not None:
+            np.save(directory+"/variance_integrated.npy",var)
+        np.save(directory+"/shifts_integrated.npy",np.array(self.shifts,dtype=np.int32))
+
+
+def integrate_pings(recorder:bb_listener.EchoRecorder,listen_time_ms:int,pings:int = None,duration_s:float = None,
+                    chirp:np.ndarray = None,max_shift:int = 0,search_len:int = None,welford:bool = True,
+                    max_skips:int = 10)->CoherentIntegrator:
+    """Listens back to back on one session and integrates every ping. The
+    accumulator is sized for a complete listen, short pings are skipped.
+
+    Args:
+        recorder (bb_listener.EchoRecorder): listener to read from
+        listen_time_ms (int): time to listen for each ping
+        pings (int, optional): pings to integrate. Defaults to None.
+        duration_s (float, optional): stop after this long, with pings None it alone sets the length. Defaults to None.
+        chirp (np.ndarray, optional): chirp to align with, see CoherentIntegrator. Defaults to None.
+        max_shift (int, optional): most samples a ping is moved. Defaults to 0.
+        search_len (int, optional): samples searched for the chirp. Defaults to None.
+        welford (bool, optional): keep the variance too. Defaults to True.
+        max_skips (int, optional): stop after this many short pings in a row, fewer than pings
+            may have been integrated then. Defaults to 10.
+
+    Returns:
+        CoherentIntegrator: the accumulator, None if the listener did not answer
+    """
+    if pings is None and duration_s is None:
+        raise ValueError("give pings, duration_s or both")
+
+    integrator = CoherentIntegrator(recorder.samples_per_ear(listen_time_ms),chirp,max_shift,search_len,
+                                    welford,recorder.sample_freq)
+    with recorder.session() as listen_session:
+        if not listen_session.connected:
+            return None
+
+        start = time.perf_counter()
+        skips = 0
+        while skips < max_skips:
+            if pings is not None and integrator.count >= pings:
+                break
+            if duration_s is not None and time.perf_counter() - start >= duration_s:
+                break
+
+            ret = listen_session.listen(listen_time_ms)
+            if ret is None:
+                break
+            skips = 0 if integrator.add(recorder.to_capture(ret[0])) else skips + 1
+
+    return integrator
+
+
+if __name__ == '__main__':
+    from scipy import signal
+
+    # 30ms pings with a 3ms chirp and an echo 20 dB under the noise
+    Fs = 1e6
+    t = np.arange(0,3e-3,1/Fs)
+    chirp = (signal.chirp(t,100e3,3e-3,30e3)*512 + 2048).astype(np.uint16)
+    template = chirp - np.mean(chirp)
+    n = 30000
+    pings = 200
+
+    rng = np.random.default_rng(0)
+    clean = np.full((2,n),2048.0)
+    clean[:,1000:1000 + len(template)] += template
+    clean[:,15000:15000 + len(template)] += 0.05*template
+
+    integrator = CoherentIntegrator(n,chirp,max_shift=50,search_len=6000)
+    add_time = 0.0
+    for i in range(pings):
+        # everything lines up with the first ping, keep that one where it was
+        jitter = int(rng.integers(-20,21)) if i else 0
+        ping = np.roll(clean,jitter,axis=1) + rng.normal(scale=256,size=(2,n))
+        start = time.perf_counter()
+        integrator.add(ping.astype(np.uint16))
+        add_time += time.perf_counter() - start
+
+    echo = slice(15000,15000 + len(template))
+    single = np.std(ping[0,echo] - clean[0,echo])
+    residual = np.std(integrator.mean()[0,echo] - clean[0,echo])
+    print(f"add: {add_time/pings*1e3:.3f} ms/ping, buffers {integrator.acc.nbytes*4/1e6:.2f} MB for any number of pings")
+    print(f"noise over the echo: single ping {single:.1f}, {pings} pings {residual:.1f} ({20*np.log10(single/residual):.1f} dB)")
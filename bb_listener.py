@@ -2,12 +2,16 @@
 
     """
 
-from serial import Serial
+from serial import Serial, SerialException
 import time
 import numpy as np
 import os
+import errno
+import select
 from enum import Enum
 
+from bb_stereo import StereoCapture, split_bursts
+
 class LISTENER_SERIAL_CMD(Enum):
     NONE = 0
     START_LISTEN = 1
@@ -29,12 +33,16 @@ class t_colors:
     
 class EchoRecorder:
     
-    def __init__(self,serial_obj:Serial = Serial(),channel_burst_len:np.uint16 = 1000, left_channel_first = True,sample_freq:int = 1e6) -> None:
+    def __init__(self,serial_obj:Serial = Serial(),channel_burst_len:np.uint16 = 1000, left_channel_first = True,sample_freq:int = 1e6,ring_slots:int = 8,
+                 burst_interleaved:bool = False) -> None:
         """Create echo listener using the serial device 
 
         Args:
             serial_obj (Serial): object of teensy
             channel_burst_len (np.uint16): length of left and right channel bursts. Defaults to 1000 uint16's.
+            ring_slots (int): captures kept before the ring wraps and overwrites the oldest. Defaults to 8.
+            burst_interleaved (bool): the firmware alternates ears every channel_burst_len samples
+                instead of every sample. Defaults to False.
         """
         
         self.teensy = serial_obj
@@ -51,6 +59,14 @@ class EchoRecorder:
         # for sending data over UART and reconstructing to left and right channels
         self.channel_burst_len = channel_burst_len
         self.left_channel_first = left_channel_first
+        self.burst_interleaved = burst_interleaved
+        
+        # captures are read into rotating slots of this ring, made on first listen
+        self.ring_slots = ring_slots
+        self.ring = None
+        
+        # perf_counter right after the last START_LISTEN went out
+        self.last_start_time = None
     
     def check_status(self)->bool:
         if not self.teensy:
@@ -139,13 +155,183 @@ class EchoRecorder:
         if print_: print(f"LISTENER NOT RESPONDING!{back_val}")
         return False
         
-    def listen(self, listen_time_ms:np.uint16)->tuple[np.uint16,np.uint16,np.uint16]:
+    def session(self,drain_quiet_s:float = 2e-3,max_drain_s:float = 0.5)->'ListenSession':
+        """Create a session that keeps the port open for back to back listens
+
+        Args:
+            drain_quiet_s (float, optional): time the port must stay quiet after STOP_LISTEN. Defaults to 2e-3.
+            max_drain_s (float, optional): longest a drain may take. Defaults to 0.5.
+
+        Returns:
+            ListenSession: use as a context manager
+        """
+        return ListenSession(self,drain_quiet_s,max_drain_s)
+    
+    def _drain_input(self,quiet_s:float,max_drain_s:float = 0.5,poll_s:float = 2e-4)->int:
+        """Throws away bytes still in flight after STOP_LISTEN, returns once 
+        nothing has arrived for quiet_s seconds. If STOP_LISTEN got lost the
+        Teensy never goes quiet, so it also gives up after max_drain_s.
+
+        Args:
+            quiet_s (float): time with no new bytes before giving up
+            max_drain_s (float, optional): time after which it returns even if bytes keep coming. Defaults to 0.5.
+            poll_s (float, optional): sleep between polls of an empty port. Defaults to 2e-4.
+
+        Returns:
+            int: number of bytes thrown away
+        """
+        drained = 0
+        start = last_rx = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            if now - last_rx >= quiet_s:
+                break
+            if now - start >= max_drain_s:
+                print(f"{t_colors.WARNING}LISTENER STILL STREAMING AFTER {max_drain_s} s OF DRAINING!{t_colors.ENDC}")
+                break
+            waiting = self.teensy.in_waiting
+            if waiting:
+                drained += len(self.teensy.read(waiting))
+                last_rx = time.perf_counter()
+            else:
+                time.sleep(poll_s)
+        return drained
+    
+    def get_ring(self,slot_bytes:int)->'CaptureRing':
+        """Returns the capture ring, reallocating it only when the capture size changes
+
+        Args:
+            slot_bytes (int): bytes in one capture
+
+        Returns:
+            CaptureRing: ring the next capture is read into
+        """
+        if self.ring is None or self.ring.slot_bytes != slot_bytes or self.ring.slots != self.ring_slots:
+            self.ring = CaptureRing(slot_bytes,self.ring_slots)
+        return self.ring
+    
+    def capture_len(self,listen_time_ms:np.uint16)->int:
+        """uint16 samples of both ears that a complete capture of listen_time_ms holds"""
+        # ms * 1MS * 2 ears, in whole bursts
+        samples_to_read = int(listen_time_ms*1e-3*self.sample_freq * 2)
+        return int(samples_to_read/self.channel_burst_len)*self.channel_burst_len
+    
+    def samples_per_ear(self,listen_time_ms:np.uint16)->int:
+        """Samples of each ear in to_capture of a complete capture of listen_time_ms"""
+        raw_len = self.capture_len(listen_time_ms)
+        if self.burst_interleaved:
+            # the ears are trimmed to the same number of whole bursts
+            return raw_len//self.channel_burst_len//2*self.channel_burst_len
+        return raw_len//2
+    
+    def _read_into(self,view:memoryview)->int:
+        """Reads up to len(view) bytes into view, stopping at the port timeout like
+        Serial.read. On posix the bytes go from the fd straight into view with
+        os.readv, Serial.readinto would read a new bytes object and copy it.
+
+        Args:
+            view (memoryview): writable bytes to fill
+
+        Returns:
+            int: bytes read, less than len(view) on a timeout
+        """
+        fd = getattr(self.teensy,'fd',None)
+        if fd is None or not hasattr(os,'readv'):
+            return self.teensy.readinto(view)
+
+        timeout = self.teensy.timeout
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        got = 0
+        while got < len(view):
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.perf_counter(),0)
+            ready,_,_ = select.select([fd],[],[],remaining)
+            if not ready:
+                break
+            try:
+                n = os.readv(fd,[view[got:]])
+            except OSError as e:
+                if e.errno in (errno.EAGAIN,errno.EWOULDBLOCK,errno.EINTR):
+                    continue
+                raise SerialException(f"read failed: {e}")
+            if n == 0:
+                # ready but nothing to read, the device went away
+                raise SerialException("device reports readiness to read but returned no data")
+            got += n
+        return got
+    
+    def _capture(self,listen_time_ms:np.uint16,on_start = None,start_after_bursts:int = 0)->np.uint16:
+        """Runs one START_LISTEN/STOP_LISTEN cycle on an already open port, reading
+        straight into the next slot of the capture ring.
+
+        Args:
+            listen_time_ms (np.uint16): time to listen for in ms
+            on_start (callable, optional): called once the capture is running, like
+                writing EMIT_CHIRP to the emitter. Defaults to None.
+            start_after_bursts (int, optional): bursts read before on_start is called. Defaults to 0.
+
+        Returns:
+            np.uint16: interleaved raw samples, a view into the ring
+        """
+        read_times = self.capture_len(listen_time_ms)//self.channel_burst_len
+        burst_bytes = self.channel_burst_len*2
+
+        slot, slot_bytes = self.get_ring(read_times*burst_bytes).next_slot()
+        
+        bytes_read = 0
+        self.teensy.write([LISTENER_SERIAL_CMD.START_LISTEN.value])
+        self.last_start_time = time.perf_counter()
+        if on_start is not None and start_after_bursts <= 0:
+            on_start()
+        for i in range(read_times):
+            bytes_read += self._read_into(slot_bytes[bytes_read:bytes_read+burst_bytes])
+            if on_start is not None and i + 1 == start_after_bursts:
+                on_start()
+
+        self.teensy.write([LISTENER_SERIAL_CMD.STOP_LISTEN.value])
+        self.teensy.flush()
+        
+        # a timed out read leaves the rest of the slot stale, only hand back what arrived
+        return slot[:bytes_read//2]
+    
+    def _split_ears(self,raw_data:np.uint16)->tuple[np.uint16,np.uint16]:
+        if self.burst_interleaved:
+            return split_bursts(raw_data,self.channel_burst_len,self.left_channel_first)
+        
+        if self.left_channel_first:
+            left_ear = raw_data[::2]
+            right_ear = raw_data[1::2]
+        else:
+            left_ear = raw_data[1::2]
+            right_ear = raw_data[::2]
+        
+        return left_ear,right_ear
+    
+    def to_capture(self,raw_data:np.uint16)->StereoCapture:
+        """Both ears of a capture from this listener
+
+        Args:
+            raw_data (np.uint16): raw samples from listen or a session
+
+        Returns:
+            StereoCapture: a view of raw_data, or a copy in burst mode
+        """
+        if self.burst_interleaved:
+            return StereoCapture.from_bursts(raw_data,self.channel_burst_len,self.left_channel_first,self.sample_freq)
+        return StereoCapture.from_interleaved(raw_data,self.left_channel_first,self.sample_freq)
+        
+    def listen(self, listen_time_ms:np.uint16, copy:bool = True)->tuple[np.uint16,np.uint16,np.uint16]:
         """Reads bytes from Teensy for given amount of listen time. This listen time
          is calculated into number of bytes so deviation of time is not an issue. The raw_data
          is interleaved between left and right ear for ease of demodulating at the end.
+         
+         With copy=False all three outputs are views into the capture ring, they get
+         silently overwritten after ring_slots more listens.
 
         Args:
             listen_time_ms (np.uint16): time to listen for in ms
+            copy (bool, optional): hand back data the caller owns instead of ring views. Defaults to True.
 
         Returns:
             tuple[np.uint16,np.uint16,np.uint16]: raw_data, left_ear, right_ear
@@ -155,39 +341,139 @@ class EchoRecorder:
             print(f"EROR")
             return None
         
+        raw_data = self._capture(listen_time_ms)
+        if copy:
+            raw_data = raw_data.copy()
+        self.teensy.close()
+        self.teensy.open()
+        self.teensy.flush()
+        
+        left_ear,right_ear = self._split_ears(raw_data)
+            
+        return [raw_data,left_ear,right_ear]
+
+
+class CaptureRing:
+    """Preallocated uint16 slots that captures are read into in place. Each
+    listen takes the next slot so a long run allocates nothing per ping, but
+    a slot is reused once the ring wraps around.
+    """
+    
+    def __init__(self,slot_bytes:int,slots:int = 8) -> None:
+        """
+        Args:
+            slot_bytes (int): bytes in one capture
+            slots (int, optional): number of captures kept. Defaults to 8.
+        """
+        self.slot_bytes = slot_bytes
+        self.slots = slots
+        self.buffer = np.zeros((slots,slot_bytes//2),dtype=np.uint16)
         
-        listen_time_ms = listen_time_ms * 1e-3
+        # byte views of each row for readinto
+        self.byte_views = [memoryview(self.buffer[i]).cast('B') for i in range(slots)]
+        self.index = 0
         
-        # ms * 1MS * 2 ears
-        samples_to_read = int(listen_time_ms*self.sample_freq * 2)
-        read_times = int(samples_to_read/self.channel_burst_len)
+    def next_slot(self)->tuple[np.uint16,memoryview]:
+        """Hands out the next slot in the ring
 
-            
-        raw_bytes = bytearray()
-        self.teensy.write([LISTENER_SERIAL_CMD.START_LISTEN.value])
-        for i in range(read_times):
-            raw_bytes.extend(self.teensy.read(self.channel_burst_len*2))
+        Returns:
+            tuple[np.uint16,memoryview]: slot as uint16, same slot as writable bytes
+        """
+        i = self.index
+        self.index = (self.index + 1) % self.slots
+        return self.buffer[i],self.byte_views[i]
 
-        self.teensy.write([LISTENER_SERIAL_CMD.STOP_LISTEN.value])
-        self.teensy.flush()
-        self.teensy.close()
-        self.teensy.open()
-        self.teensy.flush()
+
+class ListenSession:
+    """Keeps the Teensy port open for back to back listens. EchoRecorder.listen
+    reopens the port and does an ACK round trip before and after every capture,
+    a session does the handshake once and then only sends START_LISTEN/STOP_LISTEN
+    per capture, throwing away the tail of the stream between cycles.
+    
+        with recorder.session() as sess:
+            for i in range(100):
+                raw,L,R = sess.listen(30)
+            print(sess.cycles_per_second())
+    """
+    
+    def __init__(self,recorder:EchoRecorder,drain_quiet_s:float = 2e-3,max_drain_s:float = 0.5) -> None:
+        self.recorder = recorder
+        self.drain_quiet_s = drain_quiet_s
+        self.max_drain_s = max_drain_s
+        self.connected = False
         
-        raw_data = np.frombuffer(raw_bytes,dtype=np.uint16)
+        # timing for cycles per second
+        self.cycles = 0
+        self.first_cycle_start = None
+        self.last_cycle_end = None
+        self.last_cycle_time = 0.0
+        
+    def __enter__(self)->'ListenSession':
+        self.open()
+        return self
+    
+    def __exit__(self,exc_type,exc_value,traceback)->None:
+        self.close()
+        
+    def open(self)->bool:
+        """Opens the port and does the ACK handshake once
 
-        if self.left_channel_first:
-            left_ear = raw_data[::2]
-            right_ear = raw_data[1::2]
-        else:
-            left_ear = raw_data[1::2]
-            right_ear = raw_data[::2]
+        Returns:
+            bool: true if the Teensy answered
+        """
+        self.connected = self.recorder.connection_status()
+        if not self.connected:
+            print(f"{t_colors.FAIL}LISTENER NOT RESPONDING, SESSION NOT OPEN!{t_colors.ENDC}")
+        return self.connected
+    
+    def close(self)->None:
+        """Drains whatever is left and leaves the port in the same state listen() does"""
+        if not self.connected:
+            return
+        self.connected = False
+        try:
+            self.recorder._drain_input(self.drain_quiet_s,self.max_drain_s)
+            self.recorder.teensy.reset_input_buffer()
+        except:
+            pass
+        
+    def listen(self,listen_time_ms:np.uint16,on_start = None,start_after_bursts:int = 0)->tuple[np.uint16,np.uint16,np.uint16]:
+        """Same as EchoRecorder.listen with copy=False but on the open port. The
+        outputs are views into the capture ring and are overwritten after
+        ring_slots more listens, copy them if they need to live longer.
 
-            
-        return [raw_bytes,left_ear,right_ear]
+        Args:
+            listen_time_ms (np.uint16): time to listen for in ms
+            on_start (callable, optional): see EchoRecorder._capture. Defaults to None.
+            start_after_bursts (int, optional): see EchoRecorder._capture. Defaults to 0.
 
+        Returns:
+            tuple[np.uint16,np.uint16,np.uint16]: raw_data, left_ear, right_ear
+        """
+        if not self.connected:
+            print(f"EROR")
+            return None
         
+        start = time.perf_counter()
+        if self.first_cycle_start is None:
+            self.first_cycle_start = start
         
+        raw_data = self.recorder._capture(listen_time_ms,on_start,start_after_bursts)
+        self.recorder._drain_input(self.drain_quiet_s,self.max_drain_s)
         
+        self.last_cycle_end = time.perf_counter()
+        self.last_cycle_time = self.last_cycle_end - start
+        self.cycles += 1
         
-        
\ No newline at end of file
+        left_ear,right_ear = self.recorder._split_ears(raw_data)
+        return [raw_data,left_ear,right_ear]
+    
+    def cycles_per_second(self)->float:
+        """Listen cycles completed per second since the first listen in this session
+
+        Returns:
+            float: cycles per second, 0 if nothing has run yet
+        """
+        if self.cycles == 0 or self.last_cycle_end == self.first_cycle_start:
+            return 0.0
+        return self.cycles/(self.last_cycle_end - self.first_cycle_start)
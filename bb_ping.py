@@ -0,0 +1,198 @@
+"""Emit and listen as one ping cycle with known host side timing
+
+    EchoEmitter.chirp() and EchoRecorder.listen() each reopen their port and
+    do an ACK round trip, so a chirp and a capture started one after the other
+    are tens of ms apart with whatever jitter the OS adds. PingCycle opens both
+    ports once. Per ping it writes START_LISTEN and then EMIT_CHIRP straight
+    after it, or after a set number of bursts so the capture has a known
+    stretch of silence in front of the chirp. The perf_counter time of both
+    writes is recorded.
+
+    The emitter's ACK is never waited for. It arrives while the capture is
+    still streaming and is collected from the input buffer afterwards, so the
+    only gap between pings is STOP_LISTEN and the listener drain.
+    """
+
+import time
+import numpy as np
+
+import bb_listener
+import bb_emitter
+
+EMIT_CMD = bytes([bb_emitter.ECHO_SERIAL_CMD.EMIT_CHIRP.value])
+ACK = bb_emitter.ECHO_SERIAL_CMD.ACK.value
+
+
+class PingRecord:
+    """One emit and listen cycle, times are time.perf_counter"""
+    __slots__ = ('index','timestamp','capture','t_listen','t_emit','t_end','emit_ack')
+
+    @property
+    def emit_offset(self)->float:
+        """Seconds from START_LISTEN going out to EMIT_CHIRP going out"""
+        return self.t_emit - self.t_listen
+
+
+class PingCycle:
+    """Chirps and listens back to back on ports that stay open.
+
+        with PingCycle(emitter,recorder,30) as cycle:
+            for i in range(100):
+                ping = cycle.ping()
+            print(cycle.stats())
+    """
+
+    def __init__(self,emitter:bb_emitter.EchoEmitter,recorder:bb_listener.EchoRecorder,listen_time_ms:int,
+                 emit_delay_bursts:int = 0,drain_quiet_s:float = 2e-3,offset_history:int = 4096) -> None:
+        """
+        Args:
+            emitter (bb_emitter.EchoEmitter): emitter with a chirp uploaded
+            recorder (bb_listener.EchoRecorder): listener
+            listen_time_ms (int): time to listen for each ping
+            emit_delay_bursts (int, optional): listener bursts read before the chirp is triggered. Defaults to 0.
+            drain_quiet_s (float, optional): see ListenSession. Defaults to 2e-3.
+            offset_history (int, optional): most recent emit offsets kept for percentiles, the
+                mean, std, min and max cover every ping. Defaults to 4096.
+        """
+        self.emitter = emitter
+        self.recorder = recorder
+        self.listen_time_ms = listen_time_ms
+        self.emit_delay_bursts = emit_delay_bursts
+        self.session = recorder.session(drain_quiet_s)
+        self.connected = False
+
+        self.cycles = 0
+        self.acks = 0
+        self._t_emit = None
+
+        # emit offsets, a ring of the recent ones and running sums over all of them
+        self._offsets = np.zeros(offset_history)
+        self.offset_count = 0
+        self.offset_min = 0.0
+        self.offset_max = 0.0
+        self._offset_sum = 0.0
+        self._offset_sq = 0.0
+
+    @property
+    def emit_offsets(self)->np.ndarray:
+        """Emit offsets of the most recent pings that emitted, oldest first"""
+        kept = min(self.offset_count,len(self._offsets))
+        return np.roll(self._offsets,-self.offset_count)[len(self._offsets) - kept:]
+
+    def _record_offset(self,offset:float)->None:
+        # NaN when the chirp never went out, that ping only counts as a cycle
+        if not np.isfinite(offset):
+            return
+        self._offsets[self.offset_count % len(self._offsets)] = offset
+        if self.offset_count == 0 or offset < self.offset_min:
+            self.offset_min = offset
+        if self.offset_count == 0 or offset > self.offset_max:
+            self.offset_max = offset
+        self._offset_sum += offset
+        self._offset_sq += offset*offset
+        self.offset_count += 1
+
+    def __enter__(self)->'PingCycle':
+        self.open()
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback)->None:
+        self.close()
+
+    def open(self)->bool:
+        """Does the handshake with both boards once
+
+        Returns:
+            bool: true if both answered
+        """
+        if not self.session.open():
+            return False
+        if not self.emitter.connection_status():
+            print(f"{bb_emitter.t_colors.FAIL}EMIT NOT RESPONDING, PING CYCLE NOT OPEN!{bb_emitter.t_colors.ENDC}")
+            self.session.close()
+            return False
+        if not self.emitter.chirp_uploaded:
+            print(f"{bb_emitter.t_colors.WARNING}WARNING NO CHRIP UPLOADED, PRECEEDING ANYWAY!{bb_emitter.t_colors.ENDC}")
+        self.emitter.itsy.reset_input_buffer()
+        self.connected = True
+        return True
+
+    def close(self)->None:
+        if not self.connected:
+            return
+        self.connected = False
+        self.session.close()
+        try:
+            self._collect_acks()
+        except:
+            pass
+
+    def _emit(self)->None:
+        self.emitter.itsy.write(EMIT_CMD)
+        self._t_emit = time.perf_counter()
+
+    def _collect_acks(self)->int:
+        """Counts the ACKs waiting on the emitter port without blocking"""
+        waiting = self.emitter.itsy.in_waiting
+        if not waiting:
+            return 0
+        acks = self.emitter.itsy.read(waiting).count(ACK)
+        self.acks += acks
+        return acks
+
+    def ping(self)->PingRecord:
+        """One chirp and capture
+
+        Returns:
+            PingRecord: the ping, its capture is a view into the capture ring. None if not open.
+        """
+        if not self.connected:
+            return None
+
+        timestamp = time.time()
+        ret = self.session.listen(self.listen_time_ms,on_start=self._emit,start_after_bursts=self.emit_delay_bursts)
+        if ret is None:
+            return None
+        t_end = time.perf_counter()
+
+        ping = PingRecord()
+        ping.index = self.cycles
+        ping.timestamp = timestamp
+        ping.capture = self.recorder.to_capture(ret[0])
+        ping.t_listen = self.recorder.last_start_time
+        # a delay longer than the capture means the chirp never went out
+        ping.t_emit = self._t_emit if self._t_emit is not None else np.nan
+        ping.t_end = t_end
+        self._t_emit = None
+
+        # the ACK had the whole capture to arrive, a late one is counted next ping
+        ping.emit_ack = self._collect_acks() > 0
+        self._record_offset(ping.emit_offset)
+        self.cycles += 1
+        return ping
+
+    def cycles_per_second(self)->float:
+        return self.session.cycles_per_second()
+
+    def stats(self)->dict:
+        """Cycle rate and emit timing so far, times are in seconds. Mean, std, min and
+        max cover every ping, the percentiles the last offset_history
+
+        Returns:
+            dict: counters
+        """
+        n = self.offset_count
+        mean = self._offset_sum/n if n else 0.0
+        recent = self.emit_offsets
+        p50,p99 = np.percentile(recent,[50,99]) if len(recent) else (0.0,0.0)
+        return {
+            'cycles': self.cycles,
+            'cycles_per_second': self.session.cycles_per_second(),
+            'missing_acks': self.cycles - self.acks,
+            'emit_offset_mean': mean,
+            'emit_offset_std': float(np.sqrt(max(self._offset_sq/n - mean*mean,0.0))) if n else 0.0,
+            'emit_offset_min': self.offset_min,
+            'emit_offset_max': self.offset_max,
+            'emit_offset_p50': float(p50),
+            'emit_offset_p99': float(p99),
+        }
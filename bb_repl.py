@@ -25,6 +25,8 @@ import pinnae
 import numpy as np
 import bb_listener
 import bb_emitter
+import bb_acquire
+from bb_runfile import RunWriter
 import yaml
 import serial
 import bb_gps
@@ -42,6 +44,10 @@ import time
 import queue
 import multiprocessing as mp
 from serial_helper import get_port_from_serial_num
+from bb_spec import plot_spec, SpecView, process
+from bb_echo import EchoRanger
+import bb_chirplib
+import bb_integrate
 from datetime import datetime
 
 
@@ -92,42 +98,6 @@ def gen_fft(data)->tuple[np.ndarray,np.ndarray]:
 
 
 
-def plot_spec(ax, fig, spec_tup, fbounds = (30E3, 100E3), dB_range = 40, plot_title = 'spec',plot_db=False):
-    
-    fmin, fmax = fbounds
-    s, f, t = spec_tup
-    
-    lfc = (f >= fmin).argmax()
-    s = 20*np.log10(s)
-    f_cut = f[lfc:]
-    s_cut = s[:][lfc:]
-
-    
-    max_s = np.amax(s_cut)
-    s_cut = s_cut - max_s
-    
-    [rows_s, cols_s] = np.shape(s_cut)
-    
-    dB = -dB_range
-    
-    for col in range(cols_s):
-        for row in range(rows_s):
-            if s_cut[row][col] < dB:
-                s_cut[row][col] = dB
-                
-    cf = ax.pcolormesh(t, f_cut, s_cut, cmap='jet', shading='auto')
-    if plot_db:
-        cbar = fig.colorbar(cf, ax=ax)
-        cbar.ax.set_ylabel('dB')
-    
-    ax.set_ylim(fmin, fmax)
-    ax.set_ylabel('Frequency (Hz)')
-    ax.set_xlabel('Time (sec)')
-    ax.title.set_text(plot_title)
-
-
- 
-            
 def plot_time(ax, fig,Fs,plot_data,use_ms=False)->None:
     T = 1/Fs
     x_vals = np.linspace(0,len(plot_data)/Fs,num=len(plot_data))
@@ -179,19 +149,6 @@ def make_ms_xtick(ax):
 
     
 
-def process(raw, spec_settings, time_offs = 0):
-
-    unraw_balanced = raw - np.mean(raw)
-    
-    pt_cut = unraw_balanced[time_offs:]
-    remainder = unraw_balanced[:time_offs]
-    
-    Fs, NFFT, noverlap, window = spec_settings
-    spec_tup = mlab.specgram(pt_cut, Fs=Fs, NFFT=NFFT, noverlap=noverlap, window=window)
-    
-    return spec_tup, pt_cut, remainder
-
-
             
 
         
@@ -221,6 +178,7 @@ class bb_repl(Cmd):
         
         self.gui = None
         self.PinnaWidget = None
+        self.chirp_lib = None
         
         super().__init__()
         
@@ -260,6 +218,28 @@ class bb_repl(Cmd):
         
         self.do_status(None)
 
+    def get_chirp_lib(self)->bb_chirplib.ChirpLibrary:
+        """Maps the chirp library from the config, building it first if the spec changed"""
+        if self.chirp_lib is None:
+            lib_cfg = self.bb_config.get('chirp_library')
+            if not lib_cfg:
+                self.perror("No chirp_library in config")
+                return None
+            self.chirp_lib = bb_chirplib.open_library(os.path.join(self.dir_path,lib_cfg['spec']),
+                                                      os.path.join(self.dir_path,lib_cfg['file']))
+        return self.chirp_lib
+    
+    def do_chirp_lib(self,args):
+        """Lists the chirps in the chirp library"""
+        lib = self.get_chirp_lib()
+        if lib is None:
+            return
+        for name in lib.names:
+            chirp = lib[name]
+            self.poutput(f"{name:>32}: {len(chirp.samples)*1e-3:5.1f}ms {chirp.describe()}")
+
+    def get_current_time_str(self)->str:
+        return datetime.now().strftime("%H_%M_%S")
     
 
 
@@ -276,6 +256,11 @@ class bb_repl(Cmd):
     pinna_parser = Cmd2ArgumentParser()
     pinna_parser.add_argument('-g','--gui',action='store_true')
     pinna_parser.add_argument('-cal','--calibrate',action='store_true')
+    pinna_parser.add_argument('-f','--flap',type=float,metavar='HZ',help='flap both ears between their limits')
+    pinna_parser.add_argument('-s','--sweep',type=float,metavar='HZ',help='sweep each motor in turn')
+    pinna_parser.add_argument('-a','--actuate',type=float,metavar='HZ',help='move all motors together smoothly')
+    pinna_parser.add_argument('-n','--times',type=float,default=None,help='cycles to run, default until --stop')
+    pinna_parser.add_argument('--stop',action='store_true',help='stop the ears where they are')
     @with_argparser(pinna_parser)
     def do_pinna(self,args):
         if args.gui:
@@ -292,6 +277,22 @@ class bb_repl(Cmd):
         if args.calibrate:
             l_lims = self.L_pinna_MCU.calibrate_and_get_motor_limits()
             r_lims = self.R_pinna_MCU.calibrate_and_get_motor_limits()
+
+        # runs in each ear's motion engine, the prompt stays free
+        motion = [(args.flap,'flap_pinnae'),(args.sweep,'sweep_motors'),(args.actuate,'actuate_motors')]
+        for frequency,method in motion:
+            if frequency is None:
+                continue
+            try:
+                for ear in (self.L_pinna_MCU,self.R_pinna_MCU):
+                    getattr(ear,method)(frequency,args.times)
+            except ValueError as e:
+                self.poutput(f"{t_colors.FAIL}{e}{t_colors.ENDC}")
+            break
+
+        if args.stop:
+            self.L_pinna_MCU.stop_motion()
+            self.R_pinna_MCU.stop_motion()
             
         self.poutput(f"{args}")
             
@@ -490,10 +491,11 @@ class bb_repl(Cmd):
         cur_dir = self.runs_path+f"/LISTEN_{cur_time}"
         os.makedirs(cur_dir)
         
-        _,L,R = self.record_MCU.listen(args.listen_time_ms)
-        np.save(cur_dir+f"/left_ear.npy",L)
-        np.save(cur_dir+f"/right_ear.npy",R)
-        self.emitter.save_chirp_info(cur_dir+"/chirp_info.txt")
+        raw_data,_,_ = self.record_MCU.listen(args.listen_time_ms)
+        capture = self.record_MCU.to_capture(raw_data)
+        capture.save(cur_dir)
+        L,R = capture.left,capture.right
+        self.emit_MCU.save_chirp_info(cur_dir+"/chirp_info.txt")
             
         # L = butter_bandpass_filter(L,30e3,100e3,fs=1e6)
         # R = butter_bandpass_filter(R,30e3,100e3,fs=1e6)
@@ -536,8 +538,8 @@ class bb_repl(Cmd):
             DB_range = 40
             f_plot_bounds = (30E3, 100E3)
             
-            spec_tup1, pt_cut1, pt1 = process(L, spec_settings, time_offs=args.time_off)
-            spec_tup2, pt_cut2, pt2 = process(R, spec_settings, time_offs=args.time_off)
+            s, f, t = capture.spectrogram(spec_settings, time_offs=args.time_off)
+            spec_tup1, spec_tup2 = (s[0], f, t), (s[1], f, t)
             
             if rows > 1:
                 plot_spec(axes[cur_row,0], fig, spec_tup1, fbounds = f_plot_bounds, dB_range = DB_range, plot_title='Left Ear')
@@ -552,12 +554,70 @@ class bb_repl(Cmd):
             plt.close()
             
             
+    integrate_parser = Cmd2ArgumentParser()
+    integrate_parser.add_argument('-lt','--listen_time_ms',type=int,help="Time to listen for in ms",default=30)
+    integrate_parser.add_argument('-n','--pings',type=int,help="pings to integrate",default=None)
+    integrate_parser.add_argument('-d','--duration',type=float,help="seconds to integrate for",default=None)
+    integrate_parser.add_argument('-a','--align',type=int,help="align pings on the uploaded chirp, most samples to shift",default=0)
+    integrate_parser.add_argument('-sl','--search_len',type=int,help="samples searched for the chirp when aligning",default=None)
+    integrate_parser.add_argument('-sum','--sum',action='store_true',help="running sum only, no variance")
+    integrate_parser.add_argument('-spec','--spec',action='store_true',help="Plot the spec")
+    integrate_parser.add_argument('-to','--time_off',type=int,default=0)
+    @with_argparser(integrate_parser)
+    def do_integrate(self,args):
+        """Averages many pings into one, only the running mean and variance are kept"""
+        if args.pings is None and args.duration is None:
+            self.perror("Give -n pings, -d seconds or both")
+            return
+        
+        chirp = None
+        if args.align:
+            chirp = self.emit_MCU.uploaded_chirp
+            if chirp is None:
+                self.perror("No confirmed chirp upload, integrating without alignment")
+        
+        cur_time = self.get_current_time_str()
+        cur_dir = self.runs_path+f"/INTEGRATE_{cur_time}"
+        os.makedirs(cur_dir)
+        self.emit_MCU.save_chirp_info(cur_dir+"/chirp_info.txt")
+        
+        start = time.perf_counter()
+        integrator = bb_integrate.integrate_pings(self.record_MCU,args.listen_time_ms,args.pings,args.duration,
+                                                  chirp,args.align,args.search_len,welford=not args.sum)
+        if integrator is None:
+            self.perror("Listener not responding")
+            return
+        elapsed = time.perf_counter() - start
+        integrator.save(cur_dir)
+        self.poutput(f"Integrated {integrator.count} pings in {elapsed:.1f}s, skipped {integrator.skipped}")
+        if args.pings is not None and integrator.count < args.pings:
+            self.perror("Stopped early, the listener kept coming back short")
+        if chirp is not None and integrator.count:
+            shifts = integrator.shift_stats()
+            self.poutput(f"shifts: {shifts['min']} to {shifts['max']} samples, mean {shifts['mean']:.1f}")
+        
+        if args.spec:
+            Fs = self.record_MCU.sample_freq
+            NFFT = 512
+            noverlap = 400
+            spec_settings = (Fs, NFFT, noverlap, signal.windows.hann(NFFT))
+            s, f, t = integrator.capture().spectrogram(spec_settings, time_offs=args.time_off)
+            fig,axes = plt.subplots(nrows=1,ncols=2)
+            plot_spec(axes[0], fig, (s[0], f, t), fbounds = (30E3, 100E3), dB_range = 40, plot_title='Left Ear')
+            plot_spec(axes[1], fig, (s[1], f, t), fbounds = (30E3, 100E3), dB_range = 40, plot_title='Right Ear')
+            plt.subplots_adjust(wspace=0.5,hspace=0.8)
+            plt.show()
+            plt.close()
+            
     run_parser = Cmd2ArgumentParser()
     run_parser.add_argument('-lt','--listen_time_ms',type=int,help="Time to listen for in ms",default=30)
     run_parser.add_argument('-p','--plot',action='store_true',help="Plot the results")
-    run_parser.add_argument('-pf','--plot_freq',help="how often to plot the spec", default=5)
+    run_parser.add_argument('-pf','--plot_freq',type=int,help="how often to plot the spec", default=5)
     run_parser.add_argument('-nc','--num_chirps',type=int,help='times to chirp',default=30)
     run_parser.add_argument('-to','--time_off',type=int,default=3000)
+    run_parser.add_argument('-r','--range',action='store_true',help="range echoes against the uploaded chirp as pings come in")
+    run_parser.add_argument('-e','--emit',action='store_true',help="chirp at the start of every listen")
+    run_parser.add_argument('-ed','--emit_delay',type=int,help="listener bursts read before each chirp",default=0)
 
     @with_argparser(run_parser)
     def do_run(self,args):
@@ -577,40 +637,88 @@ class bb_repl(Cmd):
 		            hspace=0.4)
 
         Fs = 1e6
-        count = 0
         NFFT = 512
         noverlap = 400
         spec_settings = (Fs, NFFT, noverlap, signal.windows.hann(NFFT))
         DB_range = 40
         f_plot_bounds = (30E3, 100E3)
         
-        show_db = True
+        # built on the first frame, after that only the pixels change
+        left_view = SpecView(axes[0], fbounds = f_plot_bounds, dB_range = DB_range, plot_title='Left Ear')
+        right_view = SpecView(axes[1], fbounds = f_plot_bounds, dB_range = DB_range, plot_title='Right Ear')
+        if args.plot:
+            plt.show(block=False)
         
         cur_time = self.get_current_time_str()
         cur_dir = self.runs_path+f"/RUN_{cur_time}"
         os.makedirs(cur_dir)
-        self.emitter.save_chirp_info(cur_dir+"/chirp_info.txt")
-        while True:
-            _,L,R = self.record_MCU.listen(args.listen_time_ms)
-            
-            np.save(cur_dir+f"/left_ear_{count}.npy",L)
-            np.save(cur_dir+f"/right_ear_{count}.npy",R)
-
-            if args.plot and count % args.plot_freq == 0:
-                spec_tup1, pt_cut1, pt1 = process(L, spec_settings, time_offs=args.time_off)
-                spec_tup2, pt_cut2, pt2 = process(R, spec_settings, time_offs=args.time_off)
-                plot_spec(axes[0], fig, spec_tup1, fbounds = f_plot_bounds, dB_range = DB_range, plot_title='Left Ear',plot_db=show_db)
-                plot_spec(axes[1], fig, spec_tup2, fbounds = f_plot_bounds, dB_range = DB_range, plot_title='Right Ear',plot_db=show_db)
-                show_db = False
-                plt.draw()
-                plt.pause(0.0001)
-                # plot_q.put([L,R])
-
-            
-            if count >= args.num_chirps:
-                break
+        self.emit_MCU.save_chirp_info(cur_dir+"/chirp_info.txt")
+        
+        ranger = None
+        if args.range:
+            if self.emit_MCU.uploaded_chirp is None:
+                self.perror("No confirmed chirp upload, running without ranging")
+            else:
+                # echoes before time_off are the emitter itself
+                lib_chirp = self.emit_MCU.library_chirp
+                if lib_chirp is not None and lib_chirp.crc == self.emit_MCU.uploaded_crc:
+                    ranger = lib_chirp.ranger(self.record_MCU.sample_freq,min_delay=args.time_off)
+                else:
+                    ranger = EchoRanger(self.emit_MCU.uploaded_chirp,self.record_MCU.sample_freq,min_delay=args.time_off)
+                echo_file = open(cur_dir+"/echoes.csv","w")
+                echo_file.write("ping,ear,delay_s,range_m,amplitude\n")
+        
+        # every ping goes into one file, bb_runfile.RunReader maps it back
+        run_file = RunWriter(cur_dir+"/run.bbrun",sample_freq=self.record_MCU.sample_freq)
+        
+        def write_frame(frame:bb_acquire.AcqFrame):
+            run_file.append_capture(frame.capture,frame.timestamp)
+            if ranger is None:
+                return
             
-            count+=1
+            echoes = ranger.range(frame.capture)
+            for ear,ear_echoes in zip(("left","right"),echoes):
+                for delay,dist,amp in zip(ear_echoes.delays,ear_echoes.ranges,ear_echoes.amplitudes):
+                    echo_file.write(f"{frame.index},{ear},{delay:.6f},{dist:.4f},{amp:.4f}\n")
+            nearest = [f"{e.nearest():.3f} m" if len(e) else "none" for e in echoes]
+            print(f"ping {frame.index}: nearest L {nearest[0]} R {nearest[1]}",end='\r',flush=True)
+        
+        # listening happens on its own thread, this one only draws
+        pipeline = bb_acquire.AcquisitionPipeline(self.record_MCU,args.listen_time_ms,args.num_chirps+1,
+                                                  write_fun=write_frame,plot_every=args.plot_freq if args.plot else 0,
+                                                  emitter=self.emit_MCU if args.emit else None,emit_delay_bursts=args.emit_delay)
+        pipeline.start()
+        try:
+            while pipeline.is_running():
+                frame = pipeline.get_plot_frame(timeout=0.05)
+                if frame is None:
+                    continue
+                
+                s, f, t = frame.capture.spectrogram(spec_settings, time_offs=args.time_off)
+                left_view.update((s[0], f, t))
+                right_view.update((s[1], f, t))
+                fig.canvas.flush_events()
+        except KeyboardInterrupt:
+            pipeline.stop()
+        pipeline.join()
+        run_file.close()
+        if ranger is not None:
+            print()
+            echo_file.close()
+        
+        stats = pipeline.stats()
+        if stats['error'] is not None:
+            self.perror(f"Run stopped: {stats['error']}")
+        self.poutput(f"Listen rate: {stats['listen_rate']:.2f} cycles/s, "
+                     f"captured: {stats['captured']} written: {stats['written']}, "
+                     f"max queue: {stats['max_queue_depth']}/{pipeline.queue_len}, "
+                     f"backpressure: {stats['backpressure_events']} ({stats['backpressure_time']:.3f}s), "
+                     f"plot dropped: {stats['plot_dropped']}/{stats['plot_offered']}")
+        if stats['ping_stats'] is not None:
+            ping_stats = stats['ping_stats']
+            self.poutput(f"Emit offset: {ping_stats['emit_offset_mean']*1e6:.1f} us "
+                         f"(std {ping_stats['emit_offset_std']*1e6:.1f} us, max {ping_stats['emit_offset_max']*1e6:.1f} us), "
+                         f"missing acks: {ping_stats['missing_acks']}")
         
         
     
@@ -694,10 +802,19 @@ class bb_repl(Cmd):
     upload_chirp_parser.add_argument('-fft','--fft',help='Preview',action='store_true')
     upload_chirp_parser.add_argument('-spec','--spec',help='Preview',action='store_true')
     upload_chirp_parser.add_argument('-cf','--file',help='file to use')
+    upload_chirp_parser.add_argument('-n','--name',help='chirp from the chirp library, see chirp_lib')
     @with_argparser(upload_chirp_parser)
     def do_upload_chirp(self,args):
         
-        if not args.file:
+        if args.name:
+            lib = self.get_chirp_lib()
+            if lib is None:
+                return
+            if args.name not in lib:
+                self.perror(f"No chirp {args.name} in library")
+                return
+            s = self.emit_MCU.use_library_chirp(lib[args.name])
+        elif not args.file:
             freq0 = convert_khz(args.freq0)
             if freq0 is None:
                 self.perror("-f0 should be xk")
@@ -0,0 +1,348 @@
+"""Append only run file, every ping of a run in one memory mappable file
+
+    Layout, all little endian:
+
+        file header     HEADER_DTYPE, 64 bytes
+        chunk           CHUNK_DTYPE header, 32 bytes
+                        index, chunk_pings entries of INDEX_DTYPE (24 bytes each)
+                        ping data, one block per ping
+        chunk           ...
+
+    A ping is stored sample interleaved as (n_samples, channels) like the Teensy
+    sends it, so the (2, N) ears are a transposed view of the mapped file. Ping
+    data starts on 8 byte boundaries. The index of the chunk being written is
+    kept in memory and written into its reserved slot on flush, rollover and
+    close, so a crash loses at most the pings since the last flush.
+    """
+
+import glob
+import os
+import re
+import time
+import numpy as np
+
+from bb_stereo import StereoCapture
+
+RUN_MAGIC = b'BBRUN\x00\x00\x01'
+CHUNK_MAGIC = b'BBCHUNK1'
+RUN_VERSION = 1
+ALIGN = 8
+
+HEADER_DTYPE = np.dtype([
+    ('magic','S8'),
+    ('version','<u4'),
+    ('channels','<u4'),
+    ('sample_freq','<f8'),
+    ('dtype','S8'),
+    ('chunk_pings','<u4'),
+    ('n_pings','<u4'),
+    ('first_chunk','<u8'),
+    ('created','<f8'),
+    ('reserved','S8'),
+])
+
+CHUNK_DTYPE = np.dtype([
+    ('magic','S8'),
+    ('capacity','<u4'),
+    ('count','<u4'),
+    ('data_start','<u8'),
+    ('next_chunk','<u8'),
+])
+
+INDEX_DTYPE = np.dtype([
+    ('offset','<u8'),
+    ('timestamp','<f8'),
+    ('n_samples','<u4'),
+    ('ping','<u4'),
+])
+
+
+def _aligned(pos:int)->int:
+    return -(-pos//ALIGN)*ALIGN
+
+
+class RunWriter:
+
+    def __init__(self,file_path:str,channels:int = 2,sample_freq:float = 1e6,dtype = np.uint16,
+                 chunk_pings:int = 256,flush_every:int = 32) -> None:
+        """Creates a new run file, an existing one is overwritten
+
+        Args:
+            file_path (str): file to write
+            channels (int, optional): channels per ping. Defaults to 2.
+            sample_freq (float, optional): sample rate of each channel. Defaults to 1e6.
+            dtype (optional): sample type. Defaults to np.uint16.
+            chunk_pings (int, optional): index entries reserved per chunk. Defaults to 256.
+            flush_every (int, optional): pings between index flushes, 0 only flushes on rollover and close. Defaults to 32.
+        """
+        self.file_path = file_path
+        self.channels = channels
+        self.sample_freq = sample_freq
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.chunk_pings = chunk_pings
+        self.flush_every = flush_every
+
+        self.header = np.zeros(1,HEADER_DTYPE)
+        self.header['magic'] = RUN_MAGIC
+        self.header['version'] = RUN_VERSION
+        self.header['channels'] = channels
+        self.header['sample_freq'] = sample_freq
+        self.header['dtype'] = self.dtype.str.encode()
+        self.header['chunk_pings'] = chunk_pings
+        self.header['first_chunk'] = HEADER_DTYPE.itemsize
+        self.header['created'] = time.time()
+
+        self.f = open(file_path,'wb')
+        self.f.write(self.header.tobytes())
+        self.end = HEADER_DTYPE.itemsize
+
+        self.n_pings = 0
+        self.bytes_written = 0
+        self.chunk = None
+        self._new_chunk()
+
+    def __enter__(self)->'RunWriter':
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback)->None:
+        self.close()
+
+    def _new_chunk(self)->None:
+        """Reserves a chunk header and index at the end of the file"""
+        self.chunk_pos = self.end
+        self.chunk = np.zeros(1,CHUNK_DTYPE)
+        self.chunk['magic'] = CHUNK_MAGIC
+        self.chunk['capacity'] = self.chunk_pings
+        self.index = np.zeros(self.chunk_pings,INDEX_DTYPE)
+
+        index_bytes = CHUNK_DTYPE.itemsize + INDEX_DTYPE.itemsize*self.chunk_pings
+        self.end = _aligned(self.chunk_pos + index_bytes)
+        self.chunk['data_start'] = self.end
+
+        self.f.seek(self.chunk_pos)
+        self.f.write(self.chunk.tobytes())
+        self.f.write(self.index.tobytes())
+        self.f.write(bytes(self.end - self.f.tell()))
+
+    def append(self,data:np.ndarray,timestamp:float = None)->int:
+        """Adds one ping
+
+        Args:
+            data (np.ndarray): (channels, n) samples, like StereoCapture.data
+            timestamp (float, optional): capture time, None uses time.time(). Defaults to None.
+
+        Returns:
+            int: the ping number in the file
+        """
+        data = np.asarray(data)
+        if data.ndim != 2 or data.shape[0] != self.channels:
+            raise ValueError(f"expected ({self.channels}, n) samples, got {data.shape}")
+
+        count = int(self.chunk['count'][0])
+        if count == self.chunk_pings:
+            self._close_chunk()
+            count = 0
+
+        # stored as (n, channels), for an interleaved capture this is the raw buffer again
+        block = np.ascontiguousarray(data.T,dtype=self.dtype)
+
+        entry = self.index[count]
+        entry['offset'] = self.end
+        entry['timestamp'] = time.time() if timestamp is None else timestamp
+        entry['n_samples'] = data.shape[1]
+        entry['ping'] = self.n_pings
+
+        self.f.seek(self.end)
+        self.f.write(block)
+        self.end = _aligned(self.end + block.nbytes)
+        self.bytes_written += block.nbytes
+
+        self.chunk['count'] = count + 1
+        self.n_pings += 1
+        if self.flush_every and self.n_pings % self.flush_every == 0:
+            self.flush()
+        return self.n_pings - 1
+
+    def append_capture(self,capture:StereoCapture,timestamp:float = None)->int:
+        return self.append(capture.data,timestamp)
+
+    def _write_index(self)->None:
+        self.f.seek(self.chunk_pos)
+        self.f.write(self.chunk.tobytes())
+        self.f.write(self.index.tobytes())
+        self.header['n_pings'] = self.n_pings
+        self.f.seek(0)
+        self.f.write(self.header.tobytes())
+
+    def _close_chunk(self)->None:
+        self.chunk['next_chunk'] = self.end
+        self._write_index()
+        self._new_chunk()
+
+    def flush(self,fsync:bool = False)->None:
+        """Writes the current chunk index and ping count, then flushes the file
+
+        Args:
+            fsync (bool, optional): also ask the OS to put it on disk. Defaults to False.
+        """
+        self._write_index()
+        self.f.flush()
+        if fsync:
+            os.fsync(self.f.fileno())
+
+    def close(self)->None:
+        if self.f.closed:
+            return
+        self.flush(fsync=True)
+        self.f.close()
+
+
+class RunReader:
+
+    def __init__(self,file_path:str) -> None:
+        """Memory maps a run file, nothing is read until a ping is used
+
+        Args:
+            file_path (str): file written by RunWriter
+        """
+        self.file_path = file_path
+        self.mm = np.memmap(file_path,dtype=np.uint8,mode='r')
+
+        self.header = self.mm[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if self.header['magic'] != RUN_MAGIC:
+            raise ValueError(f"{file_path} is not a run file")
+        if self.header['version'] > RUN_VERSION:
+            raise ValueError(f"{file_path} is version {self.header['version']}, newest known is {RUN_VERSION}")
+
+        self.channels = int(self.header['channels'])
+        self.sample_freq = float(self.header['sample_freq'])
+        self.dtype = np.dtype(self.header['dtype'].decode())
+
+        # every chunk index back to back
+        indexes = []
+        pos = int(self.header['first_chunk'])
+        while pos and pos + CHUNK_DTYPE.itemsize <= len(self.mm):
+            chunk = self.mm[pos:pos + CHUNK_DTYPE.itemsize].view(CHUNK_DTYPE)[0]
+            if chunk['magic'] != CHUNK_MAGIC:
+                break
+            start = pos + CHUNK_DTYPE.itemsize
+            indexes.append(self.mm[start:start + INDEX_DTYPE.itemsize*int(chunk['count'])].view(INDEX_DTYPE))
+            pos = int(chunk['next_chunk'])
+        self.index = np.concatenate(indexes) if indexes else np.zeros(0,INDEX_DTYPE)
+
+    def __enter__(self)->'RunReader':
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback)->None:
+        self.close()
+
+    def __len__(self)->int:
+        return len(self.index)
+
+    def __getitem__(self,i:int)->np.ndarray:
+        """(channels, n) samples of ping i, a view into the mapped file"""
+        entry = self.index[i]
+        n = int(entry['n_samples'])
+        offset = int(entry['offset'])
+        block = self.mm[offset:offset + n*self.channels*self.dtype.itemsize].view(self.dtype)
+        return block.reshape(n,self.channels).T
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def timestamps(self)->np.ndarray:
+        return self.index['timestamp']
+
+    def capture(self,i:int)->StereoCapture:
+        return StereoCapture(self[i],self.sample_freq)
+
+    def stack(self)->np.ndarray:
+        """Every ping in one array, the pings have to be the same length
+
+        Returns:
+            np.ndarray: (pings, channels, n) copy
+        """
+        lengths = np.unique(self.index['n_samples'])
+        if len(lengths) > 1:
+            raise ValueError(f"pings have different lengths {lengths}")
+        n = int(lengths[0]) if len(lengths) else 0
+        out = np.empty((len(self),self.channels,n),dtype=self.dtype)
+        for i in range(len(self)):
+            out[i] = self[i]
+        return out
+
+    def close(self)->None:
+        # the map is released once nothing points at it anymore
+        self.mm = None
+
+
+def convert_npy_run(run_dir:str,file_path:str = None,chunk_pings:int = 256)->str:
+    """Packs a run folder of left_ear_{i}.npy / right_ear_{i}.npy into one run file
+
+    Args:
+        run_dir (str): folder from an older do_run or the GUI
+        file_path (str, optional): run file to write, None puts run.bbrun in run_dir. Defaults to None.
+        chunk_pings (int, optional): index entries per chunk. Defaults to 256.
+
+    Returns:
+        str: path of the run file
+    """
+    if file_path is None:
+        file_path = os.path.join(run_dir,"run.bbrun")
+
+    pings = []
+    for left_path in glob.glob(os.path.join(run_dir,"left_ear_*.npy")):
+        match = re.search(r"left_ear_(\d+)\.npy$",left_path)
+        if match is None:
+            continue
+        right_path = os.path.join(run_dir,f"right_ear_{match.group(1)}.npy")
+        if os.path.exists(right_path):
+            pings.append((int(match.group(1)),left_path,right_path))
+    pings.sort()
+
+    with RunWriter(file_path,chunk_pings=chunk_pings,flush_every=0) as writer:
+        for i,left_path,right_path in pings:
+            # the old layout has no timestamps, the file time is the closest thing
+            writer.append(np.stack((np.load(left_path),np.load(right_path))),os.path.getmtime(left_path))
+
+    return file_path
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+
+    if len(sys.argv) > 1:
+        for run_dir in sys.argv[1:]:
+            print(f"wrote {convert_npy_run(run_dir)}")
+        sys.exit()
+
+    # 30ms pings, one file per ear per ping vs one run file
+    pings = 500
+    raw = np.random.default_rng(0).integers(0,1024,60000).astype(np.uint16)
+    capture = StereoCapture.from_interleaved(raw)
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        for i in range(pings):
+            capture.save(tmp,suffix=f"_{i}")
+        npy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with RunWriter(os.path.join(tmp,"run.bbrun")) as writer:
+            for i in range(pings):
+                writer.append_capture(capture)
+        run_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        convert_npy_run(tmp,os.path.join(tmp,"converted.bbrun"))
+        convert_time = time.perf_counter() - start
+
+        reader = RunReader(os.path.join(tmp,"converted.bbrun"))
+        assert len(reader) == pings and np.array_equal(reader[pings - 1],capture.data)
+        reader.close()
+
+    print(f".npy per ear: {npy_time/pings*1e3:.3f} ms/ping")
+    print(f"    run file: {run_time/pings*1e3:.3f} ms/ping")
+    print(f"   converter: {convert_time:.2f} s for {pings} pings")
@@ -0,0 +1,181 @@
+"""Fixed rate stepping on absolute perf_counter deadlines
+
+    time.sleep(1/freq) after each step adds the step's own time on top of the
+    period, so a loop runs slower than asked and more so the faster it goes.
+    DeadlineScheduler keeps step k at start + k*period whatever the steps
+    cost. It sleeps until just before each deadline and busy-waits the rest,
+    since a sleep can wake up late by more than the OS timer slack. How late
+    every step started is binned into a jitter histogram, steps later than a
+    tolerance are counted as missed, and whole periods that were overrun are
+    skipped rather than run back to back to catch up.
+
+        sched = DeadlineScheduler(1/freq)
+        sched.start()
+        while running:
+            sched.wait()
+            send_step()
+        logging.debug(sched.report())
+    """
+
+import time
+import numpy as np
+
+# upper edges of the jitter histogram in seconds, the last bin is anything later
+JITTER_BINS = np.array([10e-6,20e-6,50e-6,100e-6,200e-6,500e-6,1e-3,2e-3,5e-3,10e-3])
+
+
+class DeadlineScheduler:
+
+    def __init__(self,period_s:float,spin_s:float = 5e-4,tolerance_s:float = None,catch_up:bool = False,
+                 history:int = 4096) -> None:
+        """
+        Args:
+            period_s (float): time between steps
+            spin_s (float, optional): the last part of each wait spent busy-waiting instead of sleeping. Defaults to 5e-4.
+            tolerance_s (float, optional): a step later than this is missed, None is a tenth of the period. Defaults to None.
+            catch_up (bool, optional): run overrun steps back to back instead of skipping them. Defaults to False.
+            history (int, optional): most recent latenesses kept for percentiles. Defaults to 4096.
+        """
+        self.spin_s = spin_s
+        self.catch_up = catch_up
+        self._tolerance_s = tolerance_s
+        self.start_time = None
+        self._anchor = None
+        self._k = 0
+        self.set_period(period_s)
+
+        self.histogram = np.zeros(len(JITTER_BINS) + 1,dtype=np.int64)
+        self.lateness = np.zeros(history)
+        self.steps = 0
+        self.missed = 0
+        self.skipped = 0
+        self.max_late = 0.0
+
+    def set_period(self,period_s:float)->None:
+        """Changes the rate, the next step is one new period after the last deadline"""
+        if period_s <= 0:
+            raise ValueError(f"period must be positive, got {period_s}")
+        self.period_s = period_s
+        self.tolerance_s = period_s/10 if self._tolerance_s is None else self._tolerance_s
+        if self._k > 0:
+            # re-anchor on the last deadline so the steps so far are not rescaled
+            self._anchor += (self._k - 1)*self._prev_period
+            self._k = 1
+        self._prev_period = period_s
+
+    def start(self,now:float = None)->None:
+        """Sets the first deadline, the first wait returns straight away"""
+        self.start_time = time.perf_counter() if now is None else now
+        self._anchor = self.start_time
+        self._k = 0
+
+    @property
+    def next_deadline(self)->float:
+        return self._anchor + self._k*self.period_s
+
+    def wait(self)->float:
+        """Blocks until the next step is due
+
+        Returns:
+            float: seconds this step starts after its deadline
+        """
+        if self._anchor is None:
+            self.start()
+
+        deadline = self.next_deadline
+        remaining = deadline - time.perf_counter()
+        if remaining > self.spin_s:
+            time.sleep(remaining - self.spin_s)
+        now = time.perf_counter()
+        while now < deadline:
+            now = time.perf_counter()
+
+        late = now - deadline
+        self._record(late)
+        self._k += 1
+
+        if late > self.period_s and not self.catch_up:
+            # whole periods went by, drop them so the next step keeps the phase
+            overrun = int(late//self.period_s)
+            self.skipped += overrun
+            self._k += overrun
+        return late
+
+    def _record(self,late:float)->None:
+        self.histogram[np.searchsorted(JITTER_BINS,late)] += 1
+        self.lateness[self.steps % len(self.lateness)] = late
+        self.steps += 1
+        if late > self.tolerance_s:
+            self.missed += 1
+        if late > self.max_late:
+            self.max_late = late
+
+    def achieved_rate(self)->float:
+        """Steps per second since start, 0 before the second step"""
+        if self.steps < 2:
+            return 0.0
+        # the first step is at start, so steps - 1 periods have gone by
+        return (self.steps - 1)/(time.perf_counter() - self.start_time)
+
+    def stats(self)->dict:
+        """Rate, jitter and missed deadlines so far, times in seconds
+
+        Returns:
+            dict: counters, histogram counts line up with JITTER_BINS plus one overflow bin
+        """
+        late = self.lateness[:min(self.steps,len(self.lateness))]
+        return {
+            'steps': self.steps,
+            'requested_rate': 1/self.period_s,
+            'achieved_rate': self.achieved_rate(),
+            'missed': self.missed,
+            'skipped': self.skipped,
+            'jitter_mean': float(np.mean(late)) if len(late) else 0.0,
+            'jitter_p99': float(np.percentile(late,99)) if len(late) else 0.0,
+            'jitter_max': self.max_late,
+            'histogram': self.histogram.tolist(),
+        }
+
+    def report(self)->str:
+        """One line summary for the log"""
+        s = self.stats()
+        return (f"{s['steps']} steps at {s['achieved_rate']:.2f}/{s['requested_rate']:.2f} Hz, "
+                f"jitter mean {s['jitter_mean']*1e6:.1f} us p99 {s['jitter_p99']*1e6:.1f} us max {s['jitter_max']*1e6:.1f} us, "
+                f"{s['missed']} missed, {s['skipped']} skipped")
+
+    def histogram_table(self)->str:
+        """Jitter histogram as text, one bin per line"""
+        lines = []
+        lower = 0.0
+        for upper,count in zip(list(JITTER_BINS) + [np.inf],self.histogram):
+            label = f"{lower*1e6:6.0f}-{upper*1e6:<6.0f} us" if np.isfinite(upper) else f"{lower*1e6:6.0f}+       us"
+            lines.append(f"{label} {count}")
+            lower = upper
+        return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    # 500 Hz steps that each take 0.4 ms, the old sleep loop against the scheduler
+    freq = 500
+    steps = 1000
+    work = 4e-4
+
+    def busy(t):
+        end = time.perf_counter() + t
+        while time.perf_counter() < end:
+            pass
+
+    start = time.perf_counter()
+    for i in range(steps):
+        busy(work)
+        time.sleep(1/freq)
+    print(f"time.sleep:        {steps/(time.perf_counter() - start):8.2f} Hz of {freq}")
+
+    sched = DeadlineScheduler(1/freq)
+    sched.start()
+    for i in range(steps):
+        sched.wait()
+        busy(work)
+    print(f"DeadlineScheduler: {sched.achieved_rate():8.2f} Hz of {freq}")
+    print(sched.report())
+    print(sched.histogram_table())
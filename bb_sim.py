@@ -0,0 +1,303 @@
+"""Simulated Teensy and ItsyBitsy on pseudo terminals
+
+    Each device owns a pty and runs the firmware side of its protocol on a
+    thread, the host side opens device.port with a plain serial.Serial like
+    it would a real board. fake_spidev does the same for the pinnae, this is
+    for benchmarking bb_listener, bb_emitter and ser_utils without hardware.
+
+        SimTeensy       LISTENER_SERIAL_CMD, streams L/R interleaved uint16
+                        samples in channel_burst_len bursts between
+                        START_LISTEN and STOP_LISTEN, like src/listen/main.cpp
+        SimItsy         ECHO_SERIAL_CMD, chirp upload checked with the same
+                        CRC the firmware sends back, like src/emit/echo_main.cpp
+        SimFramedDevice ser_utils frames, takes emit uploads from
+                        emit.build_emit_upd and answers START_RECORD with data
+                        frames like simple_sonar expects
+
+    Linux and macOS only, pty does not exist on Windows.
+    """
+
+import abc
+import os
+import pty
+import select
+import threading
+import time
+import tty
+import zlib
+import numpy as np
+
+from bb_listener import LISTENER_SERIAL_CMD
+from bb_emitter import ECHO_SERIAL_CMD
+import ser_utils
+
+
+class SimDevice(abc.ABC):
+    """A pty with a thread playing the board. The host opens port, the device
+    talks on the master end.
+    """
+
+    def __init__(self,name:str = "sim") -> None:
+        self.master,self._slave = pty.openpty()
+        # raw so bytes pass untouched, the slave stays open here so the master
+        # keeps working while the host closes and reopens the port
+        tty.setraw(self._slave)
+        os.set_blocking(self.master,False)
+        self.port = os.ttyname(self._slave)
+        self.name = name
+
+        self.rx = bytearray()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run,daemon=True,name=name)
+
+    def __enter__(self)->'SimDevice':
+        self.start()
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback)->None:
+        self.close()
+
+    def start(self)->None:
+        self.thread.start()
+
+    def close(self)->None:
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(1.0)
+        for fd in (self.master,self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _fill(self,timeout:float)->bool:
+        """Waits up to timeout for bytes from the host and appends them to rx"""
+        r,_,_ = select.select([self.master],[],[],timeout)
+        if not r:
+            return False
+        try:
+            data = os.read(self.master,65536)
+        except (BlockingIOError,OSError):
+            return False
+        self.rx += data
+        self.bytes_in += len(data)
+        return len(data) > 0
+
+    def _read(self,n:int,timeout:float = 2.0)->bytes:
+        """n bytes from the host, None if they did not all arrive in time"""
+        deadline = time.perf_counter() + timeout
+        while len(self.rx) < n:
+            left = deadline - time.perf_counter()
+            if left <= 0 or self.stop_event.is_set():
+                return None
+            self._fill(min(left,0.05))
+        data = bytes(self.rx[:n])
+        del self.rx[:n]
+        return data
+
+    def _write(self,data)->None:
+        view = memoryview(bytes(data))
+        while len(view) and not self.stop_event.is_set():
+            select.select([],[self.master],[],0.05)
+            try:
+                sent = os.write(self.master,view)
+            except BlockingIOError:
+                continue
+            self.bytes_out += sent
+            view = view[sent:]
+
+    def _run(self)->None:
+        while not self.stop_event.is_set():
+            self.step()
+
+    @abc.abstractmethod
+    def step(self)->None:
+        """One pass of the board's main loop, run over and over on the thread"""
+
+
+class SimTeensy(SimDevice):
+
+    def __init__(self,channel_burst_len:int = 1000,sample_freq:float = 1e6,realtime:bool = False,seed:int = 0) -> None:
+        """Listener board
+
+        Args:
+            channel_burst_len (int, optional): uint16 per burst, match EchoRecorder. Defaults to 1000.
+            sample_freq (float, optional): per ear, used when realtime. Defaults to 1e6.
+            realtime (bool, optional): pace the stream at 2 ears x sample_freq, otherwise as fast as the pty takes it. Defaults to False.
+            seed (int, optional): noise seed. Defaults to 0.
+        """
+        super().__init__("SimTeensy")
+        self.channel_burst_len = channel_burst_len
+        self.sample_freq = sample_freq
+        self.realtime = realtime
+
+        # a few bursts of noise around mid scale, streamed round and round
+        rng = np.random.default_rng(seed)
+        self.pattern = (2048 + rng.normal(scale=30,size=16*channel_burst_len)).astype('<u2').tobytes()
+        self.burst_bytes = channel_burst_len*2
+
+        self.streaming = False
+        self.listens = 0
+        self.stream_start = None
+        self.start_times = []
+
+    def _handle(self,cmd:int)->None:
+        if cmd == LISTENER_SERIAL_CMD.START_LISTEN.value:
+            self.streaming = True
+            self.stream_start = time.perf_counter()
+            self.start_times.append(self.stream_start)
+            self.streamed = 0
+            self.listens += 1
+        elif cmd == LISTENER_SERIAL_CMD.STOP_LISTEN.value:
+            self.streaming = False
+        elif cmd == LISTENER_SERIAL_CMD.ACK_REQ.value:
+            self._write([LISTENER_SERIAL_CMD.ACK.value])
+        elif cmd == ord('A'):
+            # check_status
+            self._write(b'A')
+
+    def step(self)->None:
+        self._fill(0 if self.streaming else 0.05)
+        while self.rx:
+            cmd = self.rx[0]
+            del self.rx[0]
+            self._handle(cmd)
+
+        if not self.streaming:
+            return
+        if self.realtime:
+            # bytes the ADC would have made by now, 2 ears of uint16
+            due = (time.perf_counter() - self.stream_start)*self.sample_freq*4
+            if self.streamed + self.burst_bytes > due:
+                return
+        pos = self.streamed % len(self.pattern)
+        burst = self.pattern[pos:pos + self.burst_bytes]
+        self._write(burst)
+        self.streamed += len(burst)
+
+
+class SimItsy(SimDevice):
+
+    def __init__(self,max_chirp_len:int = 65000) -> None:
+        """Emitter board
+
+        Args:
+            max_chirp_len (int, optional): EMIT_BUF_LEN of the firmware. Defaults to 65000.
+        """
+        super().__init__("SimItsy")
+        self.max_chirp_len = max_chirp_len
+        self.chirp = None
+        self.uploads = 0
+        self.upload_errors = 0
+        self.emits = 0
+        self.emit_times = []
+
+    def _error(self)->None:
+        self.upload_errors += 1
+        self._write([ECHO_SERIAL_CMD.ERROR.value])
+        # the firmware drains whatever is left after an error
+        time.sleep(5e-3)
+        self._fill(0)
+        self.rx.clear()
+
+    def _upload(self)->None:
+        raw = self._read(2)
+        if raw is None:
+            self._error()
+            return
+        chirp_len = raw[0] | raw[1] << 8
+        if chirp_len > self.max_chirp_len:
+            self._write([ECHO_SERIAL_CMD.CHIRP_DATA_TOO_LONG.value])
+            self.upload_errors += 1
+            return
+        self._write([chirp_len & 0xff,(chirp_len >> 8) & 0xff,ECHO_SERIAL_CMD.ACK.value])
+
+        data = self._read(chirp_len*2)
+        if data is None:
+            self._error()
+            return
+        cmd = self._read(1)
+        if cmd is None or cmd[0] != ECHO_SERIAL_CMD.ACK_REQ.value:
+            self._error()
+            return
+
+        self.chirp = np.frombuffer(data,dtype='<u2').copy()
+        self.uploads += 1
+        # CRC32 over the uint16 buffer is the same as zlib over its little endian bytes
+        self._write(bytes([ECHO_SERIAL_CMD.ACK.value]) + zlib.crc32(data).to_bytes(4,'little'))
+
+    def step(self)->None:
+        cmd = self._read(1,timeout=0.05)
+        if cmd is None:
+            return
+        cmd = cmd[0]
+        if cmd == ECHO_SERIAL_CMD.ACK_REQ.value:
+            self._write([ECHO_SERIAL_CMD.ACK.value])
+        elif cmd == ECHO_SERIAL_CMD.EMIT_CHIRP.value:
+            self.emit_times.append(time.perf_counter())
+            self.emits += 1
+            self._write([ECHO_SERIAL_CMD.ACK.value])
+        elif cmd == ECHO_SERIAL_CMD.GET_MAX_UINT16_CHIRP_LEN.value:
+            self._write([ECHO_SERIAL_CMD.GET_MAX_UINT16_CHIRP_LEN.value,self.max_chirp_len & 0xff,(self.max_chirp_len >> 8) & 0xff])
+        elif cmd == ECHO_SERIAL_CMD.CHIRP_DATA.value:
+            self._upload()
+        elif cmd in (ECHO_SERIAL_CMD.ACK.value,ECHO_SERIAL_CMD.ERROR.value):
+            pass
+        else:
+            self._error()
+
+
+# simple_sonar's record request
+START_RECORD = 0x33
+
+
+class SimFramedDevice(SimDevice):
+
+    def __init__(self,samples_per_record:int = 25000,seed:int = 0) -> None:
+        """Board speaking the ser_utils framed protocol
+
+        Args:
+            samples_per_record (int, optional): uint16 sent back for each START_RECORD. Defaults to 25000.
+            seed (int, optional): noise seed. Defaults to 0.
+        """
+        super().__init__("SimFramedDevice")
+        self.decoder = ser_utils.FrameDecoder()
+        rng = np.random.default_rng(seed)
+        samples = (2048 + rng.normal(scale=30,size=samples_per_record)).astype('<u2')
+        # encoded once, a record is the same frames every time
+        chunks,_ = ser_utils.to_chunks(ser_utils.TX_DATA_FRAME,samples,order=2)
+        self.record = b''.join(bytes(chunk) for chunk in chunks)
+        self.record_frames = len(chunks)
+
+        self.emit_len = None
+        self.emit_chunks = 0
+        self.emit_data = bytearray()
+        self.uploads = 0
+        self.records = 0
+
+    def _handle(self,frame_type:int,payload:bytes)->None:
+        if frame_type == ser_utils.TX_MSG_FRAME and payload[:1] == b'\x01':
+            # emit update header from build_emit_upd, lengths are big endian
+            self.emit_len = payload[1] << 8 | payload[2]
+            self.emit_chunks = payload[3] << 8 | payload[4]
+            self.emit_data = bytearray()
+        elif frame_type == ser_utils.TX_DATA_FRAME and self.emit_len is not None:
+            self.emit_data += payload
+            self.emit_chunks -= 1
+            if self.emit_chunks == 0:
+                self.uploads += 1
+                self.emit_len = None
+        elif frame_type == START_RECORD:
+            self.records += 1
+            self._write(self.record)
+
+    def step(self)->None:
+        if not self._fill(0.05):
+            return
+        data = bytes(self.rx)
+        self.rx.clear()
+        for frame_type,payload in self.decoder.feed(data):
+            self._handle(frame_type,payload)
@@ -0,0 +1,442 @@
+"""Spectrogram rendering shared by bb_repl, bb_gui and src/listen/recieve.py
+
+    SpecEngine computes the same PSD spectrogram as mlab.specgram, but the
+    window, frame strides and axes are made once per setting and both ears go
+    through one rfft. The log, normalization and dB floor clamp are done as
+    whole array operations. plot_spec draws a one off spectrogram, SpecView
+    keeps one image on the axes and only swaps its pixels for live runs. Run
+    this file to benchmark them against the old versions.
+    """
+
+import functools
+import threading
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class SpecEngine:
+    """Spectrogram plan for one (Fs, NFFT, noverlap, window, length, channels).
+
+    The engine owns an input buffer with a strided frame view on top of it, so a
+    ping only fills the buffer and runs the rfft. Results match
+    mlab.specgram(x, Fs=Fs, NFFT=NFFT, noverlap=noverlap, window=window) for
+    each channel. The buffer is shared, use one engine per thread,
+    get_spec_engine hands every thread its own.
+    """
+
+    def __init__(self, Fs, NFFT:int, noverlap:int, window:np.ndarray, length:int, channels:int = 1) -> None:
+        """
+        Args:
+            Fs (float): sample rate
+            NFFT (int): samples per segment
+            noverlap (int): samples shared by neighbouring segments
+            window (np.ndarray): NFFT long window
+            length (int): samples per channel
+            channels (int, optional): channels computed together. Defaults to 1.
+        """
+        self.Fs = Fs
+        self.NFFT = NFFT
+        self.noverlap = noverlap
+        self.length = length
+        self.channels = channels
+        self.window = np.asarray(window, dtype=np.float64)
+        if self.window.shape != (NFFT,):
+            raise ValueError(f"window has {self.window.size} samples, NFFT is {NFFT}")
+
+        step = NFFT - noverlap
+        # short captures are zero padded to one segment like mlab does
+        padded = max(length, NFFT)
+        self.buffer = np.zeros((channels, padded))
+        self.frames = sliding_window_view(self.buffer, NFFT, axis=-1)[:, ::step]
+        # reused every ping, a fresh array this size costs more than the rfft
+        self.windowed = np.empty(self.frames.shape)
+
+        self.freqs = np.fft.rfftfreq(NFFT, 1/Fs)
+        self.t = np.arange(NFFT/2, padded - NFFT/2 + 1, step)/Fs
+        # handed out with every result, nobody gets to change them
+        self.freqs.flags.writeable = False
+        self.t.flags.writeable = False
+
+        # one sided psd, every bin but DC and Nyquist counts twice
+        self.scale = np.full(len(self.freqs), 1/(Fs*np.sum(np.abs(self.window)**2)))
+        if NFFT % 2:
+            self.scale[1:] *= 2
+        else:
+            self.scale[1:-1] *= 2
+
+    def run(self)->np.ndarray:
+        """Spectrogram of whatever is in buffer
+
+        Returns:
+            np.ndarray: (channels, freqs, segments) power spectral density
+        """
+        np.multiply(self.frames, self.window, out=self.windowed)
+        X = np.fft.rfft(self.windowed, axis=-1)
+        s = X.real**2
+        s += X.imag**2
+        s *= self.scale
+        return s.swapaxes(-1, -2)
+
+    def specgram(self, x:np.ndarray)->np.ndarray:
+        """Copies x in and computes its spectrogram
+
+        Args:
+            x (np.ndarray): (channels, length) or (length,) for one channel
+
+        Returns:
+            np.ndarray: (channels, freqs, segments), or (freqs, segments) for 1D x
+        """
+        x = np.asarray(x)
+        self.buffer[:, :self.length] = x.reshape(self.channels, self.length)
+        s = self.run()
+        return s[0] if x.ndim == 1 else s
+
+
+@functools.lru_cache(maxsize=16)
+def _cached_engine(thread_id, Fs, NFFT, noverlap, window_bytes, length, channels)->SpecEngine:
+    return SpecEngine(Fs, NFFT, noverlap, np.frombuffer(window_bytes), length, channels)
+
+
+def get_spec_engine(Fs, NFFT:int, noverlap:int, window:np.ndarray = None, length:int = 0, channels:int = 1)->SpecEngine:
+    """Engine for these settings, made once per thread and reused after that
+
+    Args:
+        Fs (float): sample rate
+        NFFT (int): samples per segment
+        noverlap (int): samples shared by neighbouring segments
+        window (np.ndarray, optional): NFFT long window, None is mlab's default hanning. Defaults to None.
+        length (int, optional): samples per channel. Defaults to 0.
+        channels (int, optional): channels computed together. Defaults to 1.
+
+    Returns:
+        SpecEngine: the calling thread's cached engine
+    """
+    if window is None:
+        window = np.hanning(NFFT)
+    window = np.ascontiguousarray(window, dtype=np.float64)
+    # engines fill their buffer in place, so threads must not share one
+    return _cached_engine(threading.get_ident(), float(Fs), int(NFFT), int(noverlap), window.tobytes(), int(length), int(channels))
+
+
+def process(raw, spec_settings, time_offs = 0):
+    """Removes the mean, cuts off the first time_offs samples and takes the
+    spectrogram of the rest
+
+    Args:
+        raw (np.ndarray): one ear
+        spec_settings (tuple): (Fs, NFFT, noverlap, window)
+        time_offs (int, optional): samples to cut from the start. Defaults to 0.
+
+    Returns:
+        tuple: (s, f, t), the cut samples, the samples before the cut
+    """
+    unraw_balanced = raw - np.mean(raw)
+
+    pt_cut = unraw_balanced[time_offs:]
+    remainder = unraw_balanced[:time_offs]
+
+    Fs, NFFT, noverlap, window = spec_settings
+    engine = get_spec_engine(Fs, NFFT, noverlap, window, len(pt_cut))
+    spec_tup = (engine.specgram(pt_cut), engine.freqs, engine.t)
+
+    return spec_tup, pt_cut, remainder
+
+
+def process_stereo(data, spec_settings, time_offs = 0):
+    """process for a (channels, N) array in one batch, the mean removed samples
+    go straight into the engine buffer
+
+    Args:
+        data (np.ndarray): (channels, N) samples, like StereoCapture.data
+        spec_settings (tuple): (Fs, NFFT, noverlap, window)
+        time_offs (int, optional): samples to cut from the start. Defaults to 0.
+
+    Returns:
+        tuple: s as (channels, freqs, segments), f, t
+    """
+    Fs, NFFT, noverlap, window = spec_settings
+    channels, n = data.shape[0], data.shape[1] - time_offs
+    engine = get_spec_engine(Fs, NFFT, noverlap, window, n, channels=channels)
+
+    np.subtract(data[:, time_offs:], np.mean(data, axis=1, keepdims=True), out=engine.buffer[:, :n])
+
+    return engine.run(), engine.freqs, engine.t
+
+
+def process_ears(left, right, spec_settings, time_offs = 0):
+    """process_stereo for two separate ears
+
+    Args:
+        left (np.ndarray): left ear
+        right (np.ndarray): right ear, same length as left
+        spec_settings (tuple): (Fs, NFFT, noverlap, window)
+        time_offs (int, optional): samples to cut from the start. Defaults to 0.
+
+    Returns:
+        tuple: (s, f, t) for the left ear, (s, f, t) for the right ear
+    """
+    s, f, t = process_stereo(np.stack((left, right)), spec_settings, time_offs)
+
+    return (s[0], f, t), (s[1], f, t)
+
+
+def spec_to_db(spec_tup, fbounds = (30E3, 100E3), dB_range = 40)->tuple[np.ndarray,np.ndarray,np.ndarray]:
+    """Converts a (s, f, t) spectrogram to dB relative to its peak above fmin,
+    clamped to -dB_range.
+
+    Args:
+        spec_tup (tuple): (s, f, t) as returned by mlab.specgram
+        fbounds (tuple, optional): (fmin, fmax), rows below fmin are cut. Defaults to (30E3, 100E3).
+        dB_range (int, optional): dB below the peak to clamp to. Defaults to 40.
+
+    Returns:
+        tuple[np.ndarray,np.ndarray,np.ndarray]: s_cut in dB, f_cut, t
+    """
+    fmin, fmax = fbounds
+    s, f, t = spec_tup
+
+    lfc = (f >= fmin).argmax()
+    f_cut = f[lfc:]
+
+    # empty bins go to -inf and get clamped with everything else
+    with np.errstate(divide='ignore'):
+        s_cut = 20*np.log10(s[lfc:])
+
+    s_cut -= np.amax(s_cut)
+    np.maximum(s_cut, -dB_range, out=s_cut)
+
+    return s_cut, f_cut, t
+
+
+def plot_spec(ax, fig, spec_tup, fbounds = (30E3, 100E3), dB_range = 40, plot_title = 'spec',plot_db=False,khz_ticks=False):
+    """Draws the spectrogram on ax with pcolormesh
+
+    Args:
+        ax (plt.axes): axes to draw on
+        fig (plt.figure): figure the colorbar is added to
+        spec_tup (tuple): (s, f, t) as returned by mlab.specgram
+        fbounds (tuple, optional): (fmin, fmax) to show. Defaults to (30E3, 100E3).
+        dB_range (int, optional): dB below the peak to clamp to. Defaults to 40.
+        plot_title (str, optional): title of the axes. Defaults to 'spec'.
+        plot_db (bool, optional): add a dB colorbar. Defaults to False.
+        khz_ticks (bool, optional): label the frequency axis every 10 kHz. Defaults to False.
+    """
+    fmin, fmax = fbounds
+    s_cut, f_cut, t = spec_to_db(spec_tup, fbounds, dB_range)
+
+    cf = ax.pcolormesh(t, f_cut, s_cut, cmap='jet', shading='auto')
+    if plot_db:
+        cbar = fig.colorbar(cf, ax=ax)
+        cbar.ax.set_ylabel('dB')
+
+    ax.set_ylim(fmin, fmax)
+    if khz_ticks:
+        ax.set_yticks(range(int(fmin), int(fmax) + 1, 10000))
+        ax.set_yticklabels([f'{int(val)} kHz' for val in ax.get_yticks()/1000])
+    ax.set_ylabel('Frequency (Hz)')
+    ax.set_xlabel('Time (sec)')
+    ax.title.set_text(plot_title)
+
+
+class SpecView:
+    """Live spectrogram on one axes.
+
+    The image, labels and colorbar are made on the first update, after that a
+    ping only sets the pixel data and color limits. When the canvas supports it
+    the image is blitted over a saved background instead of redrawing the whole
+    figure. The view rebuilds itself if the spectrogram shape or axes change.
+    """
+
+    def __init__(self, ax, fbounds = (30E3, 100E3), dB_range = 40, plot_title = 'spec',plot_db=True,khz_ticks=False,tight_layout=False):
+        """
+        Args:
+            ax (plt.axes): axes the view owns, it is cleared on the first update
+            fbounds (tuple, optional): (fmin, fmax) to show. Defaults to (30E3, 100E3).
+            dB_range (int, optional): dB below the peak to clamp to. Defaults to 40.
+            plot_title (str, optional): title of the axes. Defaults to 'spec'.
+            plot_db (bool, optional): add a dB colorbar. Defaults to True.
+            khz_ticks (bool, optional): label the frequency axis every 10 kHz. Defaults to False.
+            tight_layout (bool, optional): run tight_layout on the figure after building. Defaults to False.
+        """
+        self.ax = ax
+        self.fig = ax.figure
+        self.fbounds = fbounds
+        self.dB_range = dB_range
+        self.plot_title = plot_title
+        self.plot_db = plot_db
+        self.khz_ticks = khz_ticks
+        self.tight_layout = tight_layout
+
+        self.image = None
+        self.cbar = None
+        self.extent = None
+        self.background = None
+        self.draw_cid = None
+        self.rebuilds = 0
+
+    def update(self, spec_tup)->None:
+        """Shows a new spectrogram
+
+        Args:
+            spec_tup (tuple): (s, f, t) as returned by mlab.specgram
+        """
+        s_cut, f_cut, t = spec_to_db(spec_tup, self.fbounds, self.dB_range)
+        # rows above fmax are never on screen, keep them out of the image
+        hfc = np.searchsorted(f_cut, self.fbounds[1], side='right') + 1
+        s_cut = s_cut[:hfc]
+        f_cut = f_cut[:hfc]
+        extent = self._extent(f_cut, t)
+
+        if self.image is None or self.image.get_array().shape != s_cut.shape or extent != self.extent:
+            self._build(s_cut, extent)
+            return
+
+        self.image.set_data(s_cut)
+        self.image.set_clim(-self.dB_range, 0)
+        self._blit()
+
+    def _extent(self, f_cut, t)->tuple:
+        # pixel edges, the same cells pcolormesh(shading='auto') would draw
+        dt = t[1] - t[0] if len(t) > 1 else 1.0
+        df = f_cut[1] - f_cut[0] if len(f_cut) > 1 else 1.0
+        return (t[0] - dt/2, t[-1] + dt/2, f_cut[0] - df/2, f_cut[-1] + df/2)
+
+    def _build(self, s_cut, extent)->None:
+        fmin, fmax = self.fbounds
+        canvas = self.fig.canvas
+
+        if self.cbar is not None:
+            self.cbar.remove()
+            self.cbar = None
+        self.ax.cla()
+
+        blit = canvas.supports_blit
+        self.image = self.ax.imshow(s_cut, cmap='jet', origin='lower', aspect='auto', interpolation='nearest', interpolation_stage='data',
+                                    extent=extent, vmin=-self.dB_range, vmax=0, animated=blit)
+        self.extent = extent
+        if self.plot_db:
+            self.cbar = self.fig.colorbar(self.image, ax=self.ax)
+            self.cbar.ax.set_ylabel('dB')
+
+        self.ax.set_ylim(fmin, fmax)
+        if self.khz_ticks:
+            self.ax.set_yticks(range(int(fmin), int(fmax) + 1, 10000))
+            self.ax.set_yticklabels([f'{int(val)} kHz' for val in self.ax.get_yticks()/1000])
+        self.ax.set_ylabel('Frequency (Hz)')
+        self.ax.set_xlabel('Time (sec)')
+        self.ax.title.set_text(self.plot_title)
+        if self.tight_layout:
+            self.fig.tight_layout()
+
+        # any full redraw (first show, resize) takes a new background
+        if blit and self.draw_cid is None:
+            self.draw_cid = canvas.mpl_connect('draw_event', self._on_draw)
+        self.rebuilds += 1
+        canvas.draw()
+
+    def _on_draw(self, event)->None:
+        if self.image is None:
+            return
+        canvas = self.fig.canvas
+        self.background = canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.image)
+
+    def _blit(self)->None:
+        canvas = self.fig.canvas
+        if self.background is None:
+            canvas.draw_idle()
+            return
+        canvas.restore_region(self.background)
+        self.ax.draw_artist(self.image)
+        # the image would otherwise cover the axes frame
+        for spine in self.ax.spines.values():
+            self.ax.draw_artist(spine)
+        canvas.blit(self.ax.bbox)
+
+
+if __name__ == '__main__':
+    import time
+    import matplotlib.mlab as mlab
+    from scipy import signal
+
+    def clamp_loop(spec_tup, fbounds, dB_range):
+        # the per bin clamp plot_spec used to do
+        fmin, fmax = fbounds
+        s, f, t = spec_tup
+        lfc = (f >= fmin).argmax()
+        s = 20*np.log10(s)
+        s_cut = s[:][lfc:] - np.amax(s[lfc:])
+        [rows_s, cols_s] = np.shape(s_cut)
+        for col in range(cols_s):
+            for row in range(rows_s):
+                if s_cut[row][col] < -dB_range:
+                    s_cut[row][col] = -dB_range
+        return s_cut
+
+    # same settings as a 30ms run
+    Fs = 1e6
+    NFFT = 512
+    noverlap = 400
+    raw = np.random.default_rng(0).normal(size=30000)
+    spec_tup = mlab.specgram(raw, Fs=Fs, NFFT=NFFT, noverlap=noverlap, window=signal.windows.hann(NFFT))
+    print(f"spectrogram {spec_tup[0].shape[0]} x {spec_tup[0].shape[1]} bins")
+
+    for name, fun, reps in (("loop", clamp_loop, 5), ("vectorized", spec_to_db, 500)):
+        start = time.perf_counter()
+        for i in range(reps):
+            fun(spec_tup, (30E3, 100E3), 40)
+        per_frame = (time.perf_counter() - start)/reps
+        print(f"{name:>10}: {per_frame*1e3:8.3f} ms/frame per ear")
+
+    assert np.array_equal(clamp_loop(spec_tup, (30E3, 100E3), 40), spec_to_db(spec_tup, (30E3, 100E3), 40)[0])
+
+    # spectrogram of both ears, mlab per ear vs one batched engine call
+    L = np.random.default_rng(1).integers(0, 1024, 30000).astype(np.uint16)
+    R = np.random.default_rng(2).integers(0, 1024, 30000).astype(np.uint16)
+    spec_settings = (Fs, NFFT, noverlap, signal.windows.hann(NFFT))
+
+    def mlab_ears(L, R, spec_settings, time_offs):
+        Fs, NFFT, noverlap, window = spec_settings
+        return [mlab.specgram(raw[time_offs:] - np.mean(raw), Fs=Fs, NFFT=NFFT, noverlap=noverlap, window=window) for raw in (L, R)]
+
+    for name, fun in (("mlab", mlab_ears), ("SpecEngine", process_ears)):
+        reps = 200
+        start = time.perf_counter()
+        for i in range(reps):
+            fun(L, R, spec_settings, 3000)
+        print(f"{name:>10}: {(time.perf_counter() - start)/reps*1e3:8.3f} ms/ping")
+
+    for ours, theirs in zip(process_ears(L, R, spec_settings, 3000), mlab_ears(L, R, spec_settings, 3000)):
+        assert all(np.allclose(a, b) for a, b in zip(ours, theirs))
+
+    # redraw cost for a two ear figure, rebuilding vs updating in place
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    def rebuild(axes, fig):
+        for ax in axes:
+            ax.cla()
+            plot_spec(ax, fig, spec_tup, plot_title='rebuild')
+        fig.tight_layout()
+        fig.canvas.draw()
+
+    fig = Figure(figsize=(9,7))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(nrows=2)
+    reps = 20
+    start = time.perf_counter()
+    for i in range(reps):
+        rebuild(axes, fig)
+    print(f"{'rebuild':>10}: {(time.perf_counter() - start)/reps*1e3:8.3f} ms/ping")
+
+    fig = Figure(figsize=(9,7))
+    FigureCanvasAgg(fig)
+    views = [SpecView(ax, plot_title='view') for ax in fig.subplots(nrows=2)]
+    for view in views:
+        view.update(spec_tup)
+    reps = 200
+    start = time.perf_counter()
+    for i in range(reps):
+        for view in views:
+            view.update(spec_tup)
+    print(f"{'SpecView':>10}: {(time.perf_counter() - start)/reps*1e3:8.3f} ms/ping")
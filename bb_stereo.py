@@ -0,0 +1,229 @@
+"""Both ears of one capture as a single (2, N) array
+
+    The Teensy interleaves left and right samples, so the stereo array is just a
+    reshaped view of the raw capture. Mean removal, filtering, spectrograms and
+    correlation run on both rows in one call instead of once per ear. Firmware
+    that streams whole bursts of one ear at a time is split with split_bursts.
+    """
+
+import functools
+import os
+import numpy as np
+from scipy import signal
+
+import bb_spec
+
+LEFT = 0
+RIGHT = 1
+
+
+@functools.lru_cache(maxsize=8)
+def bandpass_sos(lowcut, highcut, fs, order=5)->np.ndarray:
+    """Butterworth bandpass as second order sections, designed once per setting
+
+    Args:
+        lowcut (float): low edge in Hz
+        highcut (float): high edge in Hz
+        fs (float): sample rate
+        order (int, optional): filter order. Defaults to 5.
+
+    Returns:
+        np.ndarray: sos array for signal.sosfilt
+    """
+    return signal.butter(order, [lowcut, highcut], fs=fs, btype='band', output='sos')
+
+
+def split_bursts(raw_data:np.ndarray,burst_len:int,left_first:bool = True)->tuple[np.ndarray,np.ndarray]:
+    """Splits data that alternates between the ears every burst_len samples
+
+    The whole pairs of bursts are a (bursts, 2, burst_len) view, each ear is one
+    strided copy out of it. A partial burst at the end goes to whichever ear
+    was next, so the ears can differ in length.
+
+    Args:
+        raw_data (np.ndarray): burst interleaved samples
+        burst_len (int): samples in each burst
+        left_first (bool, optional): the first burst is the left ear. Defaults to True.
+
+    Returns:
+        tuple[np.ndarray,np.ndarray]: left ear, right ear
+    """
+    raw_data = np.asarray(raw_data)
+    n = len(raw_data)
+    pairs = n//(2*burst_len)
+    body = pairs*burst_len
+    tail = raw_data[2*body:]
+    first_len = body + min(len(tail),burst_len)
+
+    first = np.empty(first_len,dtype=raw_data.dtype)
+    second = np.empty(n - first_len,dtype=raw_data.dtype)
+    bursts = raw_data[:2*body].reshape(pairs,2,burst_len)
+    first[:body].reshape(pairs,burst_len)[...] = bursts[:,0]
+    second[:body].reshape(pairs,burst_len)[...] = bursts[:,1]
+    if len(tail):
+        first[body:] = tail[:burst_len]
+        second[body:] = tail[burst_len:]
+
+    if left_first:
+        return first,second
+    return second,first
+
+
+def load_raw(file_name:str,mmap:bool = False)->np.ndarray:
+    """Reads a raw capture of little endian uint16 in one go
+
+    Args:
+        file_name (str): file written straight from the serial port
+        mmap (bool, optional): map the file read only instead of reading it, for captures
+            bigger than memory. Defaults to False.
+
+    Returns:
+        np.ndarray: uint16 samples, a trailing odd byte is ignored
+    """
+    count = os.path.getsize(file_name)//2
+    if mmap:
+        if count == 0:
+            return np.zeros(0,dtype='<u2')
+        return np.memmap(file_name,dtype='<u2',mode='r',shape=(count,))
+    return np.fromfile(file_name,dtype='<u2',count=count)
+
+
+class StereoCapture:
+    """One capture, row 0 is the left ear and row 1 the right ear"""
+
+    def __init__(self,data:np.ndarray,sample_freq:float = 1e6) -> None:
+        """
+        Args:
+            data (np.ndarray): (2, N) samples
+            sample_freq (float, optional): sample rate of each ear. Defaults to 1e6.
+        """
+        data = np.asarray(data)
+        if data.ndim != 2 or data.shape[0] != 2:
+            raise ValueError(f"expected (2, N) samples, got {data.shape}")
+        self.data = data
+        self.sample_freq = sample_freq
+
+    @classmethod
+    def from_interleaved(cls,raw_data:np.uint16,left_first:bool = True,sample_freq:float = 1e6)->'StereoCapture':
+        """Wraps an interleaved capture from EchoRecorder without copying
+
+        Args:
+            raw_data (np.uint16): L/R interleaved samples
+            left_first (bool, optional): the first sample is the left ear. Defaults to True.
+            sample_freq (float, optional): sample rate of each ear. Defaults to 1e6.
+
+        Returns:
+            StereoCapture: a view of raw_data
+        """
+        raw_data = np.asarray(raw_data)
+        # a capture cut short can end half way through a sample pair
+        data = raw_data[:len(raw_data)//2*2].reshape(-1,2).T
+        if not left_first:
+            data = data[::-1]
+        return cls(data,sample_freq)
+
+    @classmethod
+    def from_bursts(cls,raw_data:np.ndarray,burst_len:int,left_first:bool = True,sample_freq:float = 1e6)->'StereoCapture':
+        """Capture from firmware that streams burst_len samples of one ear at a time
+
+        Args:
+            raw_data (np.ndarray): burst interleaved samples
+            burst_len (int): samples in each burst
+            left_first (bool, optional): the first burst is the left ear. Defaults to True.
+            sample_freq (float, optional): sample rate of each ear. Defaults to 1e6.
+
+        Returns:
+            StereoCapture: a copy, the longer ear is cut to the shorter one
+        """
+        raw_data = np.asarray(raw_data)
+        pairs = len(raw_data)//(2*burst_len)
+        body = pairs*burst_len
+        # only a tail longer than a burst has samples for both ears
+        extra = max(len(raw_data) - 2*body - burst_len,0)
+
+        data = np.empty((2,body + extra),dtype=raw_data.dtype)
+        first,second = (LEFT,RIGHT) if left_first else (RIGHT,LEFT)
+        bursts = raw_data[:2*body].reshape(pairs,2,burst_len)
+        data[first,:body].reshape(pairs,burst_len)[...] = bursts[:,0]
+        data[second,:body].reshape(pairs,burst_len)[...] = bursts[:,1]
+        if extra:
+            data[first,body:] = raw_data[2*body:2*body + extra]
+            data[second,body:] = raw_data[2*body + burst_len:]
+        return cls(data,sample_freq)
+
+    @classmethod
+    def from_ears(cls,left_ear:np.ndarray,right_ear:np.ndarray,sample_freq:float = 1e6)->'StereoCapture':
+        return cls(np.stack((left_ear,right_ear)),sample_freq)
+
+    @property
+    def left(self)->np.ndarray:
+        return self.data[LEFT]
+
+    @property
+    def right(self)->np.ndarray:
+        return self.data[RIGHT]
+
+    def __len__(self)->int:
+        return self.data.shape[1]
+
+    def copy(self)->'StereoCapture':
+        """Contiguous copy that no longer shares memory with the capture ring"""
+        return StereoCapture(self.data.copy(),self.sample_freq)
+
+    def balanced(self)->np.ndarray:
+        """Both ears with their own mean removed
+
+        Returns:
+            np.ndarray: (2, N) float samples
+        """
+        return self.data - self.data.mean(axis=1,keepdims=True)
+
+    def bandpass(self,lowcut:float = 30e3,highcut:float = 100e3,order:int = 5)->np.ndarray:
+        """Mean removed and bandpass filtered ears
+
+        Args:
+            lowcut (float, optional): low edge in Hz. Defaults to 30e3.
+            highcut (float, optional): high edge in Hz. Defaults to 100e3.
+            order (int, optional): filter order. Defaults to 5.
+
+        Returns:
+            np.ndarray: (2, N) filtered samples
+        """
+        sos = bandpass_sos(lowcut,highcut,self.sample_freq,order)
+        return signal.sosfilt(sos,self.balanced(),axis=1)
+
+    def spectrogram(self,spec_settings:tuple,time_offs:int = 0)->tuple[np.ndarray,np.ndarray,np.ndarray]:
+        """Spectrogram of both ears, see bb_spec.process_stereo
+
+        Args:
+            spec_settings (tuple): (Fs, NFFT, noverlap, window)
+            time_offs (int, optional): samples to cut from the start. Defaults to 0.
+
+        Returns:
+            tuple[np.ndarray,np.ndarray,np.ndarray]: s as (2, freqs, segments), f, t
+        """
+        return bb_spec.process_stereo(self.data,spec_settings,time_offs)
+
+    def correlate(self,template:np.ndarray,mode:str = 'same')->np.ndarray:
+        """Cross correlation of both mean removed ears with template, the same
+        thing as signal.correlate on each ear
+
+        Args:
+            template (np.ndarray): signal to look for, like the emitted chirp
+            mode (str, optional): 'full', 'same' or 'valid'. Defaults to 'same'.
+
+        Returns:
+            np.ndarray: (2, M) correlation
+        """
+        kernel = np.conj(np.asarray(template)[::-1])
+        return signal.fftconvolve(self.balanced(),kernel[np.newaxis,:],mode=mode,axes=1)
+
+    def save(self,directory:str,suffix:str = '')->None:
+        """Saves the ears as left_ear{suffix}.npy and right_ear{suffix}.npy
+
+        Args:
+            directory (str): folder to save in
+            suffix (str, optional): added to the file names, like the ping number. Defaults to ''.
+        """
+        np.save(directory+f"/left_ear{suffix}.npy",self.left)
+        np.save(directory+f"/right_ear{suffix}.npy",self.right)
@@ -0,0 +1,249 @@
+"""Pinna movement files compiled into dense trajectories
+
+    A movement file (*_PM.yaml, saved by bb_gui) holds keyframes of the 7
+    motor angles and a speed in keyframes per second. compile_trajectory
+    resamples the keyframes at a fixed update rate with one of
+
+        step        hold each keyframe, what the instruction table always did
+        linear      straight lines between keyframes
+        cubic       Catmull-Rom spline through every keyframe
+        minjerk     5th order min-jerk blend, stops at every keyframe
+
+    and clamps the result to the motor limits, every step in one array
+    operation. Playback then only indexes rows of an int16 (steps, 7) array.
+
+    load_trajectory caches the result next to the YAML as .bbtraj, all little
+    endian:
+
+        header          HEADER_DTYPE, 96 bytes
+        angles          steps x motors int16
+
+    The header holds the settings and a CRC of the keyframes it was made from,
+    the cache is rebuilt whenever any of them differ or the file is not as
+    long as the header says.
+    """
+
+import os
+import zlib
+import yaml
+import numpy as np
+
+TRAJ_MAGIC = b'BBTRAJ01'
+TRAJ_VERSION = 1
+MAX_MOTORS = 7
+
+METHODS = ('step','linear','cubic','minjerk')
+DEFAULT_RATE_HZ = 100.0
+
+HEADER_DTYPE = np.dtype([
+    ('magic','S8'),
+    ('version','<u4'),
+    ('motors','<u4'),
+    ('steps','<u8'),
+    ('rate','<f8'),
+    ('speed','<f8'),
+    ('method','S8'),
+    ('loop','<u4'),
+    ('keyframes_crc','<u4'),
+    ('min_limits','<i2',(MAX_MOTORS,)),
+    ('max_limits','<i2',(MAX_MOTORS,)),
+    ('reserved','S12'),
+])
+
+
+def load_movements(yaml_path:str)->tuple[np.int16,float]:
+    """Keyframes and speed of a movement file
+
+    Args:
+        yaml_path (str): file with a 'pinna_movements' section
+
+    Returns:
+        tuple[np.int16,float]: (keyframes, motors) angles, keyframes per second
+    """
+    with open(yaml_path,"r") as f:
+        movements = yaml.safe_load(f)
+    if not movements or 'pinna_movements' not in movements:
+        raise ValueError(f"no 'pinna_movements' in {yaml_path}")
+    movements = movements['pinna_movements']
+    return np.array(movements['angles'],dtype=np.int16).reshape(len(movements['angles']),-1),float(movements['speed'])
+
+
+def _limits(limits,motors:int,default:int)->np.int16:
+    if limits is None:
+        return np.full(motors,default,dtype=np.int16)
+    return np.asarray(limits,dtype=np.int16)
+
+
+def column_limits(min_limits:np.ndarray,max_limits:np.ndarray,columns)->tuple[np.int16,np.int16]:
+    """Limits per keyframe column for an ear that plays column columns[i] on its motor i.
+    A column played on several motors gets the tightest of their limits, a column
+    the ear never plays is not limited.
+
+    Args:
+        min_limits (np.ndarray): lowest angle of each motor of the ear
+        max_limits (np.ndarray): highest angle of each motor of the ear
+        columns (array like): keyframe column each motor plays
+
+    Returns:
+        tuple[np.int16,np.int16]: min and max limits per column
+    """
+    columns = np.asarray(columns)
+    lo = np.full(len(columns),np.iinfo(np.int16).min,dtype=np.int16)
+    hi = np.full(len(columns),np.iinfo(np.int16).max,dtype=np.int16)
+    np.maximum.at(lo,columns,np.asarray(min_limits,dtype=np.int16))
+    np.minimum.at(hi,columns,np.asarray(max_limits,dtype=np.int16))
+    return lo,hi
+
+
+def compile_trajectory(keyframes:np.ndarray,speed:float,rate:float = DEFAULT_RATE_HZ,method:str = 'linear',
+                       min_limits:np.ndarray = None,max_limits:np.ndarray = None,loop:bool = True)->np.int16:
+    """Resamples keyframes at a fixed rate
+
+    Args:
+        keyframes (np.ndarray): (keyframes, motors) angles
+        speed (float): keyframes per second
+        rate (float, optional): steps per second of the result. Defaults to DEFAULT_RATE_HZ.
+        method (str, optional): one of METHODS. Defaults to 'linear'.
+        min_limits (np.ndarray, optional): lowest angle per motor, None does not clamp. Defaults to None.
+        max_limits (np.ndarray, optional): highest angle per motor, None does not clamp. Defaults to None.
+        loop (bool, optional): the last keyframe moves back to the first, like the instruction
+            thread wrapping around. Otherwise it ends on the last keyframe. Defaults to True.
+
+    Returns:
+        np.int16: (steps, motors) angles
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown interpolation {method}, use one of {METHODS}")
+    if speed <= 0 or rate <= 0:
+        raise ValueError(f"speed and rate must be positive, got {speed} and {rate}")
+
+    keys = np.asarray(keyframes,dtype=np.float64)
+    if keys.ndim != 2 or len(keys) == 0:
+        raise ValueError(f"expected (keyframes, motors) angles, got {keys.shape}")
+    n_keys = len(keys)
+
+    # position of every step along the keyframes, segment i runs from key i to i+1
+    segments = n_keys if loop else n_keys - 1
+    steps = max(int(round(segments*rate/speed)),1) + (0 if loop else 1)
+    u = np.arange(steps)*(speed/rate)
+    i = np.minimum(u.astype(np.int64),max(segments - 1,0))
+    f = (u - i)[:,np.newaxis]
+
+    def key(offset:int)->np.ndarray:
+        j = i + offset
+        j = j % n_keys if loop else np.clip(j,0,n_keys - 1)
+        return keys[j]
+
+    p1 = key(0)
+    if method == 'step' or n_keys == 1:
+        angles = p1
+    elif method == 'cubic':
+        p0,p2,p3 = key(-1),key(1),key(2)
+        angles = 0.5*(2*p1 + (p2 - p0)*f + (2*p0 - 5*p1 + 4*p2 - p3)*f**2 + (3*p1 - p0 - 3*p2 + p3)*f**3)
+    else:
+        if method == 'minjerk':
+            f = f**3*(10 - 15*f + 6*f**2)
+        angles = p1 + (key(1) - p1)*f
+
+    motors = keys.shape[1]
+    lo = _limits(min_limits,motors,np.iinfo(np.int16).min)
+    hi = _limits(max_limits,motors,np.iinfo(np.int16).max)
+    return np.clip(np.rint(angles),lo,hi).astype(np.int16)
+
+
+def cache_path(yaml_path:str)->str:
+    """Where load_trajectory keeps the compiled trajectory of a movement file"""
+    return os.path.splitext(yaml_path)[0] + ".bbtraj"
+
+
+def _header(keyframes:np.int16,speed:float,rate:float,method:str,min_limits,max_limits,loop:bool)->np.ndarray:
+    keyframes = np.ascontiguousarray(keyframes,dtype='<i2')
+    motors = keyframes.shape[1]
+    if motors > MAX_MOTORS:
+        raise ValueError(f"{motors} motors, a trajectory file holds at most {MAX_MOTORS}")
+
+    header = np.zeros(1,HEADER_DTYPE)
+    header['magic'] = TRAJ_MAGIC
+    header['version'] = TRAJ_VERSION
+    header['motors'] = motors
+    header['rate'] = rate
+    header['speed'] = speed
+    header['method'] = method.encode()
+    header['loop'] = loop
+    header['keyframes_crc'] = zlib.crc32(keyframes.tobytes())
+    header['min_limits'][0,:motors] = _limits(min_limits,motors,np.iinfo(np.int16).min)
+    header['max_limits'][0,:motors] = _limits(max_limits,motors,np.iinfo(np.int16).max)
+    return header
+
+
+def _matches(stored:np.void,wanted:np.ndarray)->bool:
+    for field in HEADER_DTYPE.names:
+        if field in ('steps','reserved'):
+            continue
+        if not np.array_equal(stored[field],wanted[0][field]):
+            return False
+    return True
+
+
+def cached_trajectory(file_path:str,keyframes:np.ndarray,speed:float,rate:float = DEFAULT_RATE_HZ,method:str = 'linear',
+                      min_limits:np.ndarray = None,max_limits:np.ndarray = None,loop:bool = True)->np.int16:
+    """Compiled trajectory from file_path if it was made from the same keyframes and
+    settings, otherwise compiles it and writes file_path. See compile_trajectory.
+
+    Returns:
+        np.int16: (steps, motors) angles, read only when they come from the file
+    """
+    keyframes = np.asarray(keyframes,dtype=np.int16)
+    header = _header(keyframes,speed,rate,method,min_limits,max_limits,loop)
+
+    if os.path.exists(file_path) and os.path.getsize(file_path) >= HEADER_DTYPE.itemsize:
+        stored = np.fromfile(file_path,dtype=HEADER_DTYPE,count=1)[0]
+        shape = (int(stored['steps']),int(stored['motors']))
+        # a cut short write leaves fewer angles than the header promises, rebuild it
+        complete = os.path.getsize(file_path) == HEADER_DTYPE.itemsize + shape[0]*shape[1]*2
+        if stored['magic'] == TRAJ_MAGIC and stored['version'] == TRAJ_VERSION and _matches(stored,header) and complete:
+            return np.memmap(file_path,dtype='<i2',mode='r',offset=HEADER_DTYPE.itemsize,shape=shape)
+
+    angles = compile_trajectory(keyframes,speed,rate,method,min_limits,max_limits,loop)
+    header['steps'] = len(angles)
+    with open(file_path,'wb') as f:
+        f.write(header.tobytes())
+        f.write(angles.astype('<i2').tobytes())
+    return angles
+
+
+def load_trajectory(yaml_path:str,rate:float = DEFAULT_RATE_HZ,method:str = 'linear',
+                    min_limits:np.ndarray = None,max_limits:np.ndarray = None,loop:bool = True)->tuple[np.int16,float]:
+    """Compiled trajectory of a movement file, cached next to it
+
+    Args:
+        yaml_path (str): *_PM.yaml movement file
+        rate (float, optional): steps per second. Defaults to DEFAULT_RATE_HZ.
+        method (str, optional): one of METHODS. Defaults to 'linear'.
+        min_limits (np.ndarray, optional): lowest angle per motor. Defaults to None.
+        max_limits (np.ndarray, optional): highest angle per motor. Defaults to None.
+        loop (bool, optional): see compile_trajectory. Defaults to True.
+
+    Returns:
+        tuple[np.int16,float]: (steps, motors) angles, rate to play them at
+    """
+    keyframes,speed = load_movements(yaml_path)
+    return cached_trajectory(cache_path(yaml_path),keyframes,speed,rate,method,min_limits,max_limits,loop),rate
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    yaml_path = sys.argv[1] if len(sys.argv) > 1 else 'MOVE_ALL_ONCE_PM.yaml'
+    keyframes,speed = load_movements(yaml_path)
+    lo = np.full(keyframes.shape[1],-180)
+    hi = np.full(keyframes.shape[1],180)
+    print(f"{yaml_path}: {len(keyframes)} keyframes at {speed} Hz")
+
+    reps = 100
+    for method in METHODS:
+        start = time.perf_counter()
+        for i in range(reps):
+            angles = compile_trajectory(keyframes,speed,1000,method,lo,hi)
+        print(f"{method:>8}: {len(angles)} steps at 1 kHz in {(time.perf_counter() - start)/reps*1e3:.3f} ms")
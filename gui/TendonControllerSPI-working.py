@@ -44,6 +44,7 @@ except ImportError:
     logging.error("no spidev found, developing on different os ")
     from fake_spidev import fake_SpiDev as SpiDev
 
+from bb_sched import DeadlineScheduler
 
 
 
@@ -946,11 +947,13 @@ class RunInstructionsThread(QThread):
         self.maxIndex = len(dataArray)
         self.spiObj = spiObj
         self.cycle_count = 0
+        self.scheduler = DeadlineScheduler(self.timeBetween)
         
     def run(self):
         logging.debug("RunInstructionsThread starting")
+        self.scheduler.start()
         while self.runThread:
-            
+            self.scheduler.wait()
             self.spiObj.xfer2(self.data[self.curIndex])
             self.curIndex+=1
             if self.curIndex >= self.maxIndex:
@@ -958,8 +961,7 @@ class RunInstructionsThread(QThread):
                 self.cycle_count += 1
                 self.cycle_complete.emit(self.cycle_count)
             
-            time.sleep(self.timeBetween)
-            
+        logging.debug(f"RunInstructionsThread {self.scheduler.report()}")
         logging.debug("RunInstructionsThread exiting")
         
     def stop(self):
@@ -3,10 +3,14 @@
 import numpy as np
 
 import logging
+import time
+import queue
+import threading
 logging.basicConfig(level=logging.DEBUG)
 import argparse
 from serial import Serial
 from enum import Enum
+from bb_sched import DeadlineScheduler
 
 # for developing on not the PI we create fake library
 # that mimics spidev
@@ -19,10 +23,24 @@ except ImportError:
 # global variables holding number of motors in A ear
 NUM_PINNAE_MOTORS = 7
 
+# SPI frame, one header byte then each motor's angle as big endian int16
+SPI_FRAME_LEN = 1 + NUM_PINNAE_MOTORS*2
+SPI_ANGLE_DTYPE = np.dtype('>i2')
+
+# header byte of each frame, the low bits hold the motor index
+OP_SET_ANGLES = 0x00
+OP_MOVE_TO_MIN = 0x40
+OP_RESET_ZERO = 0x80
+MOVE_CW_FLAG = 0x20
+
 # setting the limits on each motor
 DEFAULT_MIN_ANGLE_LIMIT = np.int16(-180)
 DEFAULT_MAX_ANGLE_LIMIT = np.int16(180)
 
+# frames per second the motion engine streams, waveforms up to half of it
+MOTION_RATE_HZ = 200.0
+MOTION_PATTERNS = ('actuate','sweep','flap')
+
 class COM_TYPE(Enum):
     NONE = -1
     SPI = 0
@@ -44,10 +62,17 @@ class PinnaeController:
         
         self.com_type = COM_TYPE.NONE
         
-
+        # one frame reused for every transfer, the angles are a big endian view into it
+        self._frame = bytearray(SPI_FRAME_LEN)
+        self._frame_angles = np.frombuffer(self._frame,dtype=SPI_ANGLE_DTYPE,offset=1)
 
         self.spi = spiObj
         self.serial = serial_dev
+
+        # held for a whole frame so the motion engine and callers do not interleave
+        self._lock = threading.Lock()
+        # background motion, started on the first actuate/sweep/flap
+        self.motion = None
     
             
         if spiObj != None:
@@ -106,166 +131,55 @@ class PinnaeController:
     def get_ack(self)->bool:
         return False
     
-    def reset_zero_position(self,index:np.uint16)->None:
-        
-        data_buffer = bytearray((NUM_PINNAE_MOTORS*2)+1)
-        
-        data_buffer[0] = (0x80) | index
-        
-        # first motor
-        data_buffer[1] = (self.current_angles[0] >> 8) & 0xff
-        data_buffer[2] =  self.current_angles[0] & 0xff
-        
-        # second motor
-        data_buffer[3] = (self.current_angles[1] >> 8) & 0xff
-        data_buffer[4] =  self.current_angles[1] & 0xff
-        
-        # third motor
-        data_buffer[5] = (self.current_angles[2] >> 8) & 0xff
-        data_buffer[6] =  self.current_angles[2] & 0xff
-        
-        # fourth motor
-        data_buffer[7] = (self.current_angles[3] >> 8) & 0xff
-        data_buffer[8] =  self.current_angles[3] & 0xff
-        
-        # fifth motor
-        data_buffer[9] = (self.current_angles[4] >> 8) & 0xff
-        data_buffer[10] = self.current_angles[4] & 0xff
-        
-        # sixth motor
-        data_buffer[11] = (self.current_angles[5] >> 8) & 0xff
-        data_buffer[12] =  self.current_angles[5] & 0xff
-        
-        # seventh motor
-        data_buffer[13] = (self.current_angles[6] >> 8) & 0xff
-        data_buffer[14] =  self.current_angles[6] & 0xff
-        
+    def pack_frame(self,header:np.uint8,angles:np.int16 = None)->bytearray:
+        """Fills the reusable SPI frame, the header byte followed by all 7 angles
+        as big endian int16. Only the header changes between opcodes.
+
+        Args:
+            header (np.uint8): opcode and its flags
+            angles (np.int16, optional): angles to send. Defaults to None, the current angles.
+
+        Returns:
+            bytearray: the frame, overwritten by the next call
+        """
+        self._frame[0] = header
+        self._frame_angles[:] = self.current_angles if angles is None else angles
+        return self._frame
+
+    def _transfer(self,frame:bytearray)->None:
         if self.com_type == COM_TYPE.SPI:
             if self.spi:
-                self.spi.xfer2(data_buffer)
+                self.spi.xfer2(frame)
             else:
                 logging.error("SPI NOT CONNECTED!")
                 self.com_type = COM_TYPE.NONE
         elif self.com_type == COM_TYPE.UART:
             if self.serial and self.serial.is_open:
-                self.serial.write(data_buffer)
+                self.serial.write(frame)
             else:
                 logging.error("UART NOT CONNECTED!")
-                self.com_type == COM_TYPE.NONE
+                self.com_type = COM_TYPE.NONE
         else:
             logging.error("NO COM TYPE SELECTED CHOOSE UART OR SPI!")
+
+    def reset_zero_position(self,index:np.uint16)->None:
+        with self._lock:
+            self._transfer(self.pack_frame(OP_RESET_ZERO | index))
     
     def move_to_min(self,index:np.uint8, move_cw:bool = True)->None:
-        data_buffer = bytearray((NUM_PINNAE_MOTORS*2) +1)
-        
-        if move_cw:
-            cw_flag = 0x20
-        else:
-            cw_flag = 0x00
-            
-        data_buffer[0] = 0x40 | index | cw_flag
-        
-         # first motor
-        data_buffer[1] = (self.current_angles[0] >> 8) & 0xff
-        data_buffer[2] =  self.current_angles[0] & 0xff
-        
-        # second motor
-        data_buffer[3] = (self.current_angles[1] >> 8) & 0xff
-        data_buffer[4] =  self.current_angles[1] & 0xff
-        
-        # third motor
-        data_buffer[5] = (self.current_angles[2] >> 8) & 0xff
-        data_buffer[6] =  self.current_angles[2] & 0xff
-        
-        # fourth motor
-        data_buffer[7] = (self.current_angles[3] >> 8) & 0xff
-        data_buffer[8] =  self.current_angles[3] & 0xff
-        
-        # fifth motor
-        data_buffer[9] = (self.current_angles[4] >> 8) & 0xff
-        data_buffer[10] = self.current_angles[4] & 0xff
-        
-        # sixth motor
-        data_buffer[11] = (self.current_angles[5] >> 8) & 0xff
-        data_buffer[12] =  self.current_angles[5] & 0xff
-        
-        # seventh motor
-        data_buffer[13] = (self.current_angles[6] >> 8) & 0xff
-        data_buffer[14] =  self.current_angles[6] & 0xff
-        
-        if self.com_type == COM_TYPE.SPI:
-            if self.spi:
-                self.spi.xfer2(data_buffer)
-            else:
-                logging.error("SPI NOT CONNECTED!")
-                self.com_type = COM_TYPE.NONE
-        elif self.com_type == COM_TYPE.UART:
-            if self.serial and self.serial.is_open:
-                self.serial.write(data_buffer)
-            else:
-                logging.error("UART NOT CONNECTED!")
-                self.com_type == COM_TYPE.NONE
-        else:
-            logging.error("NO COM TYPE SELECTED CHOOSE UART OR SPI!")
-            
+        cw_flag = MOVE_CW_FLAG if move_cw else 0x00
+        with self._lock:
+            self._transfer(self.pack_frame(OP_MOVE_TO_MIN | index | cw_flag))
 
     def send_MCU_angles(self) -> None:
         """Sends all 7 of the angles to the Grand Central, 
         in a fashion of 2 bytes for each motor angle. The original 
-        angles are represented as signed 16 int, here we break them into 
-        bytes and send them
+        angles are represented as signed 16 int, sent big endian
+        after a zero header byte
 
         """
-        # data_buffer = np.zeros( NUM_PINNAE_MOTORS*2 +1,dtype=np.uint8)
-        data_buffer = bytearray((NUM_PINNAE_MOTORS*2)+1)
-        
-        # first motor
-        data_buffer[1] = (self.current_angles[0] >> 8) & 0xff
-        data_buffer[2] =  self.current_angles[0] & 0xff
-        
-        # second motor
-        data_buffer[3] = (self.current_angles[1] >> 8) & 0xff
-        data_buffer[4] =  self.current_angles[1] & 0xff
-        
-        # third motor
-        data_buffer[5] = (self.current_angles[2] >> 8) & 0xff
-        data_buffer[6] =  self.current_angles[2] & 0xff
-        
-        # fourth motor
-        data_buffer[7] = (self.current_angles[3] >> 8) & 0xff
-        data_buffer[8] =  self.current_angles[3] & 0xff
-        
-        # fifth motor
-        data_buffer[9] = (self.current_angles[4] >> 8) & 0xff
-        data_buffer[10] = self.current_angles[4] & 0xff
-        
-        # sixth motor
-        data_buffer[11] = (self.current_angles[5] >> 8) & 0xff
-        data_buffer[12] =  self.current_angles[5] & 0xff
-        
-        # seventh motor
-        data_buffer[13] = (self.current_angles[6] >> 8) & 0xff
-        data_buffer[14] =  self.current_angles[6] & 0xff
-        
-        # convert the data to list so we can send it
-        # write_data = data_buffer.tolist()
-    
-        
-        if self.com_type == COM_TYPE.SPI:
-            if self.spi:
-                self.spi.xfer2(data_buffer)
-            else:
-                logging.error("SPI NOT CONNECTED!")
-                self.com_type = COM_TYPE.NONE
-        elif self.com_type == COM_TYPE.UART:
-            if self.serial and self.serial.is_open:
-                self.serial.write(data_buffer)
-            else:
-                logging.error("UART NOT CONNECTED!")
-                self.com_type == COM_TYPE.NONE
-        else:
-            logging.error("NO COM TYPE SELECTED CHOOSE UART OR SPI!")
-            
+        with self._lock:
+            self._transfer(self.pack_frame(OP_SET_ANGLES))
         
     def calibrate_and_get_motor_limits(self)->np.int16:
         pass 
@@ -389,8 +303,7 @@ class PinnaeController:
             return False
         
         # set the angle
-        self.current_angles[motor_index] = angle
-        self.send_MCU_angles()
+        self._send_angles(motor_index,angle)
         return True
 
 
@@ -413,8 +326,7 @@ class PinnaeController:
             return False
         
         # set the values
-        self.current_angles[:] = np.int16(angles[:])
-        self.send_MCU_angles()
+        self._send_angles(slice(None),np.int16(angles[:]))
         return True
 
 
@@ -446,29 +358,25 @@ class PinnaeController:
     # set motors to max angle
     def set_motor_to_max(self,motor_index:np.uint8)->None:
         assert motor_index < NUM_PINNAE_MOTORS, f"Motor index: {motor_index} exceded maximum index{NUM_PINNAE_MOTORS}"
-        self.current_angles[motor_index] = self.max_angle_limits[motor_index]
-        self.send_MCU_angles()
+        self._send_angles(motor_index,self.max_angle_limits[motor_index])
         logging.debug(f"Setting motor: {motor_index} to max value")
 
 
     def set_motors_to_max(self)->None:
         """Set all motors to their max angle
         """
-        self.current_angles[:] = self.max_angle_limits[:]
-        self.send_MCU_angles()
+        self._send_angles(slice(None),self.max_angle_limits)
         logging.debug("Setting motors to max")
 
     # set motors to min angle
     def set_motor_to_min(self,motor_index:np.uint8)->None:
         assert motor_index < NUM_PINNAE_MOTORS, f"Motor index: {motor_index} exceded maximum index{NUM_PINNAE_MOTORS}"
-        self.current_angles[motor_index] = self.min_angle_limits[motor_index]
-        self.send_MCU_angles()
+        self._send_angles(motor_index,self.min_angle_limits[motor_index])
         logging.debug(f"Setting motor: {motor_index} to min")
 
 
     def set_motors_to_min(self)->None:
-        self.current_angles[:] = self.min_angle_limits[:]
-        self.send_MCU_angles()
+        self._send_angles(slice(None),self.min_angle_limits)
         logging.debug("Setting motors to min")
 
 
@@ -480,8 +388,7 @@ class PinnaeController:
             logging.debug(f"Failed to set motor: {motor_index} to zero")
             return False
     
-        self.current_angles[motor_index] = 0
-        self.send_MCU_angles()
+        self._send_angles(motor_index,0)
         logging.debug(f"Success setting motor: {motor_index} to zero")
         
         return True
@@ -492,8 +399,7 @@ class PinnaeController:
             logging.debug("Failed to set motors to zero")
             return False
         
-        self.current_angles[:] = 0
-        self.send_MCU_angles()
+        self._send_angles(slice(None),0)
         logging.debug("Setting all motors to zero")
         return True
     
@@ -501,33 +407,359 @@ class PinnaeController:
     # --------------------------------------------------------------------------------------
     #           Functions for moving the motors
 
+    def motion_engine(self)->'MotionEngine':
+        """The controller's background motion engine, made on first use"""
+        if self.motion is None:
+            self.motion = MotionEngine(self)
+        return self.motion
+
     def actuate_motors(self,frequency:np.uint8,times =None)->None:
-        """This function creates a new thread and will move the 
-        pinnae motors between its max and minimums
+        """Moves all the pinnae motors together between their min and max
+        limits as a smooth cosine, in the background motion engine
 
         Args:
             frequency (np.uint8): speed in hertz to actuate the ears
+            times (np.uint8, optional): cycles to run. Defaults to None, until stop_motion.
         """
-        pass
+        self.motion_engine().start('actuate',frequency,times)
 
     def sweep_motors(self,frequency:np.uint8, times=None)->None:
-        """Will move each ear in order to max and then min in a sweeping 
-        order
+        """Will move each motor in order to max and then min in a sweeping 
+        order, one full sweep of all motors per cycle
 
         Args:
-            frequency (np.uint8): speed in hertz to actuate
-            times (np.uint8, optional): times to sweep through. Defaults to None.
+            frequency (np.uint8): sweeps per second
+            times (np.uint8, optional): times to sweep through. Defaults to None, until stop_motion.
         """
-        pass
+        self.motion_engine().start('sweep',frequency,times)
 
     def flap_pinnae(self,frequency:np.uint8,times=1)->None:
         """Makes all motors go to their max and then min after some time (1/Frequency)
 
         Args:
-            frequency (np.uint8): _description_
-            times (int, optional): _description_. Defaults to 1.
+            frequency (np.uint8): flaps per second
+            times (int, optional): flaps to make, None keeps flapping. Defaults to 1.
+        """
+        self.motion_engine().start('flap',frequency,times)
+
+    def set_motion_frequency(self,frequency:float)->None:
+        """Changes the frequency of the running motion, the waveform carries on from where it is"""
+        self.motion_engine().set_frequency(frequency)
+
+    def retarget_motion(self,min_angles:np.int16 = None,max_angles:np.int16 = None)->None:
+        """Moves between these angles instead of the limits, None goes back to the limits"""
+        self.motion_engine().retarget(min_angles,max_angles)
+
+    def stop_motion(self)->None:
+        """Stops the motion engine where it is, the thread is kept for the next one"""
+        if self.motion is not None:
+            self.motion.stop()
+
+    def close_motion(self)->None:
+        """Ends the motion engine's thread"""
+        if self.motion is not None:
+            self.motion.shutdown()
+            self.motion = None
+
+    def _send_angles(self,index,angles:np.int16)->None:
+        """Sets current_angles[index] and sends them, both under the lock so a
+        frame from the motion engine can not land in between"""
+        with self._lock:
+            self.current_angles[index] = angles
+            self._transfer(self.pack_frame(OP_SET_ANGLES))
+
+
+def motion_angles(pattern:str,phase:float,low:np.ndarray,high:np.ndarray)->np.ndarray:
+    """Angles of a motion pattern at a point in its cycle
+
+    Args:
+        pattern (str): one of MOTION_PATTERNS
+        phase (float): cycles since the start, only the fraction matters
+        low (np.ndarray): lowest angle per motor
+        high (np.ndarray): highest angle per motor
+
+    Returns:
+        np.ndarray: float angles per motor
+    """
+    phase = phase % 1.0
+    if pattern == 'actuate':
+        # starts at low, high half way through the cycle
+        return low + (high - low)*(0.5 - 0.5*np.cos(2*np.pi*phase))
+    if pattern == 'flap':
+        return high if phase < 0.5 else low
+    if pattern == 'sweep':
+        # each motor gets an equal slot of the cycle, rest -> high -> low -> rest
+        rest = np.clip(0,low,high).astype(np.float64)
+        slot = min(int(phase*len(rest)),len(rest) - 1)
+        s = np.sin(2*np.pi*(phase*len(rest) - slot))
+        angles = rest.copy()
+        angles[slot] += s*(high[slot] - rest[slot]) if s > 0 else s*(rest[slot] - low[slot])
+        return angles
+    raise ValueError(f"unknown motion pattern {pattern}, use one of {MOTION_PATTERNS}")
+
+
+class MotionEngine:
+    """One long lived thread per controller that streams motion frames.
+
+    Commands go through a queue and are picked up between frames, so starting
+    another pattern, changing the frequency, retargeting or stopping never
+    restarts the thread. Frames go out on a DeadlineScheduler at a fixed rate
+    and the waveform follows a phase accumulator, a frequency change carries
+    on from the current point of the cycle instead of jumping. While idle the
+    thread blocks on the queue.
+    """
+
+    def __init__(self,controller:PinnaeController,rate:float = MOTION_RATE_HZ) -> None:
+        """
+        Args:
+            controller (PinnaeController): ear the frames are sent to
+            rate (float, optional): frames per second. Defaults to MOTION_RATE_HZ.
+        """
+        self.controller = controller
+        self.rate = rate
+        self.commands = queue.Queue()
+        self.scheduler = DeadlineScheduler(1/rate)
+        self.idle = threading.Event()
+        self.idle.set()
+        # idle is only changed with this held, so a start can not be lost between
+        # the worker finding the queue empty and setting idle
+        self._idle_lock = threading.Lock()
+        self.thread = None
+
+        self.pattern = None
+        self.frequency = 0.0
+        self.times = None
+        self.phase = 0.0
+        self.start_phase = 0.0
+        self.low = None
+        self.high = None
+        self.frames = 0
+
+    @property
+    def running(self)->bool:
+        return not self.idle.is_set()
+
+    def _check_frequency(self,frequency:float)->None:
+        if not 0 < frequency <= self.rate/2:
+            raise ValueError(f"frequency must be in (0, {self.rate/2}] Hz, got {frequency}")
+
+    def _submit(self,command:str,*args)->None:
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run,daemon=True,name="pinna-motion")
+            self.thread.start()
+        self.commands.put((command,args))
+
+    def start(self,pattern:str,frequency:float,times:float = None,phase:float = 0.0)->None:
+        """Runs a pattern, replacing whatever is running
+
+        Args:
+            pattern (str): one of MOTION_PATTERNS
+            frequency (float): cycles per second
+            times (float, optional): cycles to run, None runs until stop. Defaults to None.
+            phase (float, optional): point in the cycle to start from. Defaults to 0.0.
+        """
+        if pattern not in MOTION_PATTERNS:
+            raise ValueError(f"unknown motion pattern {pattern}, use one of {MOTION_PATTERNS}")
+        self._check_frequency(frequency)
+        if times is not None and times <= 0:
+            raise ValueError(f"times must be positive, got {times}")
+        with self._idle_lock:
+            self.idle.clear()
+            self._submit('start',pattern,float(frequency),times,phase)
+
+    def set_frequency(self,frequency:float)->None:
+        self._check_frequency(frequency)
+        self._submit('frequency',float(frequency))
+
+    def retarget(self,low:np.int16 = None,high:np.int16 = None)->None:
+        low = None if low is None else np.asarray(low,dtype=np.float64).copy()
+        high = None if high is None else np.asarray(high,dtype=np.float64).copy()
+        self._submit('retarget',low,high)
+
+    def stop(self)->None:
+        self._submit('stop')
+
+    def shutdown(self,timeout:float = 1.0)->None:
+        if self.thread is not None and self.thread.is_alive():
+            self.commands.put(('shutdown',()))
+            self.thread.join(timeout)
+        self.idle.set()
+
+    def wait_idle(self,timeout:float = None)->bool:
+        """Blocks until a pattern with times set has finished or the engine was stopped
+
+        Returns:
+            bool: false on timeout
+        """
+        return self.idle.wait(timeout)
+
+    def _apply(self,command:str,args:tuple)->bool:
+        if command == 'start':
+            if self.pattern is None:
+                self.scheduler.start()
+            self.pattern,self.frequency,self.times,self.phase = args
+            self.start_phase = self.phase
+        elif command == 'frequency':
+            self.frequency = args[0]
+        elif command == 'retarget':
+            self.low,self.high = args
+        elif command == 'stop':
+            self.pattern = None
+        elif command == 'shutdown':
+            self.pattern = None
+            return False
+        return True
+
+    def _limits(self)->tuple:
+        low = self.controller.min_angle_limits
+        high = self.controller.max_angle_limits
+        # a retarget is kept inside the limits, which can change while running
+        if self.low is not None:
+            low = np.clip(self.low,low,high)
+        if self.high is not None:
+            high = np.clip(self.high,low,high)
+        return low.astype(np.float64),high.astype(np.float64)
+
+    def _run(self)->None:
+        while True:
+            if self.pattern is None:
+                with self._idle_lock:
+                    if self.commands.empty():
+                        self.idle.set()
+                command,args = self.commands.get()
+                if not self._apply(command,args):
+                    break
+                continue
+
+            try:
+                while True:
+                    command,args = self.commands.get_nowait()
+                    if not self._apply(command,args):
+                        return
+            except queue.Empty:
+                pass
+            if self.pattern is None:
+                continue
+
+            self.scheduler.wait()
+            low,high = self._limits()
+            angles = motion_angles(self.pattern,self.phase,low,high)
+            self.controller._send_angles(slice(None),np.clip(np.rint(angles),low,high))
+            self.frames += 1
+
+            self.phase += self.frequency/self.rate
+            if self.times is not None and self.phase - self.start_phase >= self.times - 1e-9:
+                self.pattern = None
+
+    def stats(self)->dict:
+        """Frame timing of the engine, see DeadlineScheduler.stats
+
+        Returns:
+            dict: scheduler counters plus frames sent and cycles of the current pattern
+        """
+        stats = self.scheduler.stats()
+        stats['frames'] = self.frames
+        stats['cycles'] = self.phase - self.start_phase
+        return stats
+
+
+class PinnaPair:
+    """Both ears updated as one. The two angle vectors are checked against the
+    limits in one go and both frames are packed before either is sent, so the
+    only thing between the two chip selects is the left transfer itself. The
+    time from the left transfer starting to the right one starting is kept as
+    the inter ear skew.
+    """
+
+    def __init__(self,left:PinnaeController,right:PinnaeController,skew_history:int = 1000) -> None:
+        """
+        Args:
+            left (PinnaeController): left ear
+            right (PinnaeController): right ear
+            skew_history (int, optional): most recent skews kept for skew_stats. Defaults to 1000.
+        """
+        if left is right:
+            # both locks are taken for every update, the same controller twice would deadlock
+            raise ValueError("PinnaPair needs two different controllers")
+        self.left = left
+        self.right = right
+
+        # limits of both ears as (2, NUM_PINNAE_MOTORS), refreshed per update
+        # since either ear's limits can change from the GUI
+        self._min = np.empty((2,NUM_PINNAE_MOTORS),dtype=np.int16)
+        self._max = np.empty((2,NUM_PINNAE_MOTORS),dtype=np.int16)
+
+        self.skews = np.zeros(skew_history)
+        self.updates = 0
+        self.last_skew = 0.0
+
+    def _refresh_limits(self)->None:
+        self._min[0] = self.left.min_angle_limits
+        self._min[1] = self.right.min_angle_limits
+        self._max[0] = self.left.max_angle_limits
+        self._max[1] = self.right.max_angle_limits
+
+    def set_motor_angles(self,angles:np.int16)->bool:
+        """Checks and sends new angles to both ears
+
+        Args:
+            angles (np.int16): (2, NUM_PINNAE_MOTORS) angles, row 0 is the left ear
+
+        Returns:
+            bool: false if the shape is wrong or an angle is out of limits, then neither ear moves
+        """
+        angles = np.asarray(angles)
+        if angles.shape != (2,NUM_PINNAE_MOTORS):
+            return False
+
+        self._refresh_limits()
+        if (angles > self._max).any() or (angles < self._min).any():
+            logging.error("PinnaPair.set_motor_angles: angles out of bounds!")
+            return False
+
+        with self.left._lock, self.right._lock:
+            self._send(angles)
+        return True
+
+    def _send(self,angles:np.int16)->None:
+        self.left.current_angles[:] = angles[0]
+        self.right.current_angles[:] = angles[1]
+        left_frame = self.left.pack_frame(OP_SET_ANGLES)
+        right_frame = self.right.pack_frame(OP_SET_ANGLES)
+
+        if self.left.com_type == COM_TYPE.SPI and self.right.com_type == COM_TYPE.SPI and self.left.spi and self.right.spi:
+            # straight to xfer2, nothing else runs between the two chip selects
+            left_xfer = self.left.spi.xfer2
+            right_xfer = self.right.spi.xfer2
+            start = time.perf_counter()
+            left_xfer(left_frame)
+            right_start = time.perf_counter()
+            right_xfer(right_frame)
+        else:
+            start = time.perf_counter()
+            self.left._transfer(left_frame)
+            right_start = time.perf_counter()
+            self.right._transfer(right_frame)
+
+        self.last_skew = right_start - start
+        self.skews[self.updates % len(self.skews)] = self.last_skew
+        self.updates += 1
+
+    def skew_stats(self)->dict:
+        """Inter ear skew over the recent updates, in seconds
+
+        Returns:
+            dict: counters, all zero before the first update
         """
-        pass
+        skews = self.skews[:min(self.updates,len(self.skews))]
+        if len(skews) == 0:
+            return {'updates': 0,'skew_mean': 0.0,'skew_p99': 0.0,'skew_max': 0.0}
+        return {
+            'updates': self.updates,
+            'skew_mean': float(np.mean(skews)),
+            'skew_p99': float(np.percentile(skews,99)),
+            'skew_max': float(np.max(skews)),
+        }
 
 from PyQt6.QtWidgets import (
     QApplication,
@@ -32,65 +32,164 @@ RX_RECORDER_FLAG = (RX_FLAG << 8) | RECORDER_FLAG
 BUF_LEN = 256
 RAW_BUF_LEN = 515
 
+# ESC has to go first, otherwise the escapes added for START/END get escaped again
+ESCAPE_TABLE = [(bytes([b]), bytes([SER_ESC, b ^ SER_XOR])) for b in (SER_ESC, SER_FRAME_START, SER_FRAME_END)]
+
 def pad_msg(msg):
     space = RAW_BUF_LEN - len(msg)
     if space < 0:
         msg = msg[0:BUF_LEN]
     elif space > 0:
-        msg.extend(list(np.zeros(space, np.byte)))
+        msg.extend(bytes(space))
     return msg
+
+def escape_msg(msg):
+    out = bytes(msg)
+    for b, esc in ESCAPE_TABLE:
+        out = out.replace(b, esc)
+    return out
     
 def encode_msg(msg):
-    #msg = pad_msg(msg)
     
-    out = bytearray()
-    out.append(SER_FRAME_START)
+    body = escape_msg(msg)
+    frame_len = len(body) + 2
     
-    for n in range(0, len(msg)):
-        b = msg[n]
-        if b == SER_FRAME_START or b == SER_ESC or b==SER_FRAME_END:
-            out.append(SER_ESC)
-            out.append(b ^ SER_XOR)
-        else:
-            out.append(b)
+    # same as pad_msg, an oversize frame is cut down to BUF_LEN
+    if frame_len > RAW_BUF_LEN:
+        out = bytearray(BUF_LEN)
+        out[0] = SER_FRAME_START
+        out[1:] = body[:BUF_LEN - 1]
+        return out
     
-    out.append(SER_FRAME_END)
-    return pad_msg(out)
-
-def decode_msg(msg):
+    # zeroed at full size so there is nothing left to pad
+    out = bytearray(RAW_BUF_LEN)
+    out[0] = SER_FRAME_START
+    out[1:frame_len - 1] = body
+    out[frame_len - 1] = SER_FRAME_END
+    return out
 
-    ACCEPT = 0x01
-    ESCAPE = 0x02
+def unescape_msg(raw):
+    # jumps from escape to escape, the bytes in between are copied in one go
+    decoded = bytearray()
+    pos = 0
+    while True:
+        esc = raw.find(SER_ESC, pos)
+        if esc == -1:
+            decoded += raw[pos:]
+            return decoded
+        if esc + 1 == len(raw):
+            # the escaped byte is missing
+            return None
+        decoded += raw[pos:esc]
+        decoded.append(raw[esc + 1] ^ SER_XOR)
+        pos = esc + 2
 
-    state = ACCEPT
+def decode_msg(msg):
     
-    decoded = bytearray()
-    escape = False
     if msg[0] != SER_FRAME_START:
         return None
-    del msg[0]
-
-    frame_type = msg[0]
-    del msg[0]
-
-    for n in msg:
-        if state == ACCEPT:
-            if n == SER_FRAME_START:
-                return None
-            if n == SER_FRAME_END:
-                break
-            if n == SER_ESC:
-                state = ESCAPE
-            else:
-                decoded.append(n)
-            continue
+    
+    frame_type = msg[1]
+    
+    end = msg.find(SER_FRAME_END, 2)
+    body = msg[2:] if end == -1 else msg[2:end]
+    if SER_FRAME_START in body:
+        return None
+    
+    decoded = unescape_msg(body)
+    if decoded is None:
+        return None
+    
+    return frame_type, decoded
 
-        if state == ESCAPE:
-            decoded.append(n ^ SER_XOR)
-            state = ACCEPT
-            continue
+class FrameDecoder:
+    """Decodes frames out of a byte stream fed in arbitrary chunks.
     
-    return frame_type, decoded          
+    A frame split across reads is kept until its END arrives. A START inside a
+    frame, a frame longer than max_frame_len or a bad escape drops what was
+    collected and the decoder picks up at the next START. Padding between
+    frames is skipped.
+    """
+    
+    def __init__(self, max_frame_len=RAW_BUF_LEN):
+        self.max_frame_len = max_frame_len
+        self.buf = bytearray()
+        # where scanning continues, and where the open frame's body starts
+        self.pos = 0
+        self.frame_start = None
+        
+        self.frames = 0
+        self.errors = 0
+        self.dropped_bytes = 0
+        
+    def feed(self, chunk):
+        """Adds bytes and returns the list of (frame_type, payload) they complete.
+        The bytes are buffered right away, whether or not the caller looks at the result
+        """
+        self._compact()
+        self.buf += chunk
+        frames = []
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                return frames
+            frames.append(frame)
+            
+    def reset(self):
+        self.buf = bytearray()
+        self.pos = 0
+        self.frame_start = None
+            
+    def _compact(self):
+        # bytes before the open frame are done with, drop them once per feed
+        cut = self.pos if self.frame_start is None else self.frame_start
+        if cut:
+            del self.buf[:cut]
+            self.pos -= cut
+            if self.frame_start is not None:
+                self.frame_start -= cut
+                
+    def _drop_frame(self, resume):
+        self.errors += 1
+        self.dropped_bytes += resume - self.frame_start + 1
+        self.frame_start = None
+        self.pos = resume
+                
+    def _next_frame(self):
+        buf = self.buf
+        while True:
+            if self.frame_start is None:
+                start = buf.find(SER_FRAME_START, self.pos)
+                if start == -1:
+                    self.pos = len(buf)
+                    return None
+                self.frame_start = self.pos = start + 1
+                
+            end = buf.find(SER_FRAME_END, self.pos)
+            limit = len(buf) if end == -1 else end
+            
+            # everything before pos was already checked for a stray START
+            restart = buf.find(SER_FRAME_START, self.pos, limit)
+            if restart != -1:
+                self._drop_frame(restart)
+                continue
+            
+            if end == -1:
+                if len(buf) - self.frame_start + 1 > self.max_frame_len:
+                    self._drop_frame(len(buf))
+                    continue
+                self.pos = len(buf)
+                return None
+            
+            decoded = unescape_msg(buf[self.frame_start:end])
+            if not decoded:
+                self._drop_frame(end + 1)
+                continue
+            
+            self.frame_start = None
+            self.pos = end + 1
+            self.frames += 1
+            return decoded[0], decoded[1:]
         
 # order = 1 = sizof(uint8_t)
 # order = 2 = sizeof(uint16_t)
@@ -108,8 +207,8 @@ def chunk_split(data, size):
 def to_chunks(ftype, data, order=1, encode=True):
     chunks = []
     for chunk in chunk_split(data, BUF_LEN//order):
-        c = bytearray(chunk)
-        c.insert(0, ftype)
+        c = bytearray([ftype])
+        c += chunk.tobytes()
 
         if encode:
             c = encode_msg(c)
@@ -118,4 +217,47 @@ def to_chunks(ftype, data, order=1, encode=True):
     return chunks, determine_num_chunks(len(data), order=order)
 
 
+if __name__ == '__main__':
+    import time
+
+    def encode_msg_loop(msg):
+        # the per byte encoder this replaced
+        out = bytearray()
+        out.append(SER_FRAME_START)
+        for n in range(0, len(msg)):
+            b = msg[n]
+            if b == SER_FRAME_START or b == SER_ESC or b==SER_FRAME_END:
+                out.append(SER_ESC)
+                out.append(b ^ SER_XOR)
+            else:
+                out.append(b)
+        out.append(SER_FRAME_END)
+        space = RAW_BUF_LEN - len(out)
+        if space < 0:
+            out = out[0:BUF_LEN]
+        elif space > 0:
+            out.extend(list(np.zeros(space, np.byte)))
+        return out
+
+    # a full length chirp, 2**15 uint16 samples
+    chirp = np.random.default_rng(0).integers(0, 4096, 32768).astype(np.uint16)
+    frames = [bytearray([TX_DATA_FRAME]) + chunk.tobytes() for chunk in chunk_split(chirp, BUF_LEN//2)]
+
+    for name, fun, reps in (("loop", encode_msg_loop, 3), ("bulk", encode_msg, 100)):
+        start = time.perf_counter()
+        for i in range(reps):
+            encoded = [fun(frame) for frame in frames]
+        per_chirp = (time.perf_counter() - start)/reps
+        print(f"{name:>5}: {per_chirp*1e3:8.3f} ms per {len(chirp)} sample chirp ({len(frames)} frames)")
+
+    assert all(encode_msg(f) == encode_msg_loop(f) for f in frames)
 
+    # decoding the same chirp as one stream read in 4096 byte pieces
+    stream = b''.join(bytes(encode_msg(frame)) for frame in frames)
+    reps = 100
+    start = time.perf_counter()
+    for i in range(reps):
+        decoder = FrameDecoder()
+        decoded = [frame for pos in range(0, len(stream), 4096) for frame in decoder.feed(stream[pos:pos + 4096])]
+    print(f"decode: {(time.perf_counter() - start)/reps*1e3:8.3f} ms per chirp")
+    assert len(decoded) == len(frames) and all(bytes([t]) + p == f for (t, p), f in zip(decoded, frames))
@@ -36,10 +36,12 @@ RECORD_TIME = 25E-3
 TIME_PER_CHUNK = 64/ADC_SAMPLING_RATE
 N_RECV_CHUNKS = int(RECORD_TIME//TIME_PER_CHUNK + 1)
 
+# frames can straddle reads, the decoder keeps the partial one between calls
+decoder = FrameDecoder()
+
 def read_fun(reader, mask):
-    msg = reader.read(RAW_BUF_LEN)
-    frame_type, decoded = decode_msg(bytearray(msg))
-    return frame_type, decoded
+    msg = reader.read(reader.in_waiting or 1)
+    return decoder.feed(msg)
 
 START_RECORD = 0x33
 
@@ -81,12 +83,13 @@ if __name__ == '__main__':
             tmp_time = time.time()
             msg = r_stream.read(RAW_BUF_LEN)
             print(time.time() - tmp_time)
-            frame_type, decoded = decode_msg(bytearray(msg))
-            decode.extend(decoded)
-            #print(f"{nrecv}: {frame_type}: {array.array('H', decoded)}")
-            nrecv += 1
+            for frame_type, decoded in decoder.feed(msg):
+                decode.extend(decoded)
+                #print(f"{nrecv}: {frame_type}: {array.array('H', decoded)}")
+                nrecv += 1
     print(time.time() - start_time)
     print(len(decode))
+    print(f"frames: {decoder.frames} errors: {decoder.errors} dropped bytes: {decoder.dropped_bytes}")
         
         
     #print(len(data))
@@ -8,6 +8,8 @@ import numpy as np
 from scipy import signal
 
 import bb_listener
+import bb_spec
+from bb_stereo import split_bursts, load_raw
 
 def process2(raw, N_chirp, spec_settings, time_offs = 0):
 
@@ -24,39 +26,8 @@ def process2(raw, N_chirp, spec_settings, time_offs = 0):
     return spec_tup, pt_cut, remainder
 
 def plot_spec(ax, fig, spec_tup, fbounds = (20E3, 100E3), dB_range = 150, plot_title = 'spec'):
-    
-    fmin, fmax = fbounds
-    s, f, t = spec_tup
-    
-    lfc = (f >= fmin).argmax()
-    s = 20*np.log10(s)
-    f_cut = f[lfc:]
-    s_cut = s[:][lfc:]
-
-    
-    max_s = np.amax(s_cut)
-    s_cut = s_cut - max_s
-    
-    [rows_s, cols_s] = np.shape(s_cut)
-    
-    dB = -dB_range
-    #for vc in cols_s:
-    #    vc = [dB if n < dB else n for n in vc]
-    
-    for col in range(cols_s):
-        for row in range(rows_s):
-            if s_cut[row][col] < dB:
-                s_cut[row][col] = dB
-        
-    cf = ax.pcolormesh(t, f_cut, s_cut, cmap='jet', shading='auto')
-    cbar = fig.colorbar(cf, ax=ax)
-    
-    ax.set_ylim(fmin, fmax)
-    ax.set_ylabel('Frequency (Hz)')
-    ax.set_xlabel('Time (sec)')
-    ax.title.set_text(plot_title)
-
-    cbar.ax.set_ylabel('dB')
+    # keeps this script's wide view and colorbar, bb_spec.plot_spec defaults to the GUI's
+    bb_spec.plot_spec(ax, fig, spec_tup, fbounds=fbounds, dB_range=dB_range, plot_title=plot_title, plot_db=True)
 
 def autocorr(unraw, chirp, min_dist=None):
 
@@ -98,16 +69,7 @@ def plot_and_fft(new_data:np.uint16):
     plt.show()
     
 def read_bytes_to_uint16(file_name:str) ->np.uint16:
-    new_data = np.zeros(int(os.path.getsize(file_name)/2),dtype=np.uint16)
-    count = 0
-    with open(file_name,'rb') as f:
-        dat = f.read(2)
-        while dat:
-            # new_data.append(dat[0] | dat[1] << 8)
-            new_data[count] = dat[0] | dat[1] << 8
-            count +=1
-            dat = f.read(2)
-    return new_data
+    return load_raw(file_name)
 
 def plot_split_ears(raw_data:np.uint16, left_ear:np.uint16,right_ear:np.uint16):
     plt.figure()
@@ -145,60 +107,9 @@ def split_raw_to_LR(raw_data:np.uint16, channel_len:np.uint16, left_first = True
     Returns:
         tuple[np.uint16,np.uint16]: left channel, right channel
     """
-    on_left_ear = left_first
-    
-    # want to leave no room for zeros in array so precisely calc
-    #   the size depending on who starts first
-    rem = len(raw_data)/2 % channel_len
-    mult = np.floor(len(raw_data)/2*1/channel_len)
-    
-    if np.floor(len(raw_data)/channel_len %2) == 1.0:
-        print("odd")
-        is_odd = True
-    else:
-        is_odd = False
-    
-    if on_left_ear:
-        if not is_odd:
-            l_len = int(int(len(raw_data)/2) - rem)
-            r_len = len(raw_data)-l_len
-        else:
-            r_len = int(channel_len*(mult+1))
-            l_len = len(raw_data)-r_len
-        
-    else:
-        if not is_odd:
-            r_len = int(int(len(raw_data)/2) - rem)
-            l_len = len(raw_data)-r_len
-        else:
-            l_len = int(channel_len*(mult+1))
-            r_len = len(raw_data)-l_len
-    
-    # L R L R L R L R L R L R L R L R L  17
-    
-    print(f"Left: {l_len} right {r_len} mult {mult} rem {rem}")
-    
-    # allocate np buffers
-    left_channel =  np.zeros(l_len,dtype=np.uint16)
-    right_channel = np.zeros(r_len,dtype=np.uint16)
-    
-    l_index = 0
-    r_index = 0
-
-    
-    for i,data in enumerate(raw_data):
-        if i % channel_len == 0:
-            on_left_ear = not on_left_ear
-
-        if on_left_ear:
-            left_channel[l_index] = data
-            l_index += 1
-        else:
-            right_channel[r_index] = data
-            r_index +=1
-            
-    print(f"Left: {l_index} right {r_index}")
-    return left_channel,right_channel
+    # the loop this replaced flipped ears before the first sample, so the first
+    #   burst has always gone to the other channel, kept so old captures split the same
+    return split_bursts(raw_data,channel_len,not left_first)
     
 # teensy = Serial("/dev/tty.usbmodem136132801", baudrate=480e6,timeout=1)
 # teensy = Serial("COM8", baudrate=480e6,timeout=1)
@@ -11,7 +11,16 @@ import numpy as np
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 # sys.path.insert("../")
-from pinnae import PinnaeController, NUM_PINNAE_MOTORS
+from pinnae import PinnaeController, PinnaPair, NUM_PINNAE_MOTORS, motion_angles
+
+
+class RecordingSpi:
+    """Keeps a copy of every frame sent"""
+    def __init__(self):
+        self.frames = []
+
+    def xfer2(self,data):
+        self.frames.append(bytes(data))
 
 
 
@@ -240,6 +249,96 @@ class TestClass(unittest.TestCase):
             self.assertTrue(pinnae.set_motor_angle(i,-10))
             self.assertTrue(pinnae.set_motor_to_zero(i))
 
+    def test_spi_frames(self):
+        spi = RecordingSpi()
+        pinnae = PinnaeController(spi)
+        pinnae.current_angles[:] = [1,-2,180,-180,0,127,-129]
+
+        # bytes as they were packed one motor at a time
+        expected = bytearray(15)
+        for i,angle in enumerate(pinnae.current_angles):
+            expected[1 + 2*i] = (angle >> 8) & 0xff
+            expected[2 + 2*i] = angle & 0xff
+
+        pinnae.send_MCU_angles()
+        pinnae.reset_zero_position(3)
+        pinnae.move_to_min(2,move_cw=True)
+        pinnae.move_to_min(5,move_cw=False)
+        for frame,header in zip(spi.frames,(0x00,0x83,0x62,0x45)):
+            expected[0] = header
+            self.assertEqual(frame,bytes(expected))
+
+    def test_pinna_pair(self):
+        left_spi,right_spi = RecordingSpi(),RecordingSpi()
+        left,right = PinnaeController(left_spi),PinnaeController(right_spi)
+        pair = PinnaPair(left,right)
+
+        angles = np.array([[10,20,30,40,50,60,70],[-10,-20,-30,-40,-50,-60,-70]],dtype=np.int16)
+        self.assertTrue(pair.set_motor_angles(angles))
+        self.assertTrue(np.array_equal(left.current_angles,angles[0]))
+        self.assertTrue(np.array_equal(right.current_angles,angles[1]))
+        self.assertEqual(left_spi.frames[-1],b'\x00' + angles[0].astype('>i2').tobytes())
+        self.assertEqual(right_spi.frames[-1],b'\x00' + angles[1].astype('>i2').tobytes())
+
+        # one ear out of limits and neither moves
+        right.set_motor_max_limit(2,0)
+        self.assertFalse(pair.set_motor_angles(angles*0 + 5))
+        self.assertFalse(pair.set_motor_angles(angles[0]))
+        self.assertEqual(len(left_spi.frames),1)
+        self.assertTrue(np.array_equal(left.current_angles,angles[0]))
+
+        stats = pair.skew_stats()
+        self.assertEqual(stats['updates'],1)
+        self.assertGreater(stats['skew_max'],0)
+        # both locks are held for an update, one controller twice would deadlock
+        with self.assertRaises(ValueError):
+            PinnaPair(left,left)
+
+    def test_motion_patterns(self):
+        low = np.full(NUM_PINNAE_MOTORS,-40.0)
+        high = np.full(NUM_PINNAE_MOTORS,60.0)
+        self.assertTrue(np.allclose(motion_angles('actuate',0,low,high),low))
+        self.assertTrue(np.allclose(motion_angles('actuate',1.5,low,high),high))
+        self.assertTrue(np.array_equal(motion_angles('flap',0.25,low,high),high))
+        self.assertTrue(np.array_equal(motion_angles('flap',0.75,low,high),low))
+        # a quarter into motor 2's slot it is at its max, the rest wait at 0
+        sweep = motion_angles('sweep',(2 + 0.25)/NUM_PINNAE_MOTORS,low,high)
+        self.assertAlmostEqual(sweep[2],60)
+        self.assertEqual(np.count_nonzero(sweep),1)
+
+    def test_motion_engine(self):
+        spi = RecordingSpi()
+        pinnae = PinnaeController(spi)
+        pinnae.set_motor_limit(0,-30,20)
+
+        # 20 Hz at 200 frames per second, 10 frames per flap
+        pinnae.flap_pinnae(20,times=2)
+        engine = pinnae.motion
+        self.assertTrue(engine.wait_idle(2))
+        self.assertEqual(len(spi.frames),20)
+        angles = [np.frombuffer(f,dtype='>i2',offset=1)[0] for f in spi.frames]
+        self.assertEqual(angles[:10],[20]*5 + [-30]*5)
+        thread = engine.thread
+
+        # retarget and a new frequency on the same thread
+        pinnae.retarget_motion(np.full(NUM_PINNAE_MOTORS,-10),np.full(NUM_PINNAE_MOTORS,10))
+        pinnae.actuate_motors(50)
+        pinnae.set_motion_frequency(25)
+        while len(spi.frames) < 40:
+            engine.idle.wait(0.01)
+        pinnae.stop_motion()
+        self.assertTrue(engine.wait_idle(2))
+        self.assertIs(engine.thread,thread)
+        angles = np.array([np.frombuffer(f,dtype='>i2',offset=1) for f in spi.frames[20:]])
+        self.assertGreaterEqual(angles.min(),-10)
+        self.assertLessEqual(angles.max(),10)
+        self.assertEqual(engine.stats()['frames'],len(spi.frames))
+
+        with self.assertRaises(ValueError):
+            pinnae.flap_pinnae(150)
+        pinnae.close_motion()
+        self.assertFalse(thread.is_alive())
+
             
             
             
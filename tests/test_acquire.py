@@ -0,0 +1,73 @@
+"""
+Purpose: runs AcquisitionPipeline against bb_sim.SimTeensy
+    """
+
+import unittest
+
+import sys,os
+import time
+import numpy as np
+from serial import Serial
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import bb_sim
+from bb_listener import EchoRecorder
+from bb_acquire import AcquisitionPipeline
+
+
+def wait_done(pipeline:AcquisitionPipeline,timeout:float)->bool:
+    end = time.perf_counter() + timeout
+    while pipeline.is_running() and time.perf_counter() < end:
+        time.sleep(0.01)
+    return not pipeline.is_running()
+
+
+class TestClass(unittest.TestCase):
+
+    def test_run(self):
+        frames = []
+        with bb_sim.SimTeensy() as teensy:
+            recorder = EchoRecorder(Serial(teensy.port))
+            pipeline = AcquisitionPipeline(recorder,5,6,write_fun=lambda frame: frames.append(frame.index))
+            pipeline.start()
+            self.assertTrue(wait_done(pipeline,10))
+            recorder.disconnect_serial()
+        stats = pipeline.stats()
+        self.assertIsNone(stats['error'])
+        self.assertEqual(stats['written'],6)
+        self.assertEqual(frames,list(range(6)))
+
+    def test_plot_frames_are_copies(self):
+        with bb_sim.SimTeensy() as teensy:
+            recorder = EchoRecorder(Serial(teensy.port),ring_slots=2)
+            pipeline = AcquisitionPipeline(recorder,5,4,write_fun=lambda frame: None,plot_every=1)
+            pipeline.start()
+            self.assertTrue(wait_done(pipeline,10))
+            recorder.disconnect_serial()
+        frame = pipeline.get_plot_frame(timeout=0.1)
+        self.assertIsNotNone(frame)
+        self.assertFalse(np.shares_memory(frame.capture.data,recorder.ring.buffer))
+        # the ring was sized for the run, the recorder keeps its own setting
+        self.assertEqual(recorder.ring.slots,pipeline.ring_slots)
+        self.assertEqual(recorder.ring_slots,2)
+
+    def test_write_error_stops(self):
+        def write_fun(frame):
+            if frame.index == 2:
+                raise OSError("No space left on device")
+            # slow enough for the reader to fill the queue
+            time.sleep(0.02)
+
+        with bb_sim.SimTeensy() as teensy:
+            recorder = EchoRecorder(Serial(teensy.port))
+            pipeline = AcquisitionPipeline(recorder,2,None,write_fun=write_fun,queue_len=2,put_poll_s=0.01)
+            pipeline.start()
+            self.assertTrue(wait_done(pipeline,5))
+            recorder.disconnect_serial()
+        stats = pipeline.stats()
+        self.assertIn("No space left",stats['error'])
+        self.assertEqual(stats['written'],2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Purpose: tests building and mapping a chirp library with bb_chirplib
+    """
+
+import unittest
+
+import sys,os
+import tempfile
+import zlib
+import yaml
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from bb_chirplib import build_library, ChirpLibrary, default_nfft, open_library
+from bb_emitter import cached_chirp, cached_sine, cached_file
+from bb_echo import EchoRanger
+
+
+class TestClass(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.specs = [
+            {'name':'lfm','f0':100e3,'f1':30e3,'t_end':2,'method':'linear'},
+            {'name':'quiet_sine','sine':50e3,'t_end':1,'gain':128},
+            {'name':'file','file':os.path.join(os.path.dirname(__file__),'default_chirp.npy')},
+        ]
+        self.file_path = build_library(os.path.join(self.tmp.name,"chirps.bbchirp"),self.specs)
+        self.lib = ChirpLibrary(self.file_path)
+
+    def tearDown(self):
+        self.lib.close()
+        self.tmp.cleanup()
+
+    def test_samples_match_emitter(self):
+        self.assertEqual(self.lib.names,['lfm','quiet_sine','file'])
+        expected = [cached_chirp(100e3,30e3,2,'linear',512.0,2048.0)[0],
+                    cached_sine(1,50e3,128.0,2048.0)[0],
+                    cached_file(self.specs[2]['file'],512.0,2048.0)]
+        for name,samples in zip(self.lib.names,expected):
+            chirp = self.lib[name]
+            self.assertTrue(np.array_equal(chirp.samples,samples))
+            self.assertEqual(chirp.crc,zlib.crc32(samples.astype('<u2').tobytes()))
+            self.assertTrue(np.allclose(chirp.template,samples - np.mean(samples)))
+            self.assertEqual(chirp.nfft,default_nfft(len(samples)))
+        self.assertEqual(self.lib['quiet_sine'].gain,128)
+        with self.assertRaises(KeyError):
+            self.lib['missing']
+
+    def test_ranger_uses_stored_spectrum(self):
+        chirp = self.lib['lfm']
+        rng = np.random.default_rng(6)
+        data = rng.normal(size=(2,10000))
+        stored = chirp.ranger().correlate(data)
+        fresh = EchoRanger(np.array(chirp.samples)).correlate(data)
+        self.assertTrue(np.allclose(stored,fresh))
+
+    def test_rebuild_keeps_mapped_library(self):
+        before = np.array(self.lib['lfm'].samples)
+        mapped = self.lib['lfm'].samples
+        build_library(self.file_path,[{'name':'lfm','f0':90e3,'f1':40e3,'t_end':2}])
+        # the open library still sees the old file, a reopen sees the new one
+        self.assertTrue(np.array_equal(mapped,before))
+        with ChirpLibrary(self.file_path) as lib:
+            self.assertEqual(lib.names,['lfm'])
+            self.assertFalse(np.array_equal(lib['lfm'].samples,before))
+
+        with self.assertRaises(KeyError):
+            build_library(self.file_path,[{'name':'broken','f0':90e3}])
+        with ChirpLibrary(self.file_path) as lib:
+            self.assertEqual(lib.names,['lfm'])
+        self.assertEqual(os.listdir(self.tmp.name),["chirps.bbchirp"])
+
+    def test_open_library_rebuilds(self):
+        npy_path = os.path.join(self.tmp.name,"wave.npy")
+        spec_path = os.path.join(self.tmp.name,"spec.yaml")
+        np.save(npy_path,np.linspace(-1,1,100))
+        with open(spec_path,'w') as f:
+            yaml.dump({'chirps': [{'name':'wave','file':'wave.npy'}]},f)
+
+        def created(**kwargs):
+            with open_library(spec_path,**kwargs) as lib:
+                return float(lib.header['created']),np.array(lib['wave'].samples)
+
+        first,samples = created()
+        self.assertEqual(created()[0],first)
+
+        # a new .npy with the spec left alone
+        np.save(npy_path,np.linspace(1,-1,100))
+        st = os.stat(npy_path)
+        os.utime(npy_path,ns=(st.st_atime_ns,st.st_mtime_ns + 10**9))
+        second,flipped = created()
+        self.assertNotEqual(second,first)
+        self.assertTrue(np.array_equal(flipped,samples[::-1]))
+
+        third,quiet = created(gain=128)
+        self.assertNotEqual(third,second)
+        self.assertLess(np.ptp(quiet),np.ptp(flipped))
+
+
+if __name__ == '__main__':
+    unittest.main()
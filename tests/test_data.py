@@ -0,0 +1,60 @@
+"""
+Purpose: tests the batched writer thread in bb_data
+    """
+
+import unittest
+
+import sys,os
+import queue
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from bb_data import DataThread, write_npy
+
+
+class TestClass(unittest.TestCase):
+
+    def run_writer(self,items:int,**kwargs)->tuple:
+        tmp = tempfile.TemporaryDirectory()
+        q = queue.Queue()
+        for i in range(items):
+            q.put((np.full(10,i,dtype=np.uint16),i,tmp.name,write_npy))
+        writer = DataThread(q,lambda: True,poll_timeout=0.01,**kwargs)
+        pending = []
+        sync = writer.sync
+        def watched_sync():
+            pending.append(len(writer.unsynced))
+            sync()
+        writer.sync = watched_sync
+        writer.start()
+        writer.join(10)
+        return tmp,writer,pending
+
+    def test_writes_everything(self):
+        tmp,writer,pending = self.run_writer(50)
+        with tmp:
+            stats = writer.stats()
+            self.assertEqual(stats['items_written'],50)
+            self.assertEqual(stats['unsynced'],0)
+            self.assertEqual(len(os.listdir(tmp.name)),50)
+            # default policy, everything is synced once on close
+            self.assertEqual(pending,[50])
+            self.assertEqual(np.load(os.path.join(tmp.name,sorted(os.listdir(tmp.name))[0])).shape,(10,))
+
+    def test_unsynced_is_capped(self):
+        tmp,writer,pending = self.run_writer(100,max_unsynced=16,batch_max=32)
+        with tmp:
+            self.assertEqual(writer.stats()['items_written'],100)
+            self.assertLessEqual(max(pending),16)
+            self.assertEqual(sum(pending),100)
+            self.assertEqual(writer.syncs,len(pending))
+
+    def test_fsync_every(self):
+        tmp,writer,pending = self.run_writer(20,fsync_every=5,fsync_on_close=False,batch_max=5)
+        with tmp:
+            self.assertEqual(pending,[5]*4)
+
+
+if __name__ == '__main__':
+    unittest.main()
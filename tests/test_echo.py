@@ -0,0 +1,64 @@
+"""
+Purpose: tests the overlap-save matched filter in bb_echo
+    """
+
+import unittest
+
+import sys,os
+import numpy as np
+from scipy import signal
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from bb_echo import EchoRanger, SPEED_OF_SOUND
+from bb_stereo import StereoCapture
+
+
+class TestClass(unittest.TestCase):
+
+    def setUp(self):
+        t = np.arange(0,2e-3,1e-6)
+        self.chirp = (signal.chirp(t,100e3,2e-3,30e3)*512 + 2048).astype(np.uint16)
+        self.template = self.chirp - np.mean(self.chirp)
+
+    def test_matches_correlate(self):
+        rng = np.random.default_rng(4)
+        data = rng.normal(size=(2,20000))
+        # small nfft so the capture spans many blocks
+        ranger = EchoRanger(self.chirp,nfft=4096)
+        analytic = ranger.analytic_correlation(data)
+        env = ranger.correlate(data)
+        for row in range(2):
+            balanced = data[row] - np.mean(data[row])
+            ref = signal.correlate(balanced,self.template,mode='valid')/np.sum(self.template**2)
+            self.assertEqual(env[row].shape,ref.shape)
+            # overlap-save gives the same correlation, peaks here are ~2.5e-4
+            np.testing.assert_allclose(analytic[row].real,ref,rtol=0,atol=1e-17)
+            np.testing.assert_allclose(env[row],np.abs(analytic[row]))
+
+            # each block's Hilbert transform only approximates the one over the whole
+            # correlation, and hilbert() has its own edge effects at both ends, so compare
+            # away from the ends within 5% of the peak and check the typical error is tiny
+            hilbert_env = np.abs(signal.hilbert(ref))
+            err = np.abs(env[row] - hilbert_env)
+            peak = np.max(hilbert_env)
+            self.assertLess(np.max(err[256:-256]),0.05*peak)
+            self.assertLess(np.median(err),1e-3*peak)
+
+    def test_finds_echoes(self):
+        rng = np.random.default_rng(5)
+        data = rng.normal(scale=5,size=(2,25000)) + 2048
+        delays = [(6000,0.5),(9000,0.25)]
+        for row,(delay,amp) in enumerate(delays):
+            data[row,delay:delay + len(self.template)] += amp*self.template
+
+        ranger = EchoRanger(self.chirp,min_delay=3000)
+        echoes = ranger.range(StereoCapture(data))
+        for ear_echoes,(delay,amp) in zip(echoes,delays):
+            self.assertEqual(len(ear_echoes),1)
+            self.assertAlmostEqual(ear_echoes.delays[0],delay*1e-6,places=5)
+            self.assertAlmostEqual(ear_echoes.nearest(),delay*1e-6*SPEED_OF_SOUND/2,places=2)
+            self.assertAlmostEqual(ear_echoes.amplitudes[0],amp,delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+Purpose: tests the chirp cache in bb_emitter
+    """
+
+import unittest
+
+import sys,os
+import zlib
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import bb_emitter
+from bb_emitter import EchoEmitter
+from serial import Serial
+
+
+class TestClass(unittest.TestCase):
+
+    def setUp(self):
+        bb_emitter.clear_chirp_cache()
+        # a closed port with no name, nothing is ever written to it
+        self.emitter = EchoEmitter(Serial())
+
+    def test_chirp_memoized(self):
+        s1,t1 = self.emitter.gen_chirp(90e3,40e3,5)
+        s2,t2 = self.emitter.gen_chirp(90e3,40e3,5)
+        self.assertIs(s1,s2)
+        self.assertFalse(s1.flags.writeable)
+        self.assertEqual(len(s1),5000)
+
+        s3,t3 = self.emitter.gen_chirp(90e3,40e3,5,gain=256)
+        self.assertIsNot(s1,s3)
+        self.assertEqual(np.max(s3) - np.min(s3),256)
+
+    def test_default_gain_is_part_of_key(self):
+        s1,t1 = self.emitter.gen_sine(2,50e3)
+        self.emitter.SIG_GAIN = 100
+        s2,t2 = self.emitter.gen_sine(2,50e3)
+        self.assertIsNot(s1,s2)
+        self.assertEqual(np.max(s2) - np.min(s2),100)
+
+    def test_lost_connection_forgets_upload(self):
+        s,t = self.emitter.gen_chirp(90e3,40e3,5)
+        self.emitter.chirp_uploaded = True
+        self.emitter.uploaded_crc = zlib.crc32(s.astype('<u2').tobytes())
+        self.emitter.EMIT_TIME = len(s)
+        # the port is not even open, the cached CRC must not count as uploaded
+        self.assertFalse(self.emitter.upload_chirp(s))
+        self.assertFalse(self.emitter.chirp_uploaded)
+        self.assertIsNone(self.emitter.uploaded_crc)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Purpose: tests the running mean/variance and alignment in bb_integrate
+    """
+
+import unittest
+
+import sys,os
+import numpy as np
+from scipy import signal
+from serial import Serial
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import bb_sim
+from bb_integrate import CoherentIntegrator, integrate_pings
+from bb_listener import EchoRecorder
+from bb_stereo import StereoCapture
+
+
+class ShortTeensy(bb_sim.SimTeensy):
+    """Stops streaming after one burst on the listens in short_listens"""
+    def __init__(self,short_listens):
+        super().__init__()
+        self.short_listens = short_listens
+
+    def step(self):
+        super().step()
+        if self.streaming and self.listens in self.short_listens and self.streamed >= self.burst_bytes:
+            self.streaming = False
+
+
+class TestClass(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.pings = rng.integers(1500,2500,(20,2,4000)).astype(np.uint16)
+
+    def test_welford_matches_numpy(self):
+        integrator = CoherentIntegrator(4000)
+        for ping in self.pings:
+            self.assertTrue(integrator.add(StereoCapture(ping)))
+        self.assertEqual(integrator.count,20)
+        self.assertTrue(np.allclose(integrator.mean(),self.pings.mean(axis=0),atol=1e-2))
+        self.assertTrue(np.allclose(integrator.variance(),self.pings.var(axis=0,ddof=1),rtol=1e-3,atol=1e-1))
+
+    def test_sum_mode_and_skips(self):
+        integrator = CoherentIntegrator(4000,welford=False)
+        for ping in self.pings:
+            integrator.add(ping)
+        self.assertFalse(integrator.add(self.pings[0][:,:3999]))
+        self.assertEqual(integrator.skipped,1)
+        self.assertIsNone(integrator.variance())
+        self.assertTrue(np.allclose(integrator.mean(),self.pings.mean(axis=0),atol=1e-2))
+
+    def test_alignment(self):
+        t = np.arange(0,500e-6,1e-6)
+        chirp = (signal.chirp(t,100e3,500e-6,30e3)*512 + 2048).astype(np.uint16)
+        clean = np.full((2,4000),2048.0)
+        clean[:,1000:1000 + len(chirp)] += chirp - np.mean(chirp)
+        rng = np.random.default_rng(8)
+
+        integrator = CoherentIntegrator(4000,chirp,max_shift=40,search_len=2000)
+        jitters = [0,12,-7,30,-25]
+        for jitter in jitters:
+            integrator.add(np.roll(clean,jitter,axis=1) + rng.normal(scale=2,size=clean.shape))
+        self.assertEqual(integrator.shifts,jitters)
+        self.assertEqual(integrator.shift_stats()['max'],30)
+        # away from the filled ends the pings line up again, what is left is the
+        # noise of a 5 ping mean, sigma 2/sqrt(5), allow 5 sigma over the 7600 samples
+        self.assertTrue(np.allclose(integrator.mean()[:,100:3900],clean[:,100:3900],atol=5*2/np.sqrt(5)))
+
+    def test_shift_history(self):
+        integrator = CoherentIntegrator(4000,shift_history=3)
+        for ping in self.pings[:5]:
+            integrator.add(ping)
+        self.assertEqual(integrator.shifts,[0,0,0])
+        self.assertEqual(integrator.shift_stats()['count'],5)
+
+    def test_short_first_ping(self):
+        # 2 ms is 4 bursts, the first listen only gets one of them
+        with ShortTeensy({1}) as teensy:
+            recorder = EchoRecorder(Serial(teensy.port))
+            integrator = integrate_pings(recorder,2,pings=3)
+            recorder.disconnect_serial()
+        self.assertEqual(integrator.n_samples,2000)
+        self.assertEqual(integrator.count,3)
+        self.assertEqual(integrator.skipped,1)
+
+    def test_stops_after_skips(self):
+        with ShortTeensy(range(100)) as teensy:
+            recorder = EchoRecorder(Serial(teensy.port))
+            integrator = integrate_pings(recorder,2,pings=3,max_skips=2)
+            recorder.disconnect_serial()
+        self.assertEqual(integrator.count,0)
+        self.assertEqual(integrator.skipped,2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Purpose: tests ListenSession and the capture ring against bb_sim.SimTeensy
+    """
+
+import unittest
+
+import sys,os
+import contextlib,io
+import time
+import numpy as np
+from serial import Serial
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import bb_sim
+from bb_listener import EchoRecorder, LISTENER_SERIAL_CMD
+
+
+class DeafTeensy(bb_sim.SimTeensy):
+    """Never hears STOP_LISTEN, like when the command gets lost"""
+    def _handle(self,cmd:int)->None:
+        if cmd != LISTENER_SERIAL_CMD.STOP_LISTEN.value:
+            super()._handle(cmd)
+
+
+class TestClass(unittest.TestCase):
+
+    def test_session_listens(self):
+        with bb_sim.SimTeensy() as teensy:
+            recorder = EchoRecorder(Serial(teensy.port))
+            with recorder.session() as session:
+                self.assertTrue(session.connected)
+                for i in range(5):
+                    raw,left,right = session.listen(5)
+                    self.assertEqual(len(raw),10000)
+                    self.assertEqual(len(left),5000)
+                self.assertEqual(session.cycles,5)
+                self.assertGreater(session.cycles_per_second(),0)
+            self.assertFalse(session.connected)
+            recorder.disconnect_serial()
+            # one handshake for the whole session
+            self.assertEqual(teensy.listens,5)
+
+    def test_ring_reads(self):
+        with bb_sim.SimTeensy() as teensy:
+            recorder = EchoRecorder(Serial(teensy.port),ring_slots=2)
+            with recorder.session() as session:
+                raws = [session.listen(5)[0] for i in range(3)]
+            # read straight into the slots, the third listen reuses the first slot
+            self.assertTrue(np.shares_memory(raws[0],recorder.ring.buffer))
+            self.assertTrue(np.shares_memory(raws[0],raws[2]))
+            self.assertFalse(np.shares_memory(raws[0],raws[1]))
+            self.assertEqual(raws[1].tobytes(),teensy.pattern[:len(raws[1])*2])
+
+            owned,left,_ = recorder.listen(5)
+            self.assertFalse(np.shares_memory(owned,recorder.ring.buffer))
+            self.assertEqual(owned.tobytes(),teensy.pattern[:len(owned)*2])
+            self.assertEqual(len(left),5000)
+            recorder.disconnect_serial()
+
+    def test_lost_stop_drain_is_bounded(self):
+        with DeafTeensy() as teensy:
+            recorder = EchoRecorder(Serial(teensy.port))
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                with recorder.session(max_drain_s=0.2) as session:
+                    raw,_,_ = session.listen(2)
+            self.assertEqual(len(raw),4000)
+            # a listen and the drain on close, each cut off at max_drain_s
+            self.assertLess(time.perf_counter() - start,2.0)
+            self.assertIn("STILL STREAMING",out.getvalue())
+            recorder.disconnect_serial()
+
+
+if __name__ == '__main__':
+    unittest.main()
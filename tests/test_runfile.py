@@ -0,0 +1,73 @@
+"""
+Purpose: tests writing, mapping and converting bb_runfile run files
+    """
+
+import unittest
+
+import sys,os
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from bb_runfile import RunWriter, RunReader, convert_npy_run
+from bb_stereo import StereoCapture
+
+
+class TestClass(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.rng = np.random.default_rng(6)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip_across_chunks(self):
+        path = os.path.join(self.tmp.name,"run.bbrun")
+        pings = []
+        with RunWriter(path,chunk_pings=4,flush_every=3) as writer:
+            for i in range(11):
+                # odd lengths check the alignment padding
+                raw = self.rng.integers(0,4096,2*(100 + i)).astype(np.uint16)
+                capture = StereoCapture.from_interleaved(raw,left_first=i % 2 == 0)
+                self.assertEqual(writer.append_capture(capture,1000.0 + i),i)
+                pings.append(capture.data.copy())
+
+        reader = RunReader(path)
+        self.assertEqual(len(reader),11)
+        self.assertEqual(reader.channels,2)
+        self.assertEqual(reader.sample_freq,1e6)
+        self.assertTrue(np.array_equal(reader.timestamps,1000.0 + np.arange(11)))
+        for i,data in enumerate(pings):
+            self.assertTrue(np.array_equal(reader[i],data))
+        self.assertTrue(np.array_equal(reader.capture(3).left,pings[3][0]))
+        reader.close()
+
+    def test_flushed_pings_readable_before_close(self):
+        path = os.path.join(self.tmp.name,"run.bbrun")
+        writer = RunWriter(path,chunk_pings=8,flush_every=2)
+        for i in range(5):
+            writer.append(np.full((2,50),i,dtype=np.uint16))
+
+        reader = RunReader(path)
+        self.assertEqual(len(reader),4)
+        self.assertTrue(np.all(reader[3] == 3))
+        reader.close()
+        writer.close()
+        self.assertEqual(len(RunReader(path)),5)
+
+    def test_convert_npy_run(self):
+        run_dir = self.tmp.name
+        data = self.rng.integers(0,4096,(12,2,300)).astype(np.uint16)
+        for i,ping in enumerate(data):
+            StereoCapture(ping).save(run_dir,suffix=f"_{i}")
+
+        reader = RunReader(convert_npy_run(run_dir,chunk_pings=5))
+        self.assertEqual(len(reader),12)
+        # numeric order, not the file name order
+        self.assertTrue(np.array_equal(reader.stack(),data))
+        reader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""
+Purpose: tests the step rate, skipping and re-anchoring of DeadlineScheduler
+    """
+
+import unittest
+
+import sys,os
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from bb_sched import DeadlineScheduler, JITTER_BINS
+
+
+class TestClass(unittest.TestCase):
+
+    def test_rate_with_slow_steps(self):
+        # each step takes 60% of the period, a sleep loop would run at 1/1.6 the rate
+        sched = DeadlineScheduler(5e-3)
+        sched.start()
+        start = time.perf_counter()
+        for i in range(60):
+            sched.wait()
+            time.sleep(3e-3)
+        self.assertEqual(sched.steps,60)
+        # 59 periods from the first step to the last, plus the last step's work
+        self.assertLess(time.perf_counter() - start,59*5e-3 + 3e-3 + 0.1)
+        self.assertEqual(sum(sched.histogram),60)
+        self.assertEqual(len(sched.histogram),len(JITTER_BINS) + 1)
+
+    def test_overrun_is_skipped(self):
+        sched = DeadlineScheduler(2e-3)
+        sched.start()
+        sched.wait()
+        time.sleep(7e-3)
+        late = sched.wait()
+        self.assertGreater(late,2e-3)
+        self.assertGreaterEqual(sched.missed,1)
+        self.assertGreaterEqual(sched.skipped,2)
+        # the step after keeps the phase of the original grid, a whole number of
+        # periods from start give or take rounding either side of it
+        periods = (sched.next_deadline - sched.start_time)/2e-3
+        self.assertAlmostEqual(periods,round(periods),places=6)
+
+    def test_set_period(self):
+        sched = DeadlineScheduler(1e-3)
+        sched.start(now=100.0)
+        sched._k = 5
+        sched.set_period(4e-3)
+        self.assertAlmostEqual(sched.next_deadline,100.0 + 4e-3 + 4e-3)
+        with self.assertRaises(ValueError):
+            sched.set_period(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+Purpose: tests the SLIP style framing in ser_utils
+    """
+
+import unittest
+
+import sys,os
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from ser_utils import *
+
+
+def encode_msg_loop(msg):
+    """the per byte encoder encode_msg replaced"""
+    out = bytearray()
+    out.append(SER_FRAME_START)
+    for b in msg:
+        if b == SER_FRAME_START or b == SER_ESC or b == SER_FRAME_END:
+            out.append(SER_ESC)
+            out.append(b ^ SER_XOR)
+        else:
+            out.append(b)
+    out.append(SER_FRAME_END)
+    return pad_msg(out)
+
+
+class TestClass(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(7)
+
+    def test_encode_matches_loop(self):
+        specials = bytes([SER_FRAME_START,SER_FRAME_END,SER_ESC,SER_XOR])
+        msgs = [bytearray(), bytearray(specials*3), bytearray([SER_ESC,SER_ESC ^ SER_XOR])]
+        for n in [1,100,255,257,400,600]:
+            msgs.append(bytearray(self.rng.integers(0x70,0x80,n).astype(np.uint8).tobytes()))
+        for msg in msgs:
+            encoded = encode_msg(msg)
+            self.assertEqual(encoded,encode_msg_loop(msg))
+            self.assertIsInstance(encoded,bytearray)
+
+    def test_round_trip(self):
+        for n in [1,50,255]:
+            payload = self.rng.integers(0,256,n).astype(np.uint8).tobytes()
+            frame_type,decoded = decode_msg(encode_msg(bytearray([TX_DATA_FRAME]) + payload))
+            self.assertEqual(frame_type,TX_DATA_FRAME)
+            self.assertEqual(bytes(decoded),payload)
+
+    def test_to_chunks(self):
+        data = self.rng.integers(0,4096,1000).astype(np.uint16)
+        chunks,nchunks = to_chunks(TX_DATA_FRAME,data,order=2)
+        self.assertEqual(nchunks,8)
+        self.assertEqual(len(chunks),8)
+        decoded = bytearray()
+        for chunk in chunks:
+            self.assertEqual(len(chunk),RAW_BUF_LEN)
+            frame_type,payload = decode_msg(chunk)
+            self.assertEqual(frame_type,TX_DATA_FRAME)
+            decoded += payload
+        self.assertEqual(bytes(decoded),data.tobytes())
+
+    def test_decode_does_not_mutate(self):
+        frame = encode_msg(bytearray([TX_MSG_FRAME,SER_ESC,1,2]))
+        before = bytearray(frame)
+        self.assertEqual(decode_msg(frame),(TX_MSG_FRAME,bytearray([SER_ESC,1,2])))
+        self.assertEqual(frame,before)
+
+    def test_stream_decoder(self):
+        payloads = [self.rng.integers(0x70,0x80,self.rng.integers(1,256)).astype(np.uint8).tobytes() for i in range(50)]
+        frames = [bytes(encode_msg(bytearray([TX_DATA_FRAME]) + p)) for p in payloads]
+        # a frame cut off by a new START and some noise before the stream lines up
+        stream = bytes([1,2,SER_FRAME_END,SER_FRAME_START,TX_DATA_FRAME,5,6]) + b''.join(frames)
+
+        decoder = FrameDecoder()
+        out = []
+        pos = 0
+        while pos < len(stream):
+            n = int(self.rng.integers(1,700))
+            out += decoder.feed(stream[pos:pos + n])
+            pos += n
+
+        self.assertEqual(len(out),len(payloads))
+        for (frame_type,payload),expected in zip(out,payloads):
+            self.assertEqual(frame_type,TX_DATA_FRAME)
+            self.assertEqual(bytes(payload),expected)
+        self.assertEqual(decoder.errors,1)
+
+    def test_stream_decoder_oversize(self):
+        decoder = FrameDecoder(max_frame_len=20)
+        out = decoder.feed(bytes([SER_FRAME_START]) + bytes(range(1,30)))
+        out += decoder.feed(bytes(encode_msg(bytearray([TX_MSG_FRAME,9]))))
+        self.assertEqual(out,[(TX_MSG_FRAME,bytearray([9]))])
+        self.assertEqual(decoder.errors,1)
+
+    def test_stream_decoder_buffers_unread(self):
+        frame = bytes(encode_msg(bytearray([TX_MSG_FRAME,1,2,3])))
+        decoder = FrameDecoder()
+        # the first half is kept even though nobody looks at the result
+        decoder.feed(frame[:3])
+        self.assertEqual(decoder.feed(frame[3:]),[(TX_MSG_FRAME,bytearray([1,2,3]))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Purpose: runs the host side of each protocol against the bb_sim boards
+    """
+
+import unittest
+
+import sys,os
+import contextlib,io
+import numpy as np
+from serial import Serial
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import bb_sim
+import bb_bench
+import emit
+import bb_ping
+from bb_listener import EchoRecorder
+from bb_emitter import EchoEmitter
+
+
+class TestClass(unittest.TestCase):
+
+    def test_listen_session(self):
+        with bb_sim.SimTeensy() as teensy:
+            recorder = EchoRecorder(Serial(teensy.port))
+            with recorder.session() as session:
+                self.assertTrue(session.connected)
+                for i in range(3):
+                    raw,left,right = session.listen(10)
+                    self.assertEqual(len(raw),20000)
+            recorder.disconnect_serial()
+            self.assertEqual(teensy.listens,3)
+
+    def test_upload_crc(self):
+        chirp = np.random.default_rng(1).integers(0,4096,5000).astype(np.uint16)
+        with bb_sim.SimItsy() as itsy:
+            with contextlib.redirect_stdout(io.StringIO()):
+                emitter = EchoEmitter(Serial(itsy.port))
+                self.assertEqual(emitter.max_chirp_length,65000)
+                self.assertTrue(emitter.upload_chirp(chirp))
+            emitter.disconnect_serial()
+            self.assertTrue(np.array_equal(itsy.chirp,chirp))
+
+    def test_identical_upload_skipped(self):
+        chirp = np.random.default_rng(2).integers(0,4096,5000).astype(np.uint16)
+        with bb_sim.SimItsy() as itsy:
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                emitter = EchoEmitter(Serial(itsy.port))
+                self.assertTrue(emitter.upload_chirp(chirp))
+                self.assertTrue(emitter.upload_chirp(chirp))
+                self.assertEqual(itsy.uploads,1)
+                self.assertIn("ALREADY UPLOADED",out.getvalue())
+
+                other = chirp[::-1].copy()
+                self.assertTrue(emitter.upload_chirp(other))
+                self.assertTrue(emitter.upload_chirp(other,force=True))
+                self.assertEqual(itsy.uploads,3)
+            emitter.disconnect_serial()
+            self.assertTrue(np.array_equal(itsy.chirp,other))
+
+    def test_ping_offsets_are_bounded(self):
+        chirp = np.random.default_rng(3).integers(0,4096,3000).astype(np.uint16)
+        with bb_sim.SimTeensy() as teensy, bb_sim.SimItsy() as itsy:
+            recorder = EchoRecorder(Serial(teensy.port))
+            with contextlib.redirect_stdout(io.StringIO()):
+                emitter = EchoEmitter(Serial(itsy.port))
+                emitter.upload_chirp(chirp)
+                offsets = []
+                with bb_ping.PingCycle(emitter,recorder,5,offset_history=4) as cycle:
+                    for i in range(10):
+                        offsets.append(cycle.ping().emit_offset)
+                    stats = cycle.stats()
+            recorder.disconnect_serial()
+            emitter.disconnect_serial()
+
+        # only the last few are kept, the running stats still cover every ping
+        self.assertTrue(np.array_equal(cycle.emit_offsets,offsets[-4:]))
+        self.assertEqual(stats['cycles'],10)
+        self.assertAlmostEqual(stats['emit_offset_mean'],np.mean(offsets))
+        self.assertAlmostEqual(stats['emit_offset_std'],np.std(offsets))
+        self.assertEqual(stats['emit_offset_min'],min(offsets))
+        self.assertEqual(stats['emit_offset_max'],max(offsets))
+        self.assertAlmostEqual(stats['emit_offset_p50'],np.median(offsets[-4:]))
+
+    def test_framed_upload(self):
+        data = np.arange(1000,dtype=np.uint16)
+        chunks,_ = emit.build_emit_upd(len(data),data)
+        with bb_sim.SimFramedDevice(1000) as device:
+            port = Serial(device.port)
+            port.write(b''.join(bytes(chunk) for chunk in chunks))
+            port.flush()
+            for i in range(100):
+                if device.uploads:
+                    break
+                device.stop_event.wait(0.01)
+            port.close()
+            self.assertEqual(device.uploads,1)
+            self.assertEqual(bytes(device.emit_data),data.tobytes())
+
+    def test_compare(self):
+        base = {'listen': {'rates': {'pings_per_second': 100.0},'latency_ms': {'cycle': {'p50': 4.0,'p99': 6.0}}}}
+        same = {'listen': {'rates': {'pings_per_second': 95.0},'latency_ms': {'cycle': {'p50': 4.2,'p99': 6.5}}}}
+        worse = {'listen': {'rates': {'pings_per_second': 50.0},'latency_ms': {'cycle': {'p50': 8.0,'p99': 6.0}}}}
+        self.assertEqual(bb_bench.compare(same,base,0.2),[])
+        self.assertEqual(len(bb_bench.compare(worse,base,0.2)),2)
+
+
+if __name__ == '__main__':
+    unittest.main()
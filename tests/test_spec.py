@@ -0,0 +1,111 @@
+"""
+Purpose: tests the shared spectrogram helpers in bb_spec
+    """
+
+import unittest
+
+import sys,os
+import threading
+import numpy as np
+import matplotlib.mlab as mlab
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from scipy import signal
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from bb_spec import spec_to_db, process, process_ears, get_spec_engine, SpecView
+
+
+def clamp_loop(spec_tup, fbounds, dB_range):
+    """the per bin clamp plot_spec used to do"""
+    fmin, fmax = fbounds
+    s, f, t = spec_tup
+    lfc = (f >= fmin).argmax()
+    with np.errstate(divide='ignore'):
+        s = 20*np.log10(s)
+    s_cut = s[:][lfc:] - np.amax(s[lfc:])
+    [rows_s, cols_s] = np.shape(s_cut)
+    for col in range(cols_s):
+        for row in range(rows_s):
+            if s_cut[row][col] < -dB_range:
+                s_cut[row][col] = -dB_range
+    return s_cut
+
+
+class TestClass(unittest.TestCase):
+
+    def make_spec(self):
+        rng = np.random.default_rng(1)
+        s = rng.random((257,40))**8
+        s[0,:] = 0
+        f = np.linspace(0,500e3,257)
+        t = np.arange(40)*1e-4
+        return s,f,t
+
+    def test_matches_loop(self):
+        spec_tup = self.make_spec()
+        for dB_range in [10,40,150]:
+            s_cut,f_cut,t = spec_to_db(spec_tup,(30E3,100E3),dB_range)
+            self.assertTrue(np.array_equal(s_cut,clamp_loop(spec_tup,(30E3,100E3),dB_range)))
+
+    def test_cut_and_floor(self):
+        spec_tup = self.make_spec()
+        s_cut,f_cut,t = spec_to_db(spec_tup,(30E3,100E3),40)
+        self.assertTrue(f_cut[0] >= 30E3)
+        self.assertEqual(s_cut.shape,(len(f_cut),40))
+        self.assertEqual(np.amax(s_cut),0)
+        self.assertEqual(np.amin(s_cut),-40)
+
+    def test_input_not_modified(self):
+        spec_tup = self.make_spec()
+        s_before = spec_tup[0].copy()
+        spec_to_db(spec_tup)
+        self.assertTrue(np.array_equal(spec_tup[0],s_before))
+
+    def test_engine_matches_mlab(self):
+        rng = np.random.default_rng(2)
+        for NFFT,noverlap,n in [(512,400,30000),(255,100,1000),(512,400,400)]:
+            spec_settings = (1e6,NFFT,noverlap,signal.windows.hann(NFFT))
+            L = rng.integers(0,1024,n).astype(np.uint16)
+            R = rng.integers(0,1024,n).astype(np.uint16)
+            time_offs = n//10
+            refs = [mlab.specgram(raw[time_offs:]-np.mean(raw),Fs=1e6,NFFT=NFFT,noverlap=noverlap,window=spec_settings[3]) for raw in (L,R)]
+
+            for ours,ref in zip(process_ears(L,R,spec_settings,time_offs),refs):
+                for a,b in zip(ours,ref):
+                    self.assertTrue(np.allclose(a,b))
+            spec_tup,pt_cut,remainder = process(L,spec_settings,time_offs)
+            for a,b in zip(spec_tup,refs[0]):
+                self.assertTrue(np.allclose(a,b))
+            self.assertEqual(len(pt_cut)+len(remainder),n)
+
+    def test_engine_per_thread(self):
+        settings = (1e6,256,200,None,1000)
+        engines = []
+        thread = threading.Thread(target=lambda: engines.append(get_spec_engine(*settings)))
+        thread.start()
+        thread.join()
+        self.assertIs(get_spec_engine(*settings),get_spec_engine(*settings))
+        self.assertIsNot(get_spec_engine(*settings),engines[0])
+
+    def test_view_redraw(self):
+        rng = np.random.default_rng(3)
+        spec_settings = (1e6,512,400,signal.windows.hann(512))
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        view = SpecView(ax,(30E3,100E3),40)
+        for i in range(3):
+            raw = rng.integers(0,1024,8000).astype(np.uint16)
+            spec_tup,_,_ = process(raw,spec_settings,800)
+            view.update(spec_tup)
+            s_cut,f_cut,t = spec_to_db(spec_tup,(30E3,100E3),40)
+            # the image holds the rows up to one past fmax
+            rows = np.searchsorted(f_cut,100E3,side='right') + 1
+            self.assertTrue(np.array_equal(view.image.get_array(),s_cut[:rows]))
+        # only the first ping built the image
+        self.assertEqual(view.rebuilds,1)
+
+
+if __name__ == '__main__':
+    unittest.main()
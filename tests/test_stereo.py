@@ -0,0 +1,86 @@
+"""
+Purpose: tests the two ear StereoCapture against the per ear versions
+    """
+
+import unittest
+
+import sys,os
+import tempfile
+import numpy as np
+from scipy import signal
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from bb_stereo import StereoCapture, split_bursts, load_raw
+from bb_spec import process
+
+
+class TestClass(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.raw = rng.integers(0,1024,2*5000).astype(np.uint16)
+
+    def test_interleaved_view(self):
+        capture = StereoCapture.from_interleaved(self.raw)
+        self.assertTrue(np.shares_memory(capture.data,self.raw))
+        self.assertTrue(np.array_equal(capture.left,self.raw[::2]))
+        self.assertTrue(np.array_equal(capture.right,self.raw[1::2]))
+
+        capture = StereoCapture.from_interleaved(self.raw[:-1],left_first=False)
+        self.assertEqual(len(capture),4999)
+        self.assertTrue(np.array_equal(capture.left,self.raw[1:-1:2]))
+        self.assertTrue(np.array_equal(capture.right,self.raw[:-2:2]))
+
+    def test_matches_per_ear(self):
+        capture = StereoCapture.from_interleaved(self.raw)
+        ears = (self.raw[::2],self.raw[1::2])
+
+        spec_settings = (1e6,256,200,signal.windows.hann(256))
+        s,f,t = capture.spectrogram(spec_settings,time_offs=300)
+        for row,ear in enumerate(ears):
+            spec_tup,_,_ = process(ear,spec_settings,time_offs=300)
+            self.assertTrue(np.allclose(s[row],spec_tup[0]))
+
+        chirp = signal.chirp(np.arange(1000)/1e6,100e3,1e-3,30e3)
+        xcor = capture.correlate(chirp)
+        filtered = capture.bandpass(30e3,100e3)
+        b,a = signal.butter(5,[30e3,100e3],fs=1e6,btype='band')
+        for row,ear in enumerate(ears):
+            balanced = ear - np.mean(ear)
+            self.assertTrue(np.allclose(xcor[row],signal.correlate(balanced,chirp,mode='same')))
+            self.assertTrue(np.allclose(filtered[row],signal.lfilter(b,a,balanced)))
+
+    def test_split_bursts(self):
+        burst = 100
+        for n in (0,2000,2050,2100,2150,2199):
+            raw = self.raw[:n]
+            # ears alternate every burst, the first burst is the left ear
+            left = [x for i,x in enumerate(raw) if i//burst % 2 == 0]
+            right = [x for i,x in enumerate(raw) if i//burst % 2 == 1]
+
+            L,R = split_bursts(raw,burst)
+            self.assertTrue(np.array_equal(L,left))
+            self.assertTrue(np.array_equal(R,right))
+            R,L = split_bursts(raw,burst,left_first=False)
+            self.assertTrue(np.array_equal(L,left))
+
+            capture = StereoCapture.from_bursts(raw,burst)
+            n_ear = min(len(left),len(right))
+            self.assertTrue(np.array_equal(capture.left,left[:n_ear]))
+            self.assertTrue(np.array_equal(capture.right,right[:n_ear]))
+            capture = StereoCapture.from_bursts(raw,burst,left_first=False)
+            self.assertTrue(np.array_equal(capture.right,left[:n_ear]))
+
+    def test_load_raw(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file_name = os.path.join(tmp,'data.bin')
+            with open(file_name,'wb') as f:
+                f.write(self.raw.astype('<u2').tobytes() + b'\x01')
+            self.assertTrue(np.array_equal(load_raw(file_name),self.raw))
+            mapped = load_raw(file_name,mmap=True)
+            self.assertTrue(np.array_equal(mapped,self.raw))
+            del mapped
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Purpose: tests compiling movement keyframes and the .bbtraj cache
+    """
+
+import unittest
+
+import sys,os
+import tempfile
+import yaml
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import bb_trajectory
+from bb_trajectory import compile_trajectory, load_trajectory, column_limits, METHODS
+
+
+class TestClass(unittest.TestCase):
+
+    def setUp(self):
+        self.keys = np.array([[0,0,0,0,0,0,0],
+                              [0,48,0,0,0,0,0],
+                              [0,0,54,0,0,0,-90],
+                              [10,0,0,-68,0,0,0]],dtype=np.int16)
+
+    def test_passes_through_keyframes(self):
+        # 10 steps per keyframe
+        for method in METHODS:
+            angles = compile_trajectory(self.keys,speed=5,rate=50,method=method)
+            self.assertEqual(angles.shape,(40,7))
+            self.assertEqual(angles.dtype,np.int16)
+            self.assertTrue(np.array_equal(angles[::10],self.keys),method)
+
+        linear = compile_trajectory(self.keys,5,50,'linear')
+        self.assertEqual(linear[5,1],24)
+        # looping, the last segment heads back to the first keyframe
+        self.assertEqual(linear[35,0],5)
+
+        once = compile_trajectory(self.keys,5,50,'minjerk',loop=False)
+        self.assertEqual(len(once),31)
+        self.assertTrue(np.array_equal(once[-1],self.keys[-1]))
+
+    def test_clamps(self):
+        lo = np.full(7,-60)
+        hi = np.full(7,40)
+        angles = compile_trajectory(self.keys,5,50,'cubic',lo,hi)
+        self.assertEqual(angles.max(),40)
+        self.assertEqual(angles.min(),-60)
+        with self.assertRaises(ValueError):
+            compile_trajectory(self.keys,5,50,'quintic')
+
+    def test_column_limits(self):
+        lo = np.array([-10,-20,-30,-40,-50,-60,-70])
+        hi = np.array([10,20,30,40,50,60,70])
+        # motor 5 plays column 6 like the right ear, column 5 is played by nobody
+        col_lo,col_hi = column_limits(lo,hi,(0,1,2,3,4,6,6))
+        self.assertEqual(col_lo[6],-60)
+        self.assertEqual(col_hi[6],60)
+        self.assertEqual(col_lo[5],np.iinfo(np.int16).min)
+        self.assertTrue(np.array_equal(col_lo[:5],lo[:5]))
+        same_lo,same_hi = column_limits(lo,hi,range(7))
+        self.assertTrue(np.array_equal(same_lo,lo) and np.array_equal(same_hi,hi))
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            yaml_path = os.path.join(tmp,'TEST_PM.yaml')
+            with open(yaml_path,'w') as f:
+                yaml.dump({'pinna_movements': {'speed': 5,'angles': self.keys.tolist()}},f)
+
+            first,rate = load_trajectory(yaml_path,50,'linear')
+            self.assertTrue(os.path.exists(bb_trajectory.cache_path(yaml_path)))
+            cached,_ = load_trajectory(yaml_path,50,'linear')
+            self.assertIsInstance(cached,np.memmap)
+            self.assertTrue(np.array_equal(first,cached))
+            del cached
+
+            # a cut short cache is rebuilt instead of mapped
+            with open(bb_trajectory.cache_path(yaml_path),'r+b') as f:
+                f.truncate(bb_trajectory.HEADER_DTYPE.itemsize + 10)
+            rebuilt,_ = load_trajectory(yaml_path,50,'linear')
+            self.assertNotIsInstance(rebuilt,np.memmap)
+            self.assertTrue(np.array_equal(first,rebuilt))
+
+            # other settings or keyframes rebuild it
+            other,_ = load_trajectory(yaml_path,50,'cubic')
+            self.assertNotIsInstance(other,np.memmap)
+            with open(yaml_path,'w') as f:
+                yaml.dump({'pinna_movements': {'speed': 5,'angles': (self.keys*0).tolist()}},f)
+            zeros,_ = load_trajectory(yaml_path,50,'cubic')
+            self.assertNotIsInstance(zeros,np.memmap)
+            self.assertFalse(zeros.any())
+
+
+if __name__ == '__main__':
+    unittest.main()